@@ -0,0 +1,157 @@
+"""
+Log streaming throughput in lines/sec: the old polling thread that calls
+asyncio.run() per line and sends to every client in turn, versus the
+event-loop tailer with the batched per-client fan-out.
+
+usage: python benchmarks/bench_log_tailer.py [--lines 20000] [--clients 100]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants.logLock import log_lock  # noqa: E402
+from constants.websocketEventManager import register_websocket  # noqa: E402
+from utils.formatLogLine import format_log_line  # noqa: E402
+from workers.tailLogsFile import tail_log_file  # noqa: E402
+
+LINE = "100%|##########| 20/20 [00:03<00:00,  6.12it/s] sampling step done"
+
+
+class FakeWebSocket:
+    """Stands in for a browser tab, counts the log lines it receives"""
+
+    def __init__(self, delay=0):
+        self.lines = 0
+        self.delay = delay
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        # every formatted line carries exactly one timestamp span
+        self.lines += text.count("log-timestamp")
+
+
+def write_lines(log_file, lines, batch=500):
+    with open(log_file, "a") as f:
+        for start in range(0, lines, batch):
+            f.write(
+                "".join(
+                    f"{LINE} {i}\n" for i in range(start, min(lines, start + batch))
+                )
+            )
+            f.flush()
+            time.sleep(0.001)
+
+
+async def legacy_broadcast(clients, message):
+    """The previous broadcaster, one serialization and one awaited send per client"""
+    for websocket in clients:
+        await websocket.send_text(json.dumps(message))
+
+
+def legacy_tail(log_file, clients, stop):
+    """The previous thread based tailer, per-line asyncio.run()"""
+    log_buffer = []
+    with open(log_file, "r", encoding="utf-8") as file:
+        current_position = 0
+        while not stop.is_set():
+            if os.path.getsize(log_file) < current_position:
+                current_position = 0
+            file.seek(current_position)
+            new_lines = file.readlines()
+            if new_lines:
+                current_position = file.tell()
+                for line in new_lines:
+                    stripped_line = line.strip()
+                    if stripped_line:
+                        with log_lock:
+                            log_buffer.append(stripped_line)
+                            if len(log_buffer) > 500:
+                                log_buffer.pop(0)
+                        asyncio.run(
+                            legacy_broadcast(
+                                clients,
+                                {
+                                    "type": "new_log_line",
+                                    "line": format_log_line(stripped_line, ws=True),
+                                },
+                            )
+                        )
+            else:
+                time.sleep(0.1)
+
+
+def wait_for(clients, lines, timeout=300):
+    deadline = time.perf_counter() + timeout
+    while min(c.lines for c in clients) < lines:
+        if time.perf_counter() > deadline:
+            raise TimeoutError("tailer did not keep up")
+        time.sleep(0.005)
+
+
+def bench_legacy(log_file, lines, clients, connected):
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=legacy_tail, args=(log_file, connected, stop), daemon=True
+    )
+    thread.start()
+    start = time.perf_counter()
+    write_lines(log_file, lines)
+    wait_for(clients, lines)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    thread.join()
+    return elapsed
+
+
+def bench_event_loop(log_file, lines, clients, connected):
+    result = {}
+
+    async def run():
+        for client in connected:
+            register_websocket(client)
+        task = asyncio.create_task(tail_log_file(log_file))
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        writer = asyncio.to_thread(write_lines, log_file, lines)
+        waiter = asyncio.to_thread(wait_for, clients, lines)
+        await asyncio.gather(writer, waiter)
+        result["elapsed"] = time.perf_counter() - start
+        task.cancel()
+
+    asyncio.run(run())
+    return result["elapsed"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument(
+        "--slow-clients", type=int, default=0, help="tabs taking 20ms per frame"
+    )
+    args = parser.parse_args()
+
+    for label, bench in (("legacy", bench_legacy), ("event loop", bench_event_loop)):
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_file = os.path.join(log_dir, "comfyui.log")
+            open(log_file, "w").close()
+
+            clients = [FakeWebSocket() for _ in range(args.clients)]
+            slow_clients = [FakeWebSocket(0.02) for _ in range(args.slow_clients)]
+
+            # throughput is measured on the healthy clients only
+            elapsed = bench(log_file, args.lines, clients, clients + slow_clients)
+            print(f"{label:<12} {args.lines / elapsed:12,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Compare the old in-memory ZIP_DEFLATED archive with the streaming,
+media-aware archive on a synthetic ComfyUI output tree.
+
+usage: python benchmarks/bench_output_zip.py [--images 200] [--videos 4]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.outputArchive import stream_output_zip  # noqa: E402
+
+
+def create_output_zip(output_dir):
+    """The previous implementation, kept here as the baseline"""
+    memory_file = io.BytesIO()
+
+    with zipfile.ZipFile(memory_file, "w", zipfile.ZIP_DEFLATED) as zf:
+        for root, _, files in os.walk(output_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, output_dir)
+                zf.write(file_path, arcname)
+
+    memory_file.seek(0)
+    return memory_file
+
+
+def build_tree(output_dir, images, videos, workflows):
+    """Random bytes stand in for already-compressed media, json/txt/latents compress well"""
+    rng = random.Random(0)
+    os.makedirs(os.path.join(output_dir, "video"), exist_ok=True)
+
+    for i in range(images):
+        with open(os.path.join(output_dir, f"ComfyUI_{i:05d}_.png"), "wb") as f:
+            f.write(os.urandom(rng.randint(800_000, 1_600_000)))
+
+    for i in range(videos):
+        with open(os.path.join(output_dir, "video", f"wan_{i:05d}.mp4"), "wb") as f:
+            f.write(os.urandom(40 * 1024 * 1024))
+
+    for i in range(workflows):
+        workflow = {
+            str(n): {
+                "class_type": rng.choice(["KSampler", "VAEDecode", "CLIPTextEncode"]),
+                "inputs": {"seed": rng.randint(0, 2**32), "steps": 20, "cfg": 7.0},
+            }
+            for n in range(200)
+        }
+        with open(os.path.join(output_dir, f"workflow_{i:05d}.json"), "w") as f:
+            json.dump(workflow, f, indent=2)
+        with open(os.path.join(output_dir, f"prompt_{i:05d}.txt"), "w") as f:
+            f.write("a photo of a cat, masterpiece, best quality\n" * 2000)
+
+    # latents are fp16 noise with plenty of repeated exponent bytes
+    latent_table = bytes(b"\x00\x3c\x3b\xbc"[i & 3] for i in range(256))
+    for i in range(workflows // 4):
+        with open(os.path.join(output_dir, f"latent_{i:05d}.latent"), "wb") as f:
+            f.write(os.urandom(2_000_000).translate(latent_table))
+
+
+def measure(label, fn):
+    start = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed:8.2f} s  {size / 1024 / 1024:9.1f} MiB")
+    return elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--videos", type=int, default=4)
+    parser.add_argument("--workflows", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        print("Building synthetic output tree...")
+        build_tree(output_dir, args.images, args.videos, args.workflows)
+
+        baseline = measure(
+            "baseline", lambda: len(create_output_zip(output_dir).getvalue())
+        )
+        streaming = measure(
+            "streaming", lambda: sum(len(c) for c in stream_output_zip(output_dir))
+        )
+
+        print(
+            f"speedup {baseline[0] / streaming[0]:.2f}x, "
+            f"size {100 * streaming[1] / baseline[1]:.1f}% of baseline"
+        )
+
+
+if __name__ == "__main__":
+    main()
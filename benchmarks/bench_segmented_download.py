@@ -0,0 +1,183 @@
+"""
+Compare the native segmented downloader with aria2c and a single plain
+request against a local range-capable HTTP server. Each connection is
+throttled like a CDN edge, so more segments means more throughput.
+
+usage: python benchmarks/bench_segmented_download.py [--size 256] [--per-connection 16]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.segmentedDownload import close_http_session, download_url  # noqa: E402
+
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+def make_handler(path, per_connection):
+    size = os.path.getsize(path)
+
+    class RangeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            start, end = 0, size - 1
+            match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2) or end), end)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", '"bench"')
+            self.end_headers()
+
+            # per connection rate limit, 64KiB at a time
+            block = 64 * 1024
+            delay = block / per_connection
+            with open(path, "rb") as f:
+                f.seek(start)
+                left = end - start + 1
+                try:
+                    while left > 0:
+                        data = f.read(min(block, left))
+                        self.wfile.write(data)
+                        left -= len(data)
+                        time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+    return RangeHandler
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def single_request(url, out_dir):
+    path = os.path.join(out_dir, "model.bin")
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            with open(path, "wb") as f:
+                async for chunk in response.content.iter_chunked(1024 * 1024):
+                    f.write(chunk)
+    return path
+
+
+async def segmented(url, out_dir):
+    try:
+        return await download_url(url, out_dir, "model.bin")
+    finally:
+        await close_http_session()
+
+
+def aria2c(url, out_dir):
+    subprocess.run(
+        [
+            "aria2c",
+            "-x",
+            "16",
+            "-s",
+            "16",
+            "-k",
+            "1M",
+            "--file-allocation=none",
+            "--console-log-level=error",
+            "--summary-interval=0",
+            "-d",
+            out_dir,
+            "-o",
+            "model.bin",
+            url,
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return os.path.join(out_dir, "model.bin")
+
+
+def run(name, fn, expected, size):
+    out_dir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        path = fn(out_dir)
+        elapsed = time.perf_counter() - start
+        ok = sha256(path) == expected
+        print(
+            f"{name:<12} {elapsed:7.2f}s {size / elapsed / 1024 / 1024:8.1f} MiB/s"
+            f"  {'ok' if ok else 'CORRUPT'}"
+        )
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=256, help="file size in MiB")
+    parser.add_argument(
+        "--per-connection", type=float, default=16, help="MiB/s per connection"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "model.bin")
+        with open(source, "wb") as f:
+            for _ in range(args.size):
+                f.write(os.urandom(1024 * 1024))
+        expected = sha256(source)
+        size = os.path.getsize(source)
+
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            make_handler(source, args.per_connection * 1024 * 1024),
+        )
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/model.bin"
+        print(f"{args.size} MiB, {args.per_connection:g} MiB/s per connection")
+
+        run(
+            "single",
+            lambda out: asyncio.run(single_request(url, out)),
+            expected,
+            size,
+        )
+        run(
+            "segmented",
+            lambda out: asyncio.run(segmented(url, out)),
+            expected,
+            size,
+        )
+        if shutil.which("aria2c"):
+            run("aria2c", lambda out: aria2c(url, out), expected, size)
+        else:
+            print("aria2c       not installed, skipped")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
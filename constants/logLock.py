@@ -1,8 +1,67 @@
 import concurrent.futures
 import threading
+import time
+
+
+class LogRingBuffer:
+    """
+    Fixed-capacity log buffer, oldest records are overwritten in O(1).
+
+    records are stored already formatted (see utils.formatLogLine.LogRecord),
+    every record gets a monotonically increasing sequence number so clients can
+    ask for just the lines they missed. The epoch changes whenever the viewer
+    restarts, sequence numbers from another epoch mean nothing.
+    """
+
+    def __init__(self, capacity=500):
+        self.capacity = capacity
+        self.records = [None] * capacity
+        self.next_seq = 1
+        self.epoch = f"{time.time_ns():x}"
+
+    @property
+    def first_seq(self):
+        return max(1, self.next_seq - self.capacity)
+
+    @property
+    def last_seq(self):
+        return self.next_seq - 1
+
+    def __len__(self):
+        return self.next_seq - self.first_seq
+
+    @property
+    def etag(self):
+        """Changes whenever a record is added or the viewer restarts"""
+        return f'"{self.epoch}-{self.last_seq}"'
+
+    def append(self, record):
+        """Store a record and return its sequence number"""
+        seq = self.next_seq
+        self.records[seq % self.capacity] = record
+        self.next_seq += 1
+        return seq
+
+    def since(self, seq):
+        """Return [(seq, record)] newer than seq, oldest first"""
+        start = max(seq + 1, self.first_seq)
+        return [
+            (s, self.records[s % self.capacity]) for s in range(start, self.next_seq)
+        ]
+
+    def has_gap(self, seq, epoch=None):
+        """True when lines after seq are no longer (or never were) in this buffer"""
+        if epoch is not None and epoch != self.epoch:
+            return True
+        return seq + 1 < self.first_seq or seq > self.last_seq
+
+    def __iter__(self):
+        for _, record in self.since(0):
+            yield record
+
 
 # log buffer aka. like queue first in first out and threding lock to prevent race condition.
-log_buffer = []
+log_buffer = LogRingBuffer(500)
 log_lock = threading.Lock()
 
 # idk why have this
@@ -1,31 +1,181 @@
 import asyncio
 import json
+from collections import deque
 from typing import List
 
-from websocket import WebSocket
+from fastapi import WebSocket
+
+# frames waiting per client before we start dropping log lines for it
+CLIENT_QUEUE_SIZE = 256
+# log lines are coalesced into one frame every few milliseconds
+FLUSH_INTERVAL = 0.02
+MAX_BATCH_LINES = 500
+# a client that can't take a frame within this long is considered gone
+SEND_TIMEOUT = 10
+# frames that only carry the latest state of one thing, by the data field
+# naming it. A newer one replaces the queued one instead of piling up
+LATEST_STATE_FRAMES = {
+    "download_progress": "id",
+    "download_job": "id",
+    "model_readiness": "url",
+    "model_downloads": None,
+}
+
+
+class WebSocketClient:
+    """
+    One connected browser tab with its own bounded send queue.
+
+    a sender task drains the queue so a slow tab only delays itself. When the
+    queue is full the oldest log frames are dropped and the client is told
+    how many lines it missed. State frames with a key keep only the newest
+    one queued.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # (frame, number of log lines in it, 0 for messages that must not be
+        # dropped, key of a state frame or None)
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.dropped_lines = 0
+        self.task = asyncio.create_task(self._sender())
+
+    def push(self, frame: str, log_lines: int = 0, key: tuple = None):
+        if key is not None:
+            for i, (_, _, queued_key) in enumerate(self.queue):
+                if queued_key == key:
+                    # sent at the back, after whatever was published before it
+                    del self.queue[i]
+                    break
+
+        if len(self.queue) >= CLIENT_QUEUE_SIZE:
+            for i, (_, lines, _) in enumerate(self.queue):
+                if lines:
+                    del self.queue[i]
+                    self.dropped_lines += lines
+                    break
+            else:
+                if log_lines:
+                    self.dropped_lines += log_lines
+                    return
+
+        self.queue.append((frame, log_lines, key))
+        self.ready.set()
+
+    async def _send(self, frame: str):
+        await asyncio.wait_for(self.websocket.send_text(frame), SEND_TIMEOUT)
+
+    async def _sender(self):
+        try:
+            while True:
+                while not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+
+                if self.dropped_lines:
+                    dropped, self.dropped_lines = self.dropped_lines, 0
+                    await self._send(
+                        json.dumps({"type": "logs_dropped", "count": dropped})
+                    )
+
+                frame, _, _ = self.queue.popleft()
+                await self._send(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # disconnected or too slow, stop sending to it
+            if self in websocket_connections:
+                websocket_connections.remove(self)
+
+    def close(self):
+        self.task.cancel()
+
+
+# list of connected clients
+websocket_connections: List[WebSocketClient] = []
+
+# formatted log lines waiting for the next flush
+_pending_lines = []
+_pending_seq = 0
+_flush_handle = None
+
+
+def register_websocket(websocket: WebSocket, backlog: dict = None) -> WebSocketClient:
+    """
+    Start fanning out messages to an accepted websocket.
+
+    backlog is sent first, pending lines are flushed before so the client
+    sees every sequence number exactly once and in order.
+    """
+    flush_log_lines()
+    client = WebSocketClient(websocket)
+    if backlog is not None:
+        client.push(json.dumps({"type": "log_batch", **backlog}))
+    websocket_connections.append(client)
+    return client
+
+
+def unregister_websocket(client: WebSocketClient):
+    client.close()
+    if client in websocket_connections:
+        websocket_connections.remove(client)
+
+
+def _fan_out(frame: str, log_lines: int = 0, key: tuple = None):
+    for client in list(websocket_connections):
+        client.push(frame, log_lines, key)
+
+
+def flush_log_lines():
+    """Send the coalesced log lines as one frame, serialized once for everyone"""
+    global _flush_handle
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+    if not _pending_lines:
+        return
+
+    lines = _pending_lines[:]
+    _pending_lines.clear()
+    if websocket_connections:
+        _fan_out(
+            json.dumps({"type": "log_batch", "lines": lines, "seq": _pending_seq}),
+            len(lines),
+        )
+
+
+def publish_log_line(line: str, seq: int):
+    """Queue a formatted log line, it goes out with the next batch"""
+    global _flush_handle, _pending_seq
+    _pending_lines.append(line)
+    _pending_seq = seq
+    if len(_pending_lines) >= MAX_BATCH_LINES:
+        flush_log_lines()
+    elif _flush_handle is None:
+        _flush_handle = asyncio.get_running_loop().call_later(
+            FLUSH_INTERVAL, flush_log_lines
+        )
+
+
+def publish_message(message: dict):
+    """Queue a message for all connected WebSocket clients, usable from sync code"""
+    # keep ordering with log lines that are still waiting for a flush
+    flush_log_lines()
+    if websocket_connections:
+        _fan_out(json.dumps(message), key=_state_key(message))
+
+
+def _state_key(message: dict):
+    if message.get("type") not in LATEST_STATE_FRAMES:
+        return None
+    field = LATEST_STATE_FRAMES[message["type"]]
+    if field is None:
+        return (message["type"],)
+    return (message["type"], (message.get("data") or {}).get(field))
 
-# list of websockets instance
-websocket_connections: List[WebSocket] = []
 
 # send msg to websockets client (async)
 async def broadcast_to_websockets(message: dict):
     """Send a message to all connected WebSocket clients"""
-    if websocket_connections:
-        disconnected = []
-        for websocket in websocket_connections:
-            try:
-                await websocket.send_text(json.dumps(message))
-            except:
-                disconnected.append(websocket)
-
-        # Remove disconnected clients
-        for ws in disconnected:
-            websocket_connections.remove(ws)
-
-# send msg to websocksts client (sync way)
-def sync_broadcast_to_websockets(message: dict):
-    """Synchronous wrapper for broadcasting to websockets from non-async context"""
-    try:
-        asyncio.run(broadcast_to_websockets(message))
-    except Exception as e:
-        print(f"Error broadcasting to websockets: {e}")
+    publish_message(message)
@@ -1,107 +1,257 @@
 import os
 import json
+import argparse
 import asyncio
-import aiohttp
 from pathlib import Path
 import logging
 import sys
 from typing import List, Dict, Any
 
-# Prevent duplicate logging
-logging.getLogger().handlers = []
-
-# Set up logging to file only, since stdout is already captured by tee in start.sh
-log_file_path = "/workspace/logs/comfyui.log"
-file_handler = logging.FileHandler(log_file_path, encoding="utf-8")
-file_handler.setFormatter(
-    logging.Formatter("%(message)s")
+from utils.aria2Rpc import Aria2Download, Aria2Rpc
+from utils.downloadProgress import (
+    ProgressTracker,
+    describe_progress,
+    format_bytes,
+    run_download_process,
+)
+from utils.downloadScheduler import MAX_CONCURRENT, DownloadScheduler
+from utils.hashManifest import hash_manifest, sha256_file
+from utils.modelInventory import model_inventory
+from utils.modelsConfig import DEFAULT_CONFIG, models_config
+from utils.modelsLock import (
+    LOCK_FILE,
+    build_plan,
+    free_space,
+    load_lock,
+    space_needed,
+    write_lock,
+)
+from utils.stagedDownload import collect_orphan_partials, finalize, partial_path
+from utils.segmentedDownload import (
+    STATE_SUFFIX,
+    DownloadError,
+    close_http_session,
+    download_url,
+    native_backend_enabled,
+    probe_remote,
 )
 
+log_file_path = "/workspace/logs/comfyui.log"
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
 
-# Also log to stdout for visibility
-stdout_handler = logging.StreamHandler(sys.stdout)
-stdout_handler.setFormatter(
-    logging.Formatter("%(message)s")
-)
-logger.addHandler(stdout_handler)
 
-# Global semaphore to limit concurrent downloads
-download_semaphore = asyncio.Semaphore(5)
+def setup_logging() -> None:
+    """
+    Log to comfyui.log and stdout, nothing is set up on import.
 
+    called by the CLI, and by the viewer before it starts the boot downloads
+    """
+    if logger.handlers:
+        return
 
-async def download_file(
-    url: str, output_path: Path, semaphore: asyncio.Semaphore
+    # Set up logging to file only, since stdout is already captured by tee in start.sh
+    file_handler = logging.FileHandler(log_file_path, encoding="utf-8")
+    file_handler.setFormatter(
+        logging.Formatter("%(message)s")
+    )
+    logger.setLevel(logging.INFO)
+    logger.addHandler(file_handler)
+
+    # Also log to stdout for visibility
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(
+        logging.Formatter("%(message)s")
+    )
+    logger.addHandler(stdout_handler)
+
+    # Prevent duplicate logging through the root logger's handlers
+    logger.propagate = False
+
+# how often progress of each download is written to the log
+PROGRESS_LOG_INTERVAL = 10
+# HEAD requests in flight while sizing the downloads
+SIZING_CONCURRENCY = 16
+
+
+async def existing_download_ok(
+    path: Path, url: str, inventory=model_inventory, locked: Dict = None
 ) -> bool:
-    """Download a file using aria2c with optimized settings for faster downloads (async)"""
-    async with semaphore:
-        filename = url.split("/")[-1]
-        logger.info(f"Starting download of {filename} from {url}")
-
-        cmd = [
-            "aria2c",
-            "--console-log-level=warn",  # Reduce verbosity to warnings only
-            "-c",  # Continue downloading if partial file exists
-            "-x",
-            "4",  # Increase concurrent connections to 4
-            "-s",
-            "4",  # Split file into 4 parts
-            "-k",
-            "1M",  # Minimum split size
-            "--file-allocation=none",  # Disable file allocation for faster start
-            "--optimize-concurrent-downloads=true",  # Optimize concurrent downloads
-            "--max-connection-per-server=16",  # Maximum connections per server
-            "--min-split-size=1M",  # Minimum split size
-            "--max-tries=5",  # Maximum retries
-            "--retry-wait=10",  # Wait between retries
-            "--connect-timeout=30",  # Connection timeout
-            "--timeout=600",  # Timeout for stalled downloads
-            "--summary-interval=30",  # Show summary every 30 seconds
-            url,
-            "-d",
-            str(output_path),
-            "-o",
-            filename,  # Specify output filename
-        ]
-
-        try:
-            logger.info(f"Running download command for {filename}")
-            # Use async subprocess for non-blocking execution
-            process = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
+    """
+    Whether a model already on disk is complete.
+
+    files in the hash manifest are trusted while size and mtime match, others
+    are checked once against the size and sha256 the server publishes. With a
+    lockfile entry the size and sha256 come from it, without a request.
+    """
+    # the inventory answers from one scan of the models tree, no stat per url
+    if inventory.file(path) is None:
+        return False
+    for sidecar in (STATE_SUFFIX, ".aria2"):
+        if inventory.file(path.with_name(path.name + sidecar)) is not None:
+            logger.info(f"{path.name} is an unfinished download, resuming it")
+            return False
+    entry = hash_manifest.lookup(path)
+    if locked and locked.get("size") is not None:
+        size, sha256 = locked["size"], locked.get("sha256")
+    elif entry:
+        return True
+    else:
+        size, sha256 = await probe_remote(url)
+
+    if size is not None and path.stat().st_size != size:
+        logger.warning(
+            f"{path.name} is {path.stat().st_size} bytes, expected {size}, downloading it again"
+        )
+        return False
+    if entry and (not sha256 or entry["sha256"] == sha256):
+        return True
+    if sha256:
+        logger.info(f"Verifying {path.name} against its published sha256")
+        digest = await asyncio.to_thread(sha256_file, path)
+        if digest != sha256:
+            logger.warning(f"{path.name} doesn't match its sha256, downloading it again")
+            return False
+    hash_manifest.record(path, sha256, verified=bool(sha256))
+    return True
 
-            stdout, stderr = await process.communicate()
 
-            if process.returncode == 0:
+async def download_file(
+    url: str,
+    output_path: Path,
+    splits: int = 4,
+    tracker: ProgressTracker = None,
+    sha256: str = None,
+) -> bool:
+    """
+    Download a file using aria2c with optimized settings for faster downloads (async)
+
+    splits is the number of connections the scheduler gave this file.
+    """
+    filename = url.split("/")[-1]
+    logger.info(f"Starting download of {filename} from {url}")
+    # aria2c writes to a .partial that is renamed once the download checks out
+    final_path = output_path / filename
+    partial = partial_path(final_path)
+    # the native engine checks the hash itself, aria2c is handed the expected one
+    if sha256 is None and not native_backend_enabled():
+        _, sha256 = await probe_remote(url)
+
+    cmd = [
+        "aria2c",
+        "--console-log-level=warn",  # Reduce verbosity to warnings only
+        "-c",  # Continue downloading if partial file exists
+        "-x",
+        str(splits),  # Concurrent connections, sized by the scheduler
+        "-s",
+        str(splits),  # Split file into as many parts
+        "-k",
+        "1M",  # Minimum split size
+        "--file-allocation=none",  # Disable file allocation for faster start
+        "--optimize-concurrent-downloads=true",  # Optimize concurrent downloads
+        "--max-connection-per-server=16",  # Maximum connections per server
+        "--min-split-size=1M",  # Minimum split size
+        "--max-tries=5",  # Maximum retries
+        "--retry-wait=10",  # Wait between retries
+        "--connect-timeout=30",  # Connection timeout
+        "--timeout=600",  # Timeout for stalled downloads
+        "--summary-interval=0",  # Progress is parsed from the readout instead
+        "--show-console-readout=true",  # One readout line per second
+        url,
+        "-d",
+        os.path.dirname(partial),
+        "-o",
+        os.path.basename(partial),  # Specify output filename
+    ]
+    if sha256:
+        # aria2 hashes the finished file in a second full read, segments land
+        # out of order so it can't hash on the fly like the native engine
+        cmd.insert(1, f"--checksum=sha-256={sha256}")
+
+    try:
+        logger.info(f"Running download command for {filename}")
+        # Stream the output so progress and stalls show up in the log while it runs
+        tracker = tracker or download_tracker(filename)
+        if native_backend_enabled():
+            try:
+                await download_url(
+                    url,
+                    output_path,
+                    filename,
+                    tracker=tracker,
+                    max_segments=splits,
+                    sha256=sha256,
+                )
+            except DownloadError as e:
+                logger.error(f"Failed to download {filename}: {e}")
+                return False
+            logger.info(f"Successfully downloaded {filename}")
+            return True
+
+        # share the viewer's aria2c daemon when it is up, one process per file otherwise
+        rpc = Aria2Rpc.from_state_file()
+        if rpc is not None and await rpc.ping():
+            options = {"split": str(splits), "max-connection-per-server": str(splits)}
+            if sha256:
+                options["checksum"] = f"sha-256={sha256}"
+            download = Aria2Download(
+                rpc,
+                url,
+                os.path.dirname(partial),
+                os.path.basename(partial),
+                options,
+            )
+            success, message = await download.run(tracker)
+            if success:
+                await asyncio.to_thread(finalize, partial, final_path)
+                hash_manifest.record(final_path, sha256, verified=bool(sha256))
                 logger.info(f"Successfully downloaded {filename}")
-                return True
             else:
-                error_msg = stderr.decode("utf-8") if stderr else stdout.decode()
-                logger.error(f"Failed to download {filename}: {error_msg}")
-                return False
-        except Exception as e:
-            logger.error(f"Unexpected error while downloading {url}: {e}")
+                logger.error(f"Failed to download {filename}: {message}")
+            return success
+
+        returncode, stdout, stderr = await run_download_process(
+            cmd, "aria2c", tracker
+        )
+
+        if returncode == 0:
+            await asyncio.to_thread(finalize, partial, final_path)
+            hash_manifest.record(final_path, sha256, verified=bool(sha256))
+            logger.info(f"Successfully downloaded {filename}")
+            return True
+        else:
+            error_msg = stderr.decode("utf-8") if stderr else stdout.decode()
+            logger.error(f"Failed to download {filename}: {error_msg}")
             return False
+    except Exception as e:
+        logger.error(f"Unexpected error while downloading {url}: {e}")
+        return False
+
+
+def download_tracker(filename: str) -> ProgressTracker:
+    """Progress of one download, logged every PROGRESS_LOG_INTERVAL"""
+    return ProgressTracker(
+        on_update=lambda progress: logger.info(
+            f"{filename}: {describe_progress(progress)}"
+        ),
+        on_stall=lambda progress, seconds: logger.warning(
+            f"{filename}: no data received for {seconds:.0f}s, download stalled"
+        ),
+        interval=PROGRESS_LOG_INTERVAL,
+    )
 
 
 async def get_config_async(config_path: str) -> Dict[str, Any]:
-    """Load configuration from file or URL (async)"""
+    """Load configuration from file or URL (async), through the shared config cache"""
     try:
         # Check if it's a URL
         if config_path.startswith(("http://", "https://")):
-            async with aiohttp.ClientSession() as session:
-                async with session.get(config_path) as response:
-                    response.raise_for_status()
-                    # Get text content and parse as JSON manually to handle GitHub's text/plain mimetype
-                    text_content = await response.text()
-                    return json.loads(text_content)
+            config = await models_config.fetch(config_path, attempts=3)
         else:
             # Load from local file
-            with open(config_path, "r") as f:
-                return json.load(f)
+            config = models_config.load_local(config_path)
+        if config is None:
+            logger.error(f"Failed to load config from {config_path}")
+        return config
     except Exception as e:
         logger.error(f"Failed to load config from {config_path}: {e}")
         return None
@@ -133,9 +283,13 @@ def ensure_directories(base_path: Path) -> None:
 
 
 async def download_category_models(
-    category: str, urls: List[str], base_path: Path, force_download: bool = False
+    category: str,
+    urls: List[str],
+    base_path: Path,
+    force_download: bool = False,
+    lock: Dict = None,
 ):
-    """Download all models in a category concurrently"""
+    """Models in a category that still need downloading, as (url, directory) pairs"""
     if not isinstance(urls, list):
         logger.warning(f"Skipping '{category}' as it's not a list of URLs")
         return []
@@ -150,36 +304,58 @@ async def download_category_models(
         # Extract filename from URL
         filename = url.split("/")[-1]
 
-        # Skip if file exists and force_download is False
-        if (category_path / filename).exists() and not force_download:
+        # Skip if file exists, is complete and force_download is False
+        if not force_download and await existing_download_ok(
+            category_path / filename, url, locked=(lock or {}).get(url)
+        ):
             logger.info(f"Skipping {filename}, file already exists")
             continue
 
         logger.info(f"Queuing download: {filename} to {category_path}")
-        task = download_file(url, category_path, download_semaphore)
-        download_tasks.append((task, filename))
+        download_tasks.append((url, category_path))
 
     if not download_tasks:
         logger.info(f"No new models to download in category: {category}")
-        return []
 
-    logger.info(
-        f"Starting {len(download_tasks)} concurrent downloads for category: {category}"
-    )
+    return download_tasks
 
-    # Execute downloads concurrently with progress tracking
-    
-    tasks = []
-    
-    for i, (task, filename) in enumerate(download_tasks):
-        t = asyncio.create_task(
-            track_download_progress(
-                task, filename, i + 1, len(download_tasks), category
-            )
+
+async def size_downloads(urls: List[str], lock: Dict = None) -> List[tuple]:
+    """(size, sha256) of every url, from the lockfile or parallel HEAD requests"""
+    semaphore = asyncio.Semaphore(SIZING_CONCURRENCY)
+
+    async def probe(url):
+        locked = (lock or {}).get(url)
+        if locked:
+            return locked["size"], locked.get("sha256")
+        async with semaphore:
+            return await probe_remote(url)
+
+    return await asyncio.gather(*(probe(url) for url in urls))
+
+
+def scheduled_download(
+    url: str,
+    directory: Path,
+    category: str,
+    current: int,
+    total: int,
+    tracker: ProgressTracker,
+    sha256: str = None,
+):
+    """start callback for the scheduler, it picks the number of splits at start time"""
+    filename = url.split("/")[-1]
+
+    def start(splits):
+        return track_download_progress(
+            download_file(url, directory, splits, tracker, sha256),
+            filename,
+            current,
+            total,
+            category,
         )
-        tasks.append(t)
-        
-    return tasks
+
+    return start
 
 
 async def track_download_progress(
@@ -204,17 +380,27 @@ async def track_download_progress(
         return False
 
 
-async def main():
-    """Main async function to download models concurrently"""
+async def prepare_downloads(lock_path: str = LOCK_FILE, on_change=None):
+    """
+    Scheduler with every model of the config that still needs downloading.
+
+    None when there is nothing to do or it shouldn't run. Shared by main()
+    and the viewer, which runs the boot downloads while ComfyUI starts.
+    """
     # Environment variables
     config_path = os.getenv("MODELS_CONFIG_URL", "/workspace/models_config.json")
     skip_download = os.getenv("SKIP_MODEL_DOWNLOAD", "").lower() == "true"
     force_download = os.getenv("FORCE_MODEL_DOWNLOAD", "").lower() == "true"
 
+    # Partials nobody touched for a week belong to downloads that will never finish
+    freed = collect_orphan_partials()
+    if freed:
+        logger.info(f"Removed orphaned partial downloads, freed {freed / 1024**3:.1f} GiB")
+
     # Skip if explicitly told to skip
     if skip_download:
         logger.info("Model download skipped due to SKIP_MODEL_DOWNLOAD=true")
-        return
+        return None
 
     # Check if ComfyUI is fully set up
     comfyui_path = "/workspace/ComfyUI"
@@ -222,7 +408,7 @@ async def main():
         logger.info(
             "ComfyUI main.py not found. Skipping model downloads until ComfyUI is installed."
         )
-        return
+        return None
 
     # Check if key model directories exist
     model_dirs = [
@@ -236,7 +422,7 @@ async def main():
             logger.info(
                 f"Model directory {dir_path} not found. Skipping model downloads."
             )
-            return
+            return None
 
     # Base path for ComfyUI
     base_path = Path("/workspace/ComfyUI")
@@ -254,58 +440,149 @@ async def main():
             config_path = str(local_config_path.absolute())
         else:
             logger.error(f"Local config file not found at {config_path}")
-            default_config = {
-                "checkpoints": [],
-                "vae": [],
-                "unet": [],
-                "diffusion_models": [],
-                "text_encoders": [],
-                "loras": [],
-                "upscale_models": [],
-                "clip": [],
-                "controlnet": [],
-                "clip_vision": [],
-                "ipadapter": [],
-                "style_models": [],
-            }
             logger.info("Using default empty configuration")
             with open("/workspace/models_config.json", "w") as f:
-                json.dump(default_config, f, indent=4)
+                json.dump(DEFAULT_CONFIG, f, indent=4)
             config_path = "/workspace/models_config.json"
 
     # Fetch configuration
     config = await get_config_async(config_path)
     if not config:
         logger.error("Failed to get configuration, exiting.")
-        return
+        return None
 
     # Log the number of models to download
     total_models = sum(len(urls) for urls in config.values() if isinstance(urls, list))
     logger.info(f"Found {total_models} models in configuration")
-    logger.info(f"Maximum concurrent downloads: 5")
+    logger.info(f"Maximum concurrent downloads: {MAX_CONCURRENT}, adapted to throughput")
+
+    # a scandir/stat walk, kept off the event loop the viewer shares
+    await asyncio.to_thread(model_inventory.refresh)
+    # written by --plan, spares the HEAD requests for everything it resolved
+    lock = load_lock(lock_path)
+    if lock:
+        logger.info(f"Using {len(lock)} resolved models from {lock_path}")
 
-    # Create tasks for all categories
-    category_tasks = []
+    # Collect what is missing in every category
+    downloads = []
     for category, urls in config.items():
         if isinstance(urls, list) and urls:
-            tasks = await download_category_models(category, urls, base_path, force_download)
-            [category_tasks.append(task) for task in tasks]
+            for url, directory in await download_category_models(
+                category, urls, base_path, force_download, lock
+            ):
+                downloads.append((category, url, directory))
 
-    if category_tasks:
-        logger.info(
-            f"Starting concurrent downloads for {len(category_tasks)} categories..."
+    if not downloads:
+        logger.info("No models to download.")
+        return None
+
+    logger.info(f"Sizing {len(downloads)} downloads...")
+    remotes = await size_downloads([url for _, url, _ in downloads], lock)
+    total_size = sum(size for size, _ in remotes if size)
+    logger.info(f"{format_bytes(total_size)} to download, largest files first")
+
+    # better to stop now than with a full volume at 90%
+    needed = sum(
+        space_needed(str(directory / url.split("/")[-1]), size)
+        for (_, url, directory), (size, _) in zip(downloads, remotes)
+    )
+    for directory, free, need in free_space(needed):
+        if free < need:
+            logger.error(
+                f"Not enough space in {directory}: {format_bytes(free)} free, "
+                f"{format_bytes(need)} needed, not downloading"
+            )
+            return None
+
+    scheduler = DownloadScheduler(log=logger.info, on_change=on_change)
+    for i, ((category, url, directory), (size, sha256)) in enumerate(
+        zip(downloads, remotes)
+    ):
+        filename = url.split("/")[-1]
+        tracker = download_tracker(filename)
+        start = scheduled_download(
+            url, directory, category, i + 1, len(downloads), tracker, sha256
         )
-        # Wait for all categories to complete
-        await asyncio.gather(*category_tasks)
-        logger.info("All model downloads completed!")
+        scheduler.add(url, size, start, tracker, filename)
+    return scheduler
+
+
+async def run_downloads(scheduler: DownloadScheduler) -> Dict[str, bool]:
+    """Run what prepare_downloads() queued, returns {url: success}"""
+    results = await scheduler.run()
+    failed = sum(1 for success in results.values() if not success)
+    if failed:
+        logger.error(f"{failed} of {len(results)} model downloads failed")
     else:
-        logger.info("No models to download.")
+        logger.info("All model downloads completed!")
+    return results
+
+
+async def main(lock_path: str = LOCK_FILE):
+    """Main async function to download models concurrently"""
+    scheduler = await prepare_downloads(lock_path)
+    if scheduler is not None:
+        await run_downloads(scheduler)
+    await close_http_session()
+
+
+async def plan(lock_path: str = LOCK_FILE) -> bool:
+    """Resolve every model, check free space and write the lockfile, downloads nothing"""
+    config_path = os.getenv("MODELS_CONFIG_URL", "/workspace/models_config.json")
+    config = await get_config_async(config_path)
+    if not config:
+        logger.error("Failed to get configuration, exiting.")
+        return False
+
+    plan = await build_plan(config)
+    await close_http_session()
+    for entry in plan["models"]:
+        size = format_bytes(entry["size"]) if entry["size"] is not None else "unknown size"
+        if entry["error"]:
+            state = f"unresolved ({entry['error']})"
+        elif entry["needed"] or entry["local_size"] is None:
+            state = f"download {format_bytes(entry['needed'])}"
+        else:
+            state = "present"
+        sha256 = entry["sha256"][:12] if entry["sha256"] else "no sha256"
+        logger.info(f"{entry['category']}/{os.path.basename(entry['path'])}: {size}, {sha256}, {state}")
+
+    logger.info(
+        f"{len(plan['models'])} models, {format_bytes(plan['total_size'])} in total, "
+        f"{format_bytes(plan['download_size'])} to download"
+    )
+    if plan["unknown"]:
+        logger.warning(f"{plan['unknown']} models have an unknown size")
+    for check in plan["free_space"]:
+        logger.info(
+            f"{check['path']}: {format_bytes(check['free'])} free, "
+            f"{format_bytes(check['needed'])} needed"
+        )
+
+    write_lock(plan, lock_path)
+    logger.info(f"Wrote {lock_path}")
+    if not plan["fits"]:
+        logger.error("Not enough free space for these models")
+    return plan["fits"]
 
 
 if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Download the models in models_config.json")
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="resolve sizes and hashes, check free space and write the lockfile, download nothing",
+    )
+    parser.add_argument("--lock", default=LOCK_FILE, help="lockfile path")
+    args = parser.parse_args()
+
+    if args.plan:
+        sys.exit(0 if asyncio.run(plan(args.lock)) else 1)
+
     # Run the async main function
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.lock))
     except KeyboardInterrupt:
         logger.info("Download process interrupted by user")
     except Exception as e:
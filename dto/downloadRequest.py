@@ -8,3 +8,5 @@ class DownloadRequest(BaseModel):
     api_key: Optional[str] = None
     model_type: str = "loras"
     filename: Optional[str] = None
+    # higher starts first when downloads are queued
+    priority: int = 0
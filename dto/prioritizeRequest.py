@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class PrioritizeRequest(BaseModel):
+    # url of the model as it is in models_config.json
+    url: str
@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class SpeedLimitRequest(BaseModel):
+    # aria2 notation, e.g. 500K, 20M, 0 for unlimited
+    max_speed: str
@@ -1,35 +1,81 @@
 import asyncio
-import io
 import json
 import os
-import threading
-import zipfile
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Optional
 
 import uvicorn
 from fastapi import (
-    BackgroundTasks,
     FastAPI,
     HTTPException,
     Request,
     WebSocket,
     WebSocketDisconnect,
 )
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 
-from constants.websocketEventManager import websocket_connections
+from constants.logLock import log_buffer
+from constants.websocketEventManager import (
+    register_websocket,
+    unregister_websocket,
+    websocket_connections,
+)
 from dto.downloadRequest import DownloadRequest
+from dto.prioritizeRequest import PrioritizeRequest
+from dto.speedLimitRequest import SpeedLimitRequest
 from utils.getCurrentLogs import get_current_logs
 from utils.getInstalledCustomNodes import get_installed_custom_nodes
 from utils.getInstalledModels import get_installed_models
+from utils.getLogsSince import get_logs_since
+from utils.modelsConfig import models_config
+from utils.parseByteRange import parse_byte_range
+from utils.segmentedDownload import close_http_session
+from utils.searchLogs import get_log_page, parse_levels, search_logs
+from utils.outputArchive import stream_output_zip
+from utils.outputArchiveCache import output_archive_cache
+from utils.outputManifest import (
+    CLIENT_PATTERN,
+    files_since,
+    load_client_cursor,
+    save_client_cursor,
+    save_manifest,
+    scan_output_manifest,
+)
+from workers.aria2Daemon import aria2_daemon
 from workers.download_file import (
     download_from_civitai_async,
     download_from_googledrive_async,
     download_from_huggingface_async,
 )
-from workers.tailLogsFile import tail_log_file, tlf_worker
+from workers.downloadJobManager import download_jobs
+from workers.modelDownloadService import model_downloads
+from workers.tailLogsFile import log_index, log_segments, tail_log_file
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the log tailer inside uvicorn's event loop for the lifetime of the app"""
+    print("Starting log monitoring task...")
+    log_task = asyncio.create_task(
+        tail_log_file(index=log_index, segments=log_segments)
+    )
+    # aria2 downloads share one aria2c, start it before the first one is queued
+    asyncio.create_task(aria2_daemon.ensure_started())
+    yield
+    log_task.cancel()
+    await model_downloads.stop()
+    await aria2_daemon.stop()
+    await close_http_session()
+
 
 # Initialize FastAPI with disable docs url (swagger and redoc)
 app = FastAPI(
@@ -37,6 +83,7 @@ app = FastAPI(
     description="ComfyUI Runpod Log Viewer and Model Downloader",
     docs_url=None,
     redoc_url=None,
+    lifespan=lifespan,
 )
 
 # using static file to serve css,js and images
@@ -46,22 +93,6 @@ app.mount("/static", StaticFiles(directory="./static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 
-def create_output_zip():
-    """Create a zip file of the ComfyUI output directory"""
-    output_dir = os.path.join("/workspace", "ComfyUI", "output")
-    memory_file = io.BytesIO()
-
-    with zipfile.ZipFile(memory_file, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(output_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, output_dir)
-                zf.write(file_path, arcname)
-
-    memory_file.seek(0)
-    return memory_file
-
-
 # WebSocket endpoint for real-time log updates
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -69,20 +100,31 @@ async def websocket_endpoint(websocket: WebSocket):
     /ws endpoint for real time communication
     """
     await websocket.accept()
-    websocket_connections.append(websocket)
+
+    # the page opens with {"type": "resume", "since": <seq>, "epoch": ...} so we can
+    # send only the lines it missed before it starts receiving live ones
+    backlog = None
+    try:
+        hello = json.loads(await asyncio.wait_for(websocket.receive_text(), 2))
+        if hello.get("type") == "resume":
+            backlog = get_logs_since(int(hello.get("since", 0)), hello.get("epoch"))
+    except WebSocketDisconnect:
+        return
+    except (asyncio.TimeoutError, ValueError, TypeError, AttributeError):
+        pass
+
+    client = register_websocket(websocket, backlog)
     print(f"WebSocket connected. Total connections: {len(websocket_connections)}")
 
     try:
-        # Send initial logs
-        await websocket.send_text(
-            json.dumps({"type": "msg", "msg": "websocket connected"})
-        )
+        # Send initial logs, through the client queue so frames never interleave
+        client.push(json.dumps({"type": "msg", "msg": "websocket connected"}))
 
         # Keep the connection alive
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        websocket_connections.remove(websocket)
+        unregister_websocket(client)
         print(
             f"WebSocket disconnected. Remaining connections: {len(websocket_connections)}"
         )
@@ -91,75 +133,302 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.get("/api/custom-nodes")
 async def api_custom_nodes():
     """API endpoint to get installed custom nodes"""
-    return get_installed_custom_nodes()
+    return await asyncio.to_thread(get_installed_custom_nodes)
 
 
 @app.get("/api/models")
 async def api_models():
     """API endpoint to get installed models"""
-    return get_installed_models()
+    # the inventory refresh stats the models tree, keep it off the event loop
+    return await asyncio.to_thread(get_installed_models, await models_config.get())
+
+
+@app.post("/api/models/boot-downloads", status_code=202)
+async def api_start_model_downloads():
+    """
+    download the missing models of models_config.json in the background
+
+    start.sh calls this and starts ComfyUI right away, calling it again
+    while they run changes nothing
+    """
+    model_downloads.start()
+    return model_downloads.status()
+
+
+@app.get("/api/models/readiness")
+async def api_models_readiness():
+    """which models, and which whole categories, are ready to use"""
+    return await model_downloads.readiness()
+
+
+@app.post("/api/models/prioritize")
+async def api_models_prioritize(request: PrioritizeRequest):
+    """
+    move a model the boot downloads haven't started yet to the front
+    """
+    item = model_downloads.bump(request.url)
+    if item is None:
+        raise HTTPException(
+            status_code=404, detail="Model is not part of the boot downloads"
+        )
+    return item.to_dict()
 
 
 @app.get("/logs")
-async def get_logs():
-    return {"logs": get_current_logs()}
+async def get_logs(
+    request: Request, since: Optional[int] = None, epoch: Optional[str] = None
+):
+    """
+    full log html, or with ?since=<seq>&epoch=<epoch> only the lines after seq
+
+    the ETag changes with every new line, polling clients get a 304 otherwise
+    """
+    # read before building the body, a line arriving meanwhile only costs a refetch
+    etag = log_buffer.etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if since is not None:
+        payload = get_logs_since(since, epoch)
+        etag = f'"{payload["epoch"]}-{payload["seq"]}"'
+    else:
+        payload = {
+            "logs": get_current_logs(),
+            "seq": log_buffer.last_seq,
+            "epoch": log_buffer.epoch,
+        }
+    return JSONResponse(payload, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+@app.get("/api/logs/page")
+async def api_logs_page(start: Optional[int] = None, limit: int = 200):
+    """
+    page through the whole comfyui.log history including rotated segments,
+    ?start=<line> (default last page)
+    """
+    return await asyncio.to_thread(get_log_page, log_index, log_segments, start, limit)
+
+
+@app.get("/api/logs/search")
+async def api_logs_search(
+    q: str = "",
+    regex: bool = False,
+    level: Optional[str] = None,
+    before: Optional[int] = None,
+    limit: int = 100,
+):
+    """
+    search the whole log history newest first, ?level=error,warning narrows by level.
+    continue with ?before=<next> from the previous response
+    """
+    try:
+        levels = parse_levels(level)
+        return await asyncio.to_thread(
+            search_logs, log_index, log_segments, q, regex, levels, before, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _outputs_filename(prefix):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"attachment; filename={prefix}_{timestamp}.zip"
+
+
+def _save_cursor_when_sent(body, client, cursor):
+    """Pass the archive through, remembering the client's cursor once the last chunk went out"""
+    yield from body
+    try:
+        save_client_cursor(client, cursor)
+    except OSError as e:
+        print(f"Error saving output cursor: {e}")
+
+
+@app.get("/api/outputs/cursor")
+async def api_outputs_cursor(client: str):
+    """cursor of the client's last complete output download, null before the first"""
+    if not CLIENT_PATTERN.match(client):
+        raise HTTPException(status_code=400, detail="Invalid client id")
+    return {"cursor": await asyncio.to_thread(load_client_cursor, client)}
 
 
 @app.get("/download/outputs")
-async def download_outputs():
+async def download_outputs(
+    request: Request, since: Optional[str] = None, client: Optional[str] = None
+):
     """
     endpoint for download every outputs in zip file.
+    pass ?since=<cursor> (token from X-Output-Cursor or unix timestamp) to only get new/changed files,
+    a cursor that expired gets the full archive with X-Output-Full.
+    pass ?client=<id> to have the cursor saved for /api/outputs/cursor once the archive was sent.
     """
+    if client and not CLIENT_PATTERN.match(client):
+        raise HTTPException(status_code=400, detail="Invalid client id")
+    headers = {}
     try:
-        memory_file = create_output_zip()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # stat-only walk, cheap but still keep it off the event loop
+        manifest = await asyncio.to_thread(scan_output_manifest)
+        cursor = await asyncio.to_thread(save_manifest, manifest)
+
+        arcnames = None
+        if since:
+            arcnames = await asyncio.to_thread(files_since, manifest, since)
+            prefix = "comfyui_outputs_new"
+        if arcnames is None:
+            if since:
+                headers["X-Output-Full"] = "1"
+                since = None
+            arcnames = sorted(manifest)
+            prefix = "comfyui_outputs"
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return StreamingResponse(
-            io.BytesIO(memory_file.read()),
+    headers["X-Output-Cursor"] = cursor
+    view = None
+    if not since and output_archive_cache:
+        view = await asyncio.to_thread(output_archive_cache.get, manifest)
+
+    if since and not arcnames:
+        # nothing new, browsers stay on the page for 204
+        if client:
+            await asyncio.to_thread(save_client_cursor, client, cursor)
+        response = Response(status_code=204, headers=headers)
+    elif view:
+        # unchanged outputs, serve the cached archive with range support
+        etag = f'"{cursor}"'
+        range_header = request.headers.get("range")
+        if request.headers.get("if-range", etag) != etag:
+            range_header = None
+        try:
+            byte_range = parse_byte_range(range_header, view.size)
+        except ValueError:
+            view.close()
+            raise HTTPException(
+                status_code=416, headers={"Content-Range": f"bytes */{view.size}"}
+            )
+
+        start, end = byte_range or (0, view.size)
+        headers["Content-Disposition"] = _outputs_filename(prefix)
+        headers["Accept-Ranges"] = "bytes"
+        headers["ETag"] = etag
+        headers["Content-Length"] = str(end - start)
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{view.size}"
+
+        body = view.iter_range(start, end)
+        if client and end == view.size:
+            body = _save_cursor_when_sent(body, client, cursor)
+        response = StreamingResponse(
+            body,
+            status_code=206 if byte_range else 200,
             media_type="application/zip",
-            headers={
-                "Content-Disposition": f"attachment; filename=comfyui_outputs_{timestamp}.zip"
-            },
+            headers=headers,
+            # iter_range never starts when the client leaves before the body
+            background=BackgroundTask(view.close),
+        )
+    else:
+        if since or not output_archive_cache:
+            body = stream_output_zip(arcnames=arcnames)
+        else:
+            # appends new outputs to the cached archive, or builds it
+            body = output_archive_cache.stream(manifest)
+        if client:
+            body = _save_cursor_when_sent(body, client, cursor)
+
+        headers["Content-Disposition"] = _outputs_filename(prefix)
+        # sync generator, starlette iterates it in a threadpool so compression doesn't block the loop
+        response = StreamingResponse(
+            body,
+            media_type="application/zip",
+            headers=headers,
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
 
+    return response
 
-@app.post("/download/{url_type}", status_code=204)
-async def download(
-    request: DownloadRequest, url_type: str, background_tasks: BackgroundTasks
-):
+
+@app.post("/download/{url_type}", status_code=202)
+async def download(request: DownloadRequest, url_type: str):
     """
     download model endpoints with path params url_type is civitai, huggingface and googledrive
+
+    the download is queued in the job manager, returns the job
     """
     if not request.url:
         raise HTTPException(status_code=400, detail="URL is required")
 
     if url_type == "civitai":
 
-        task = asyncio.create_task(
-            download_from_civitai_async(
+        def runner():
+            return download_from_civitai_async(
                 request.url, request.api_key, request.model_type
             )
-        )
 
     elif url_type == "huggingface":
 
-        task = asyncio.create_task(
-            download_from_huggingface_async(request.url, request.model_type)
-        )
-    elif url_type == "googledrive":
+        def runner():
+            return download_from_huggingface_async(request.url, request.model_type)
 
+    elif url_type == "googledrive":
         custom_filename = (
             request.filename if request.filename and request.filename.strip() else None
         )
-        task = asyncio.create_task(
-            download_from_googledrive_async(
+
+        def runner():
+            return download_from_googledrive_async(
                 request.url, request.model_type, custom_filename
             )
-        )
 
-    background_tasks.add_task(lambda: task)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown source {url_type}")
+
+    job = download_jobs.submit(
+        url_type, request.url, runner, request.priority, request.model_type
+    )
+    return job.to_dict()
+
+
+@app.get("/api/downloads")
+async def api_downloads():
+    """queued, running, paused and finished download jobs"""
+    return {**download_jobs.list(), "aria2": await aria2_daemon.status()}
+
+
+@app.post("/api/downloads/speed-limit")
+async def api_download_speed_limit(request: SpeedLimitRequest):
+    """
+    change the global bandwidth cap of the aria2 daemon while downloads run
+    """
+    try:
+        await aria2_daemon.set_max_speed(request.max_speed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return await aria2_daemon.status()
+
+
+@app.post("/api/downloads/{job_id}/{action}")
+async def api_download_action(job_id: str, action: str):
+    """
+    cancel, pause or resume a download job
+    """
+    actions = {
+        "cancel": download_jobs.cancel,
+        "pause": download_jobs.pause,
+        "resume": download_jobs.resume,
+    }
+    if action not in actions:
+        raise HTTPException(status_code=404, detail=f"Unknown action {action}")
+
+    try:
+        job = actions[action](job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Download job not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.to_dict()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -172,8 +441,8 @@ async def index(request: Request):
     logs = get_current_logs()
 
     # Get installed custom nodes and models
-    custom_nodes = get_installed_custom_nodes()
-    models = get_installed_models()
+    custom_nodes = await asyncio.to_thread(get_installed_custom_nodes)
+    models = await asyncio.to_thread(get_installed_models, await models_config.get())
 
     # Count total models
     total_models = sum(len(models[category]) for category in models)
@@ -207,33 +476,21 @@ async def index(request: Request):
         context={
             "request": request,
             "logs": logs,
+            "log_seq": log_buffer.last_seq,
+            "log_epoch": log_buffer.epoch,
             "proxy_url": proxy_url,
             "jupyter_url": jupyter_url,
             "is_runpod": is_runpod,
             "custom_nodes": custom_nodes,
             "models": models,
             "total_models": total_models,
+            "boot_downloads": model_downloads.status(),
         },
     )
 
 
 if __name__ == "__main__":
 
-    print("Starting log monitoring thread...")
-
-    # using new event loop + thread to handle read logs like tail -f (always read latest log)
-    loop = asyncio.new_event_loop()
-
-    log_thread = threading.Thread(
-        target=tlf_worker,
-        args=(
-            tail_log_file,
-            loop,
-        ),
-        daemon=True,
-    )
-    log_thread.start()
-
     print("Starting FastAPI log viewer on port 8189...")
 
     uvicorn.run(app, host="0.0.0.0", port=8189, log_level="info")
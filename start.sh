@@ -64,20 +64,8 @@ mkdir -p /workspace/ComfyUI
 # Create log file if it doesn't exist
 touch /workspace/logs/comfyui.log
 
-# Clean up the log file to remove any duplicate lines
-clean_log_file() {
-    local log_file="/workspace/logs/comfyui.log"
-    if [ -f "$log_file" ] && [ -s "$log_file" ]; then
-        echo "Cleaning log file to remove duplicates..."
-        # Create a temporary file with unique lines only
-        awk '!seen[$0]++' "$log_file" >"${log_file}.tmp"
-        # Replace original with cleaned version
-        mv "${log_file}.tmp" "$log_file"
-    fi
-}
-
-# Clean the log file before starting the log viewer
-clean_log_file
+# The log viewer rotates comfyui.log into compressed segments itself
+# (LOG_ROTATE_MAX_BYTES, LOG_ROTATE_MAX_AGE, LOG_RETENTION_SEGMENTS, LOG_RETENTION_MAX_GB)
 
 # Start log viewer early to monitor the installation process
 cd /notebooks
@@ -89,6 +77,31 @@ cd /
 # Install uv for faster package installation
 install_uv
 
+# torch, ComfyUI and custom node requirements in one resolve, skipped when
+# nothing changed since the last install into this venv. Wheels are kept in
+# /workspace/.cache/wheelhouse so a new container installs them offline
+install_requirements() {
+    (cd /notebooks && python -m utils.requirementsBootstrap) 2>&1 | tee -a /workspace/logs/comfyui.log
+}
+
+# clone the custom nodes listed in custom_nodes.json (a copy in /workspace wins),
+# several at a time. Nodes already there are left alone unless pinned to
+# another commit. Per node results go to /workspace/.cache/custom_nodes_provision.json
+provision_custom_nodes() {
+    (cd /notebooks && python -m utils.provisionCustomNodes) 2>&1 | tee -a /workspace/logs/comfyui.log
+}
+
+# the viewer downloads the missing models in the background while ComfyUI
+# starts, /api/models/readiness tells what is there. Without the viewer
+# download_models.py runs in the background instead
+start_model_downloads() {
+    if ! curl -fsS -o /dev/null -X POST --retry 5 --retry-connrefused --retry-delay 1 \
+        http://127.0.0.1:8189/api/models/boot-downloads; then
+        echo "Log viewer not reachable, downloading models without it..." | tee -a /workspace/logs/comfyui.log
+        nohup python /notebooks/download_models.py >>$LOG_PATH 2>&1 &
+    fi
+}
+
 # Function to check internet connectivity
 check_internet() {
     local max_attempts=5
@@ -110,35 +123,13 @@ check_internet() {
     return 1
 }
 
-# Function to download config with retry
-download_config() {
-    local url=$1
-    local output=$2
-    local max_attempts=5
-    local attempt=1
-    local timeout=30
-
-    while [ $attempt -le $max_attempts ]; do
-        echo "Downloading config (attempt $attempt/$max_attempts)..."
-        if wget --timeout=$timeout --tries=3 -O "$output" "$url" 2>/dev/null; then
-            echo "Successfully downloaded config file."
-            return 0
-        fi
-        echo "Download failed. Waiting before retry..."
-        sleep 10
-        attempt=$((attempt + 1))
-    done
-
-    echo "WARNING: Failed to download config after $max_attempts attempts."
-    return 1
-}
-
 # Check for models_config.json and download it first thing
 CONFIG_FILE="/workspace/models_config.json"
 if [ ! -f "$CONFIG_FILE" ]; then
     echo "Creating models_config.json..." | tee -a /workspace/logs/comfyui.log
     if [ -n "$MODELS_CONFIG_URL" ]; then
-        if ! download_config "$MODELS_CONFIG_URL" "$CONFIG_FILE"; then
+        # fetched through the same cache the viewer and download_models.py use
+        if ! (cd /notebooks && python -m utils.modelsConfig --write "$CONFIG_FILE"); then
             echo "Failed to download from URL. Creating default config..." | tee -a /workspace/logs/comfyui.log
             echo '{
                 "checkpoints": [],
@@ -192,23 +183,6 @@ if [ ! -e "/workspace/ComfyUI/main.py" ]; then
     echo "Cloning ComfyUI..." | tee -a /workspace/logs/comfyui.log
     git clone --depth=1 https://github.com/comfyanonymous/ComfyUI /workspace/ComfyUI 2>&1 | tee -a /workspace/logs/comfyui.log
 
-    # Install dependencies
-    cd /workspace/ComfyUI
-    echo "Installing PyTorch dependencies..." | tee -a /workspace/logs/comfyui.log
-    uv pip install --no-cache torch==2.9.1 torchvision==0.24.1 torchaudio==2.9.1 --index-url https://download.pytorch.org/whl/cu130 2>&1 | tee -a /workspace/logs/comfyui.log
-    echo "Installing ComfyUI requirements..." | tee -a /workspace/logs/comfyui.log
-    uv pip install --no-cache -r requirements.txt 2>&1 | tee -a /workspace/logs/comfyui.log
-
-    echo "Pinning transformers to 5.3.0..." | tee -a /workspace/logs/comfyui.log
-    uv pip install --no-cache transformers==5.3.0 2>&1 | tee -a /workspace/logs/comfyui.log
-
-    # Install SageAttention 2.2.0 from prebuilt wheel (no compilation needed)
-    echo "Installing SageAttention 2.2.0 from prebuilt wheel..." | tee -a /workspace/logs/comfyui.log
-    uv pip install https://huggingface.co/vjump21848/sageattention-pre-compiled-wheel/resolve/main/sageattention-2.2.0%2Bcu130-cp312-cp312-linux_x86_64.whl 2>&1 | tee -a /workspace/logs/comfyui.log
-    echo "SageAttention 2.2.0 installation complete" | tee -a /workspace/logs/comfyui.log
-
-    # SageAttention 3 is intentionally skipped until a CUDA 13.0 Linux wheel is available.
-    
     cd /workspace/ComfyUI
 
     # Create model directories
@@ -218,51 +192,12 @@ if [ ! -e "/workspace/ComfyUI/main.py" ]; then
     mkdir -p /workspace/ComfyUI/output
 
     # Clone custom nodes
-    mkdir -p /workspace/ComfyUI/custom_nodes
-    cd /workspace/ComfyUI/custom_nodes
-
     echo "Cloning custom nodes..." | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/ltdrdata/ComfyUI-Manager.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-Manager | tee -a /workspace/logs/comfyui.log
-    #git clone --depth=1 https://github.com/ltdrdata/ComfyUI-Impact-Pack.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-Impact-Pack | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/cubiq/ComfyUI_essentials.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI_essentials | tee -a /workspace/logs/comfyui.log
-    #git clone --depth=1 https://github.com/ltdrdata/ComfyUI-Inspire-Pack.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-Inspire-Pack | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/Fannovel16/comfyui_controlnet_aux.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh comfyui_controlnet_aux | tee -a /workspace/logs/comfyui.log
-    #git clone --depth=1 https://github.com/nicofdga/DZ-FaceDetailer.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh DZ-FaceDetailer | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/cubiq/ComfyUI_IPAdapter_plus.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI_IPAdapter_plus | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/ssitu/ComfyUI_UltimateSDUpscale.git --recursive 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI_UltimateSDUpscale | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/Kosinkadink/ComfyUI-VideoHelperSuite.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-VideoHelperSuite | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/Acly/comfyui-inpaint-nodes.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh comfyui-inpaint-nodes | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/kijai/ComfyUI-KJNodes.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-KJNodes | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/city96/ComfyUI-GGUF.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-GGUF | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/rgthree/rgthree-comfy.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh rgthree-comfy | tee -a /workspace/logs/comfyui.log
-    #git clone --depth=1 https://github.com/AlekPet/ComfyUI_Custom_Nodes_AlekPet.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI_Custom_Nodes_AlekPet | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/justUmen/Bjornulf_custom_nodes.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh Bjornulf_custom_nodes | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/pythongosssss/ComfyUI-Custom-Scripts.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-Custom-Scripts | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/Fannovel16/ComfyUI-Frame-Interpolation.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-Frame-Interpolation | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/numz/ComfyUI-SeedVR2_VideoUpscaler.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-SeedVR2_VideoUpscaler | tee -a /workspace/logs/comfyui.log
-    #git clone --depth=1 https://github.com/ShmuelRonen/ComfyUI-VideoUpscale_WithModel.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-VideoUpscale_WithModel | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/kijai/ComfyUI-WanVideoWrapper.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-WanVideoWrapper | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/chflame163/ComfyUI_LayerStyle.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI_LayerStyle | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/kijai/ComfyUI-MelBandRoFormer.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-MelBandRoFormer | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/kijai/ComfyUI-segment-anything-2.git  2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-segment-anything-2 | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/kijai/ComfyUI-WanAnimatePreprocess.git  2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-WanAnimatePreprocess | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/theUpsider/ComfyUI-Logic.git  2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-Logic | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/ltdrdata/was-node-suite-comfyui.git  2>&1 | tee -a /workspace/logs/comfyui.log && du -sh was-node-suite-comfyui | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/kijai/ComfyUI-SCAIL-Pose.git  2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-SCAIL-Pose | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/ClownsharkBatwing/RES4LYF.git  2>&1 | tee -a /workspace/logs/comfyui.log && du -sh RES4LYF | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/Lightricks/ComfyUI-LTXVideo.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-LTXVideo | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/MoonGoblinDev/Civicomfy.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh Civicomfy | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/MadiatorLabs/ComfyUI-RunpodDirect.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-RunpodDirect | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/evanspearman/ComfyMath.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyMath | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/richservo/rs-nodes.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh rs-nodes | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/xmarre/ComfyUI-Spectrum-MiniMax-H3.git  2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-Spectrum-MiniMax-H3 | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/thaakeno/ComfyUI-MiniMax-H3-Studio.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh ComfyUI-MiniMax-H3-Studio | tee -a /workspace/logs/comfyui.log
-    git clone --depth=1 https://github.com/LBH-123-AI/Comfyui_Minimax_h3_latent_Upscaler.git 2>&1 | tee -a /workspace/logs/comfyui.log && du -sh Comfyui_Minimax_h3_latent_Upscaler | tee -a /workspace/logs/comfyui.log
-    echo "Total size of custom nodes:" | tee -a /workspace/logs/comfyui.log && du -sh . | tee -a /workspace/logs/comfyui.log 
-
-    # Install custom nodes requirements
-    echo "Installing custom node requirements..." | tee -a /workspace/logs/comfyui.log
-    find . -name "requirements.txt" -exec uv pip install --no-cache -r {} \; 2>&1 | tee -a /workspace/logs/comfyui.log
+    provision_custom_nodes
+
+    # Install PyTorch, ComfyUI and custom node requirements
+    echo "Installing requirements..." | tee -a /workspace/logs/comfyui.log
+    install_requirements
 
     mkdir -p /workspace/ComfyUI/user/default/ComfyUI-Manager
     wget https://gist.githubusercontent.com/vjumpkung/b2993de3524b786673552f7de7490b08/raw/b7ae0b4fe0dad5c930ee290f600202f5a6c70fa8/uv_enabled_config.ini -O /workspace/ComfyUI/user/default/ComfyUI-Manager/config.ini 2>&1 | tee -a /workspace/logs/comfyui.log
@@ -277,44 +212,18 @@ else
     mkdir -p /workspace/ComfyUI/input
     mkdir -p /workspace/ComfyUI/output
 
-    
-    # Install Dependencies
-    cd /workspace/ComfyUI
-    echo "Installing PyTorch dependencies..." | tee -a /workspace/logs/comfyui.log
-    uv pip install --no-cache torch==2.9.1 torchvision==0.24.1 torchaudio==2.9.1 --index-url https://download.pytorch.org/whl/cu130 2>&1 | tee -a /workspace/logs/comfyui.log
-    echo "Installing ComfyUI requirements..." | tee -a /workspace/logs/comfyui.log
-    uv pip install --no-cache -r requirements.txt 2>&1 | tee -a /workspace/logs/comfyui.log
-
-    echo "Ensuring transformers is pinned to 5.3.0..." | tee -a /workspace/logs/comfyui.log
-    uv pip install --no-cache transformers==5.3.0 2>&1 | tee -a /workspace/logs/comfyui.log
-
-    # Install SageAttention 2.2.0 from prebuilt wheel (no compilation needed)
-    echo "Installing SageAttention 2.2.0 from prebuilt wheel..." | tee -a /workspace/logs/comfyui.log
-    uv pip install https://huggingface.co/vjump21848/sageattention-pre-compiled-wheel/resolve/main/sageattention-2.2.0%2Bcu130-cp312-cp312-linux_x86_64.whl 2>&1 | tee -a /workspace/logs/comfyui.log
-    echo "SageAttention 2.2.0 installation complete" | tee -a /workspace/logs/comfyui.log
-
-    # SageAttention 3 is intentionally skipped until a CUDA 13.0 Linux wheel is available.
+    # nodes added to the manifest since the last boot
+    echo "Checking custom nodes..." | tee -a /workspace/logs/comfyui.log
+    provision_custom_nodes
 
-    cd /workspace/ComfyUI
-
-    # Install Custom Nodes Dependencies
-    cd /workspace/ComfyUI/custom_nodes
-    echo "Installing custom node requirements..." | tee -a /workspace/logs/comfyui.log
-    find . -name "requirements.txt" -exec uv pip install --no-cache -r {} \; 2>&1 | tee -a /workspace/logs/comfyui.log
+    # Install Dependencies, only when a requirement changed since the last boot
+    echo "Checking requirements..." | tee -a /workspace/logs/comfyui.log
+    install_requirements
 fi
 
 # Create log file if it doesn't exist
 touch /workspace/logs/comfyui.log
 
-# Function to check if a model exists
-check_model() {
-    local url=$1
-    local filename=$(basename "$url")
-    # Search for the file in all model directories
-    find /workspace/ComfyUI/models -type f -name "$filename" | grep -q .
-    return $?
-}
-
 # Initialize GPU - Do this before downloading models to ensure GPU is ready
 echo "Initializing GPU..."
 if ! check_gpu; then
@@ -326,11 +235,12 @@ fi
 # Check if models from config exist
 if [ -n "$CONFIG_FILE" ] && [ -f "$CONFIG_FILE" ]; then
     echo "Checking for missing models..." | tee -a /workspace/logs/comfyui.log
-    if python /utils/getInstalledModels.py --check-missing "$CONFIG_FILE"; then
+    # one scan of the models tree, shared with download_models.py and the viewer
+    if (cd /notebooks && python -m utils.getInstalledModels --check-missing "$CONFIG_FILE"); then
         echo "All required models present..." | tee -a /workspace/logs/comfyui.log
     elif [ "$SKIP_MODEL_DOWNLOAD" != "true" ]; then
-        echo "Some required models are missing. Downloading models..." | tee -a /workspace/logs/comfyui.log
-        python /notebooks/download_models.py 2>&1 | tee -a $LOG_PATH
+        echo "Some required models are missing, downloading them while ComfyUI starts..." | tee -a /workspace/logs/comfyui.log
+        start_model_downloads
     else
         echo "Models missing but download skipped..." | tee -a /workspace/logs/comfyui.log
     fi
@@ -344,9 +254,6 @@ echo "Starting services..."
 # Start Jupyter with GPU isolation
 CUDA_VISIBLE_DEVICES="" jupyter lab --allow-root --no-browser --ip=0.0.0.0 --port=8888 --NotebookApp.token="" --NotebookApp.password="" --notebook-dir=/workspace &
 
-# Give other services time to initialize
-sleep 5
-
 # Start ComfyUI with full GPU access
 cd /workspace/ComfyUI
 
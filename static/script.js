@@ -1,7 +1,10 @@
 let socket;
-let lastLogHash = "";
-let logUpdateCounter = 0;
 let isUpdating = false;
+// sequence number of the newest log line we have, and the viewer run it belongs to
+let lastLogSeq = 0;
+let logEpoch = null;
+let logEtag = null;
+let pollTimer = null;
 let autoScroll = true;
 let userScrolled = false;
 let reconnectAttempts = 0;
@@ -19,17 +22,6 @@ const statusMapping = {
   gdrive: "gdDownloadStatus",
 };
 
-function generateRandomString(length) {
-  const characters =
-    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789";
-  let result = "";
-  for (let i = 0; i < length; i++) {
-    result += characters.charAt(Math.floor(Math.random() * characters.length));
-  }
-
-  return result;
-}
-
 var support = (function () {
   if (!window.DOMParser) return false;
   var parser = new DOMParser();
@@ -68,12 +60,20 @@ function initializeWebSocket() {
     socket.onopen = function () {
       console.log("WebSocket connected");
       reconnectAttempts = 0;
+      // ask only for the lines we missed while disconnected
+      socket.send(
+        JSON.stringify({ type: "resume", since: lastLogSeq, epoch: logEpoch })
+      );
     };
 
     socket.onmessage = function (event) {
       const msg = JSON.parse(event.data);
-      if (msg.type === "new_log_line") {
-        appendLogWs(msg);
+      if (msg.type === "log_batch") {
+        handleLogBatch(msg);
+      } else if (msg.type === "logs_dropped") {
+        appendLogLines([
+          `<span class='log-warning'>... ${msg.count} log lines skipped (connection too slow)</span>`,
+        ]);
       } else if (msg.type === "download") {
         const button_source = sourceMapping[msg.data.source];
         const status_source = statusMapping[msg.data.source];
@@ -98,6 +98,14 @@ function initializeWebSocket() {
             statusDiv.className = "status-message";
             break;
         }
+      } else if (msg.type === "download_job") {
+        handleDownloadJob(msg.data);
+      } else if (msg.type === "download_progress") {
+        handleDownloadProgress(msg.data);
+      } else if (msg.type === "model_readiness") {
+        handleModelReadiness(msg.data);
+      } else if (msg.type === "model_downloads") {
+        renderBootDownloads(msg.data);
       }
     };
 
@@ -113,7 +121,7 @@ function initializeWebSocket() {
       }
     };
 
-    socket.onerror = function () {
+    socket.onerror = function (error) {
       startAutoPoll();
       console.error("WebSocket error:", error);
     };
@@ -122,87 +130,200 @@ function initializeWebSocket() {
   }
 }
 
-function appendLogWs(data) {
+function handleDownloadJob(job) {
 
-  // append logs + scroll down and remove element when it more than 500 lines.
+  // jobs stopped from /api/downloads never send a download success/failed message
 
-  const logBox = document.getElementById("log-box");
-  const parsed = stringToHTML(data.line);
+  if (job.status !== "cancelled" && job.status !== "paused") return;
 
-  // Only update if content actually changed
-  isUpdating = true;
+  const source = job.source === "googledrive" ? "gdrive" : job.source;
+  const btn = document.getElementById(sourceMapping[source]);
+  const statusDiv = document.getElementById(statusMapping[source]);
+  if (!btn || !statusDiv) return;
 
-  // Save current scroll position and check if scrolled to bottom
-  const wasAtBottom =
-    isScrolledToBottom(logBox) || (autoScroll && !userScrolled);
-  const scrollPos = logBox.scrollTop;
+  btn.disabled = false;
+  statusDiv.textContent =
+    job.status === "paused" ? "Download paused" : "Download cancelled";
+  statusDiv.className = "status-message";
+}
 
-  // Update content with minimal flickering
-  requestAnimationFrame(() => {
-    logBox.style.opacity = "0.7";
+function formatBytes(size) {
+  const units = ["B", "KiB", "MiB", "GiB", "TiB"];
+  let i = 0;
+  while (size >= 1024 && i < units.length - 1) {
+    size /= 1024;
+    i++;
+  }
+  return `${size.toFixed(i ? 1 : 0)} ${units[i]}`;
+}
 
-    logBox.appendChild(parsed);
-    // Use timeout to allow the opacity transition to happen
-    setTimeout(() => {
-      logBox.style.opacity = "1";
+function handleDownloadProgress(progress) {
 
-      if (logBox.childNodes.length > 500) {
-        logBox.removeChild(logBox.firstChild);
-      }
+  // live bytes/speed/eta of a running download, flagged when it stalls
 
-      // Maintain scroll position
-      if (wasAtBottom) {
-        scrollToBottom(logBox);
-      } else {
-        logBox.scrollTop = scrollPos;
-      }
+  const source = progress.source === "googledrive" ? "gdrive" : progress.source;
+  const statusDiv = document.getElementById(statusMapping[source]);
+  if (!statusDiv) return;
 
-      isUpdating = false;
-    }, 50);
-  });
+  let text = "Downloading...";
+  if (progress.percent !== null) text += ` ${progress.percent}%`;
+  text += ` ${formatBytes(progress.done)}`;
+  if (progress.total) text += ` / ${formatBytes(progress.total)}`;
+  if (progress.speed !== null) text += `, ${formatBytes(progress.speed)}/s`;
+  if (progress.eta !== null) text += `, ETA ${progress.eta}s`;
+  if (progress.stalled) text += " (stalled, no data received)";
+
+  statusDiv.style.display = "block";
+  statusDiv.textContent = text;
+  statusDiv.className = progress.stalled
+    ? "status-message status-error"
+    : "status-message";
 }
 
-function updateLogBoxSmoothly(logs) {
+var bootDownloads = { state: "idle", total: 0, completed: 0, detail: null };
+
+function renderBootDownloads(status) {
+
+  // overall state of the models_config.json downloads, next to the models header
+
+  bootDownloads = status;
+  const span = document.getElementById("boot-downloads");
+  if (!span) return;
+
+  let text = "";
+  switch (status.state) {
+    case "preparing":
+      text = "checking models...";
+      break;
+    case "downloading":
+      text = `downloading ${status.completed}/${status.total}`;
+      break;
+    case "finished":
+      if (status.total) text = status.detail || "downloads finished";
+      break;
+    case "failed":
+      text = `downloads failed: ${status.detail}`;
+      break;
+  }
+  span.textContent = text;
+  span.className =
+    status.state === "failed" || (status.state === "finished" && status.detail)
+      ? "model-status partial"
+      : "model-status";
+}
 
-  // for logs polling method.
+function handleModelReadiness(model) {
 
-  if (!logs || isUpdating) return;
+  // a boot download was bumped, started or finished, update its model list entry
 
-  const logBox = document.getElementById("log-box");
+  if (model.state === "ready" && bootDownloads.state === "downloading") {
+    renderBootDownloads({
+      ...bootDownloads,
+      completed: bootDownloads.completed + 1,
+    });
+  }
 
-  // Generate simple hash of the log content to check for changes
-  const hash = generateRandomString(10);
+  const item = document.querySelector(
+    `.model-list li[data-url="${CSS.escape(model.url)}"]`
+  );
+  if (!item) return;
+  const badge = item.querySelector(".model-status");
+  const btn = item.querySelector(".prioritize-btn");
+
+  if (model.state === "ready") {
+    if (badge) badge.remove();
+    if (btn) btn.remove();
+    return;
+  }
+  if (badge) {
+    badge.textContent = model.state;
+    badge.className = `model-status ${
+      model.state === "failed" ? "partial" : model.state
+    }`;
+  }
+  if (btn) {
+    btn.disabled = model.state !== "queued" || model.priority;
+    if (model.priority && model.state === "queued") btn.textContent = "next";
+  }
+}
+
+async function prioritizeModel(btn) {
 
-  if (hash !== lastLogHash) {
-    // Only update if content actually changed
-    isUpdating = true;
+  // move a model the boot downloads haven't started yet to the front
 
-    // Save current scroll position and check if scrolled to bottom
-    const wasAtBottom =
-      isScrolledToBottom(logBox) || (autoScroll && !userScrolled);
-    const scrollPos = logBox.scrollTop;
+  const url = btn.closest("li").dataset.url;
+  btn.disabled = true;
+  try {
+    const response = await fetch("/api/models/prioritize", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ url: url }),
+    });
+    if (response.ok) {
+      handleModelReadiness(await response.json());
+    } else {
+      btn.textContent = "not queued";
+    }
+  } catch (e) {
+    console.error("Prioritize failed:", e);
+    btn.disabled = false;
+  }
+}
 
-    // Update content with minimal flickering
-    requestAnimationFrame(() => {
-      logBox.style.opacity = "0.7";
+function handleLogBatch(batch) {
 
-      // Use timeout to allow the opacity transition to happen
-      setTimeout(() => {
-        logBox.innerHTML = logs;
-        logBox.style.opacity = "1";
+  // apply {lines, seq, reset, epoch} from the websocket or /logs?since=, skipping lines we already have
 
-        // Maintain scroll position
-        if (wasAtBottom) {
-          scrollToBottom(logBox);
-        } else {
-          logBox.scrollTop = scrollPos;
-        }
+  const logBox = document.getElementById("log-box");
+  let lines = batch.lines;
+
+  if (batch.reset) {
+    logBox.innerHTML = "";
+  } else {
+    const firstSeq = batch.seq - lines.length + 1;
+    if (lastLogSeq >= firstSeq) {
+      lines = lines.slice(lastLogSeq - firstSeq + 1);
+    }
+  }
 
-        lastLogHash = hash;
-        isUpdating = false;
-      }, 50);
-    });
+  if (batch.epoch) {
+    logEpoch = batch.epoch;
   }
+  lastLogSeq = Math.max(batch.reset ? 0 : lastLogSeq, batch.seq);
+
+  if (lines.length) {
+    appendLogLines(lines);
+  }
+}
+
+function appendLogLines(lines) {
+
+  // append a batch of logs + scroll down and remove elements when there are more than 500 lines.
+
+  const logBox = document.getElementById("log-box");
+  const fragment = document.createDocumentFragment();
+  lines.forEach((line) => fragment.appendChild(stringToHTML(line)));
+
+  // Save current scroll position and check if scrolled to bottom
+  const wasAtBottom =
+    isScrolledToBottom(logBox) || (autoScroll && !userScrolled);
+  const scrollPos = logBox.scrollTop;
+
+  // one DOM update per batch instead of per line
+  requestAnimationFrame(() => {
+    logBox.appendChild(fragment);
+
+    while (logBox.children.length > 500) {
+      logBox.firstElementChild.remove();
+    }
+
+    // Maintain scroll position
+    if (wasAtBottom) {
+      scrollToBottom(logBox);
+    } else {
+      logBox.scrollTop = scrollPos;
+    }
+  });
 }
 
 function isScrolledToBottom(element) {
@@ -242,39 +363,90 @@ function toggleAutoScroll() {
 
 function fetchLatestLogs(isManualRefresh) {
 
-  // fallback when ws is not support.
+  // fallback when ws is not support, only fetches lines newer than the ones we have.
 
   if (isUpdating && !isManualRefresh) return;
 
-  console.log("Fetching latest logs...");
-  fetch("/logs", {
+  isUpdating = true;
+  const params = new URLSearchParams({ since: lastLogSeq });
+  if (logEpoch) {
+    params.set("epoch", logEpoch);
+  }
+
+  // no-store keeps the browser cache out of it, the server answers 304 itself
+  const headers = logEtag ? { "If-None-Match": logEtag } : {};
+
+  fetch(`/logs?${params}`, {
     method: "GET",
-    cache: "no-cache",
-    headers: {
-      "Cache-Control": "no-cache",
-      Pragma: "no-cache",
-    },
+    cache: "no-store",
+    headers: headers,
   })
-    .then((response) => response.json())
+    .then((response) => {
+      if (response.status === 304) return null;
+      logEtag = response.headers.get("ETag");
+      return response.json();
+    })
     .then((data) => {
-      if (data && data.logs) {
-        console.log("Latest logs received, updating display");
-        updateLogBoxSmoothly(data.logs);
+      if (data === null) return;
+      if (data && data.lines) {
+        handleLogBatch(data);
       } else {
         console.warn("No logs data in response");
-        document.getElementById("log-box").style.opacity = "1";
       }
     })
     .catch((error) => {
       console.error("Error fetching logs:", error);
-      document.getElementById("log-box").style.opacity = "1";
+    })
+    .finally(() => {
+      isUpdating = false;
     });
 }
 
 // Auto-poll for logs every 3 seconds as fallback
 function startAutoPoll() {
+  if (pollTimer) return;
   console.log("Starting auto polling");
-  setInterval(() => fetchLatestLogs(false), 3000);
+  pollTimer = setInterval(() => fetchLatestLogs(false), 3000);
+}
+
+// id of this browser, the server keeps its last completed output download under it
+function outputClient() {
+  let client = localStorage.getItem("outputClient");
+  if (!client) {
+    // getRandomValues works over plain http too, unlike randomUUID
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    client = Array.from(bytes, (b) => b.toString(16).padStart(2, "0")).join("");
+    localStorage.setItem("outputClient", client);
+  }
+  return client;
+}
+
+// the archive streams straight to disk, the server only moves this browser's
+// cursor once the last byte was sent
+function downloadOutputsUrl(since) {
+  const params = new URLSearchParams({ client: outputClient() });
+  if (since) params.set("since", since);
+  return `/download/outputs?${params}`;
+}
+
+// download only outputs added since this browser's last completed download
+async function downloadNewOutputs() {
+  let cursor = null;
+  try {
+    const response = await fetch(
+      `/api/outputs/cursor?client=${outputClient()}`
+    );
+    cursor = (await response.json()).cursor;
+  } catch (error) {
+    console.error("Error fetching output cursor:", error);
+  }
+
+  // server answers 204 when nothing is new, the page stays as it is.
+  // an expired cursor gets the full archive
+  const link = document.createElement("a");
+  link.href = downloadOutputsUrl(cursor);
+  link.download = "";
+  link.click();
 }
 
 // download from civitai website
@@ -297,12 +469,12 @@ async function downloadFromCivitai() {
       }),
     });
 
-    if (response.status === 204) {
+    if (response.ok) {
       civitaibutton.disabled = true;
 
       statusDiv.className = "status-message";
       statusDiv.style.display = "block";
-      statusDiv.textContent = "Downloading...";
+      statusDiv.textContent = "Queued...";
     } else {
       const data = await response.json();
 
@@ -329,12 +501,12 @@ async function downloadFromHuggingFace() {
       body: JSON.stringify({ url: url, model_type: modelType }),
     });
 
-    if (response.status === 204) {
+    if (response.ok) {
       huggingfacebutton.disabled = true;
 
       statusDiv.className = "status-message";
       statusDiv.style.display = "block";
-      statusDiv.textContent = "Downloading...";
+      statusDiv.textContent = "Queued...";
     } else {
       const data = await response.json();
       throw { message: data.detail };
@@ -365,12 +537,12 @@ async function downloadFromGoogleDrive() {
       }),
     });
 
-    if (response.status === 204) {
+    if (response.ok) {
       gdrivebutton.disabled = true;
 
       statusDiv.className = "status-message";
       statusDiv.style.display = "block";
-      statusDiv.textContent = "Downloading...";
+      statusDiv.textContent = "Queued...";
     } else {
       const data = await response.json();
       throw { message: data.detail };
@@ -400,14 +572,29 @@ function switchTab(tabName) {
 document.addEventListener("DOMContentLoaded", function () {
   console.log("Page loaded, initializing systems");
 
+  // the server rendered the log box up to this sequence number
+  const logBox = document.getElementById("log-box");
+  lastLogSeq = parseInt(logBox.dataset.seq || "0", 10);
+  logEpoch = logBox.dataset.epoch || null;
+
   // Initialize WebSocket and fallback polling
   initializeWebSocket();
 
+  // state of the boot downloads when the page was rendered
+  const bootSpan = document.getElementById("boot-downloads");
+  if (bootSpan) {
+    renderBootDownloads({
+      state: bootSpan.dataset.state,
+      total: parseInt(bootSpan.dataset.total || "0", 10),
+      completed: parseInt(bootSpan.dataset.completed || "0", 10),
+      detail: bootSpan.dataset.detail || null,
+    });
+  }
+
   // Initialize tabs - start with Civitai tab active
   switchTab("civitai");
 
   // Set up auto-scroll toggle from saved preference
-  const logBox = document.getElementById("log-box");
   const savedAutoScroll = localStorage.getItem("autoScroll");
   if (savedAutoScroll !== null) {
     autoScroll = savedAutoScroll === "true";
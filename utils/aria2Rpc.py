@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import urllib.error
+import urllib.request
+import uuid
+
+# where the viewer's aria2c daemon publishes its rpc url and secret
+RPC_STATE_FILE = os.environ.get("ARIA2_RPC_STATE_FILE", "/tmp/aria2-rpc.json")
+POLL_INTERVAL = 0.5
+
+STATUS_KEYS = [
+    "status",
+    "totalLength",
+    "completedLength",
+    "downloadSpeed",
+    "errorMessage",
+]
+
+
+class Aria2RpcError(Exception):
+    pass
+
+
+class Aria2Rpc:
+    """
+    Minimal aria2 JSON-RPC client over urllib, blocking calls run in a thread.
+    """
+
+    def __init__(self, url, secret=None, timeout=10):
+        self.url = url
+        self.secret = secret
+        self.timeout = timeout
+
+    @classmethod
+    def from_state_file(cls, path=RPC_STATE_FILE):
+        """Client for the daemon started by the log viewer, None when there is none"""
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            return cls(state["url"], state.get("secret"))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def call_sync(self, method, *params):
+        if self.secret:
+            params = (f"token:{self.secret}",) + params
+        payload = {
+            "jsonrpc": "2.0",
+            "id": uuid.uuid4().hex,
+            "method": method if "." in method else f"aria2.{method}",
+            "params": list(params),
+        }
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = json.load(response)
+        except urllib.error.HTTPError as e:
+            # aria2 answers rpc errors with a 4xx and a json body
+            try:
+                data = json.load(e)
+            except ValueError:
+                raise Aria2RpcError(f"{method}: HTTP {e.code}")
+        except (OSError, ValueError) as e:
+            raise Aria2RpcError(f"{method}: {e}")
+
+        if "error" in data:
+            raise Aria2RpcError(f"{method}: {data['error'].get('message')}")
+        return data.get("result")
+
+    async def call(self, method, *params):
+        return await asyncio.to_thread(self.call_sync, method, *params)
+
+    async def ping(self):
+        try:
+            await self.call("getVersion")
+            return True
+        except Aria2RpcError:
+            return False
+
+
+class Aria2Download:
+    """
+    One download handed to the aria2 daemon.
+
+    run() can be called again after pause() to continue the same gid.
+    """
+
+    def __init__(self, rpc, url, directory, filename=None, options=None):
+        self.rpc = rpc
+        self.url = url
+        self.options = {"dir": str(directory), "continue": "true", **(options or {})}
+        if filename:
+            self.options["out"] = filename
+        self.gid = None
+
+    async def run(self, tracker=None):
+        """Wait for the download to finish, returns (success, message)"""
+        if self.gid is not None:
+            try:
+                status = await self.rpc.call("tellStatus", self.gid, ["status"])
+                if status["status"] == "paused":
+                    await self.rpc.call("unpause", self.gid)
+            except Aria2RpcError:
+                # aria2c restarted and forgot the gid, --continue picks up the file
+                self.gid = None
+        if self.gid is None:
+            self.gid = await self.rpc.call("addUri", [self.url], self.options)
+
+        while True:
+            status = await self.rpc.call("tellStatus", self.gid, STATUS_KEYS)
+            total = int(status.get("totalLength") or 0)
+            done = int(status.get("completedLength") or 0)
+            speed = int(status.get("downloadSpeed") or 0)
+            if tracker:
+                tracker.update(
+                    {
+                        "done": done,
+                        "total": total or None,
+                        "percent": round(done * 100 / total, 1) if total else None,
+                        "speed": speed,
+                        "eta": (total - done) // speed if total and speed else None,
+                    }
+                )
+                tracker.check_stall()
+
+            if status["status"] == "complete":
+                if tracker:
+                    tracker.finish()
+                return True, "Download completed"
+            if status["status"] == "error":
+                return False, status.get("errorMessage") or "aria2 download failed"
+            if status["status"] == "removed":
+                return False, "Download removed from aria2"
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def pause(self):
+        if self.gid is not None:
+            try:
+                await self.rpc.call("forcePause", self.gid)
+            except Aria2RpcError as e:
+                print(f"Could not pause aria2 download {self.gid}: {e}")
+
+    async def remove(self):
+        if self.gid is not None:
+            try:
+                await self.rpc.call("forceRemove", self.gid)
+            except Aria2RpcError as e:
+                print(f"Could not remove aria2 download {self.gid}: {e}")
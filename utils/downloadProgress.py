@@ -0,0 +1,263 @@
+import asyncio
+import os
+import re
+import time
+from collections import deque
+
+# progress goes out at most this often per download
+PROGRESS_INTERVAL = 0.5
+# a download that hasn't gained a byte for this long is reported as stalled
+STALL_SECONDS = float(os.environ.get("DOWNLOAD_STALL_SECONDS", 60))
+STALL_CHECK_INTERVAL = 5
+# last lines of downloader output kept for error messages
+OUTPUT_TAIL_LINES = 200
+
+ANSI_PATTERN = re.compile(rb"\x1b\[[0-9;]*[A-Za-z]")
+LINE_SPLIT_PATTERN = re.compile(rb"[\r\n]")
+
+# [#2089b0 400.0MiB/1.0GiB(39%) CN:16 DL:115.4MiB ETA:5s]
+ARIA2C_PATTERN = re.compile(
+    r"\[#\w+ ([\d.]+[KMGTP]?i?B)/([\d.]+[KMGTP]?i?B)\((\d+)%\)"
+    r"(?:.*?DL:([\d.]+[KMGTP]?i?B))?(?:.*?ETA:(\w+))?"
+)
+ARIA2C_ETA_PATTERN = re.compile(r"(\d+)([hms])")
+# 45%|████▌     | 450MB/1.00GB [00:10<00:12, 45.0MB/s]
+GDOWN_PATTERN = re.compile(
+    r"(\d+)%\|.*\|\s*([\d.]+)\s*([kMGTP]?)B?/([\d.]+)\s*([kMGTP]?)B?"
+    r"\s*\[[\d:]+<([\d:?]+),\s*([\d.]+)\s*([kMGTP]?)B?/s"
+)
+
+UNITS = {"": 0, "K": 1, "M": 2, "G": 3, "T": 4, "P": 5}
+
+
+def _size(value, unit, base=1024):
+    return int(float(value) * base ** UNITS[unit.upper()])
+
+
+def _binary_size(text):
+    """400.0MiB / 1024M / 512k / 0 -> bytes, aria2c and curl both count in 1024"""
+    match = re.match(r"([\d.]+)\s*([kKMGTP]?)", text)
+    return _size(match.group(1), match.group(2)) if match else 0
+
+
+def _clock_seconds(text):
+    """00:12 / 1:00:12 -> seconds, None for --:--:-- and ?"""
+    try:
+        seconds = 0
+        for part in text.split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def _percent(done, total):
+    return round(done * 100 / total, 1) if total else None
+
+
+def parse_aria2c_progress(line):
+    match = ARIA2C_PATTERN.search(line)
+    if not match:
+        return None
+    done, total = _binary_size(match.group(1)), _binary_size(match.group(2))
+    eta = None
+    if match.group(5):
+        eta = sum(
+            int(value) * {"h": 3600, "m": 60, "s": 1}[unit]
+            for value, unit in ARIA2C_ETA_PATTERN.findall(match.group(5))
+        )
+    return {
+        "done": done,
+        "total": total or None,
+        "percent": int(match.group(3)),
+        "speed": _binary_size(match.group(4)) if match.group(4) else None,
+        "eta": eta,
+    }
+
+
+def parse_curl_progress(line):
+    # % Total % Received % Xferd Average-Dload Upload Total Spent Left Current
+    fields = line.split()
+    if len(fields) != 12 or not fields[0].isdigit() or not fields[2].isdigit():
+        return None
+    total = _binary_size(fields[1])
+    done = _binary_size(fields[3])
+    return {
+        "done": done,
+        "total": total or None,
+        "percent": _percent(done, total),
+        "speed": _binary_size(fields[11]),
+        "eta": _clock_seconds(fields[10]),
+    }
+
+
+def parse_gdown_progress(line):
+    match = GDOWN_PATTERN.search(line)
+    if not match:
+        return None
+    # tqdm unit_scale is decimal
+    done = _size(match.group(2), match.group(3), 1000)
+    total = _size(match.group(4), match.group(5), 1000)
+    return {
+        "done": done,
+        "total": total or None,
+        "percent": int(match.group(1)),
+        "speed": _size(match.group(7), match.group(8), 1000),
+        "eta": _clock_seconds(match.group(6)),
+    }
+
+
+PARSERS = {
+    "aria2c": parse_aria2c_progress,
+    "curl": parse_curl_progress,
+    "gdown": parse_gdown_progress,
+}
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if abs(size) < 1024 or unit == "TiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def describe_progress(progress):
+    """One line summary for logs: 39% 400.0 MiB/1.0 GiB 115.4 MiB/s ETA 5s"""
+    parts = []
+    if progress.get("percent") is not None:
+        parts.append(f"{progress['percent']:g}%")
+    done = format_bytes(progress.get("done") or 0)
+    if progress.get("total"):
+        done += f"/{format_bytes(progress['total'])}"
+    parts.append(done)
+    if progress.get("speed") is not None:
+        parts.append(f"{format_bytes(progress['speed'])}/s")
+    if progress.get("eta") is not None:
+        parts.append(f"ETA {progress['eta']}s")
+    if progress.get("stalled"):
+        parts.append("STALLED")
+    return " ".join(parts)
+
+
+class ProgressTracker:
+    """
+    Latest progress of one download, handed to on_update at most every interval.
+
+    on_stall is called once when no byte arrived for stall_after seconds,
+    progress carries stalled=True until bytes flow again.
+    """
+
+    def __init__(
+        self,
+        on_update=None,
+        on_stall=None,
+        interval=PROGRESS_INTERVAL,
+        stall_after=STALL_SECONDS,
+    ):
+        self.on_update = on_update
+        self.on_stall = on_stall
+        self.interval = interval
+        self.stall_after = stall_after
+        self.progress = {
+            "done": 0,
+            "total": None,
+            "percent": None,
+            "speed": None,
+            "eta": None,
+            "stalled": False,
+        }
+        self.last_advance = time.monotonic()
+        self.last_sent = 0
+
+    def update(self, progress):
+        now = time.monotonic()
+        if progress["done"] > self.progress["done"]:
+            self.last_advance = now
+            progress["stalled"] = False
+        self.progress.update(progress)
+        if now - self.last_sent >= self.interval:
+            self._send(now)
+
+    def check_stall(self):
+        now = time.monotonic()
+        if self.progress["stalled"] or now - self.last_advance < self.stall_after:
+            return
+        self.progress["stalled"] = True
+        self.progress["speed"] = 0
+        if self.on_stall:
+            self.on_stall(dict(self.progress), now - self.last_advance)
+        self._send(now)
+
+    def finish(self):
+        """Send the last state, so the final numbers aren't lost to throttling"""
+        self._send(time.monotonic())
+
+    def _send(self, now):
+        self.last_sent = now
+        if self.on_update:
+            self.on_update(dict(self.progress))
+
+
+async def _read_output(stream, parser, tracker, tail):
+    """Parse progress out of \\r/\\n separated output as it arrives, keep the rest"""
+    pending = b""
+    while True:
+        chunk = await stream.read(64 * 1024)
+        if not chunk:
+            break
+        lines = LINE_SPLIT_PATTERN.split(pending + chunk)
+        pending = lines.pop()
+        for line in lines:
+            line = ANSI_PATTERN.sub(b"", line)
+            if not line.strip():
+                continue
+            progress = None
+            if parser and tracker:
+                progress = parser(line.decode("utf-8", "replace"))
+            if progress:
+                tracker.update(progress)
+            else:
+                tail.append(line)
+    if pending.strip():
+        tail.append(pending)
+
+
+async def _watch_stall(tracker):
+    while True:
+        await asyncio.sleep(STALL_CHECK_INTERVAL)
+        tracker.check_stall()
+
+
+async def run_download_process(cmd, parser=None, tracker=None):
+    """
+    Run a downloader process and stream its progress into tracker.
+
+    parser is a key of PARSERS. Output isn't buffered whole, only the last
+    non-progress lines come back as (returncode, stdout, stderr). The
+    process is killed when the calling task is cancelled.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    parse = PARSERS.get(parser)
+    stdout_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    watcher = asyncio.create_task(_watch_stall(tracker)) if tracker else None
+
+    try:
+        await asyncio.gather(
+            _read_output(process.stdout, parse, tracker, stdout_tail),
+            _read_output(process.stderr, parse, tracker, stderr_tail),
+        )
+        await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    finally:
+        if watcher:
+            watcher.cancel()
+
+    if tracker:
+        tracker.finish()
+    return process.returncode, b"\n".join(stdout_tail), b"\n".join(stderr_tail)
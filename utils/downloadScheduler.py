@@ -0,0 +1,245 @@
+import asyncio
+import datetime
+import os
+import time
+from urllib.parse import urlparse
+
+from utils.downloadProgress import format_bytes
+
+# files downloading at once, the scheduler ramps up to this from INITIAL_CONCURRENT
+MAX_CONCURRENT = int(os.environ.get("BOOT_DOWNLOAD_MAX_CONCURRENT", 8))
+INITIAL_CONCURRENT = 2
+# files downloading at once from one host, lowered for a host whose downloads fail
+PER_HOST_LIMIT = int(os.environ.get("BOOT_DOWNLOAD_PER_HOST_LIMIT", 4))
+# connections shared by every running download, big files get the most
+CONNECTION_BUDGET = int(os.environ.get("BOOT_DOWNLOAD_CONNECTIONS", 32))
+MAX_SPLITS = 16
+# a file is only split in parts at least this big
+MIN_SPLIT_SIZE = 32 * 1024 * 1024
+RAMP_INTERVAL = 5
+REPORT_INTERVAL = 10
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class ScheduledDownload:
+    def __init__(self, url, size, start, tracker=None, name=None):
+        self.url = url
+        self.size = size
+        # start(splits) -> coroutine returning True on success
+        self.start = start
+        self.tracker = tracker
+        self.name = name or os.path.basename(urlparse(url).path)
+        self.host = urlparse(url).hostname
+        self.splits = None
+        self.state = QUEUED
+        # bumped by the user, starts right away whatever the limits say
+        self.priority = False
+
+    @property
+    def done(self):
+        return self.tracker.progress["done"] if self.tracker else 0
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "name": self.name,
+            "size": self.size,
+            "done": self.done,
+            "state": self.state,
+            "priority": self.priority,
+            "splits": self.splits,
+        }
+
+
+class DownloadScheduler:
+    """
+    Runs a batch of downloads so the last one finishes as early as possible.
+
+    files start largest first (unknown sizes count as largest), so a 28GB
+    model never starts at the end. The number of files running at once
+    ramps up while aggregate throughput still improves by >10% and steps
+    back once it stops, a host whose downloads fail gets fewer slots.
+    Connections are split between the running files by size. log gets a
+    progress line with the expected completion time every REPORT_INTERVAL.
+    bump() moves a queued file to the front, on_change(item) is called
+    whenever a file is bumped, starts or finishes.
+    """
+
+    def __init__(
+        self,
+        max_concurrent=MAX_CONCURRENT,
+        per_host_limit=PER_HOST_LIMIT,
+        connection_budget=CONNECTION_BUDGET,
+        log=print,
+        on_change=None,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_host_limit = per_host_limit
+        self.connection_budget = connection_budget
+        self.log = log
+        self.on_change = on_change
+        self.queue = []
+        self.items = []
+        self.host_limits = {}
+        self.finished_bytes = 0
+        self.results = {}
+
+    def add(self, url, size, start, tracker=None, name=None):
+        item = ScheduledDownload(url, size, start, tracker, name)
+        self.queue.append(item)
+        self.items.append(item)
+
+    def get(self, url):
+        return next((item for item in self.items if item.url == url), None)
+
+    def bump(self, url):
+        """
+        Start a queued file next, returns it (None for an unknown url).
+
+        it starts within a second even when every slot is taken, a file
+        that is already running or finished is left as it is.
+        """
+        item = self.get(url)
+        if item is not None and item.state == QUEUED and not item.priority:
+            item.priority = True
+            self.queue.remove(item)
+            self.queue.insert(0, item)
+            self.log(f"Moved {item.name} to the front of the queue")
+            self._changed(item)
+        return item
+
+    def _changed(self, item):
+        if self.on_change:
+            self.on_change(item)
+
+    def _next(self, running):
+        per_host = {}
+        for item in running.values():
+            per_host[item.host] = per_host.get(item.host, 0) + 1
+        for item in self.queue:
+            limit = self.host_limits.get(item.host, self.per_host_limit)
+            if per_host.get(item.host, 0) < limit:
+                self.queue.remove(item)
+                return item
+        return None
+
+    def _splits(self, item, target):
+        share = max(1, self.connection_budget // target)
+        if item.size is None:
+            return min(share, MAX_SPLITS)
+        return max(1, min(share, MAX_SPLITS, item.size // MIN_SPLIT_SIZE))
+
+    def _start(self, item, running, target):
+        item.splits = self._splits(item, target)
+        item.state = RUNNING
+        size = format_bytes(item.size) if item.size else "unknown size"
+        self.log(f"Starting {item.name} ({size}, {item.splits} connections)")
+        running[asyncio.create_task(item.start(item.splits))] = item
+        self._changed(item)
+
+    def _bytes_done(self, running):
+        return self.finished_bytes + sum(item.done for item in running.values())
+
+    def _report(self, running, started, speed):
+        done = self._bytes_done(running)
+        total = done
+        remaining = unknown = 0
+        for item in self.items:
+            if not item.size:
+                unknown += 1
+            elif item.url not in self.results:
+                left = max(0, item.size - item.done)
+                remaining += left
+                total += left
+        line = (
+            f"Models: {len(self.results)}/{len(self.items)} done, "
+            f"{len(running)} running, {format_bytes(done)}/{format_bytes(total)} "
+            f"at {format_bytes(speed)}/s"
+        )
+        # unknown sizes can't be estimated, the ETA covers the rest
+        if speed > 0 and remaining:
+            eta = remaining / speed
+            ready = datetime.datetime.now() + datetime.timedelta(seconds=eta)
+            line += f", ETA {int(eta)}s (ready at {ready:%H:%M:%S})"
+        if unknown:
+            line += f", {unknown} of unknown size"
+        self.log(f"{line}, elapsed {int(time.monotonic() - started)}s")
+
+    async def run(self):
+        """Run everything that was added, returns {url: success}"""
+        # unknown sizes first, then largest first
+        self.queue.sort(key=lambda item: -(item.size or float("inf")))
+        running = {}
+        target = min(INITIAL_CONCURRENT, self.max_concurrent)
+        ramping = True
+        best_speed = 0
+        started = last_ramp = last_report = time.monotonic()
+        ramp_done = report_done = 0
+
+        try:
+            while self.queue or running:
+                for item in [item for item in self.queue if item.priority]:
+                    self.queue.remove(item)
+                    self._start(item, running, target)
+                while len(running) < target:
+                    item = self._next(running)
+                    if item is None:
+                        break
+                    self._start(item, running, target)
+
+                if not running:
+                    break
+                finished, _ = await asyncio.wait(
+                    running, timeout=1, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in finished:
+                    item = running.pop(task)
+                    try:
+                        success = bool(task.result())
+                    except Exception as e:
+                        self.log(f"Error downloading {item.name}: {e}")
+                        success = False
+                    self.results[item.url] = success
+                    # a failed file only got as far as it got
+                    self.finished_bytes += (
+                        (item.size or item.done) if success else item.done
+                    )
+                    item.state = COMPLETED if success else FAILED
+                    self._changed(item)
+                    if not success:
+                        # fewer parallel files for a host that is turning us away
+                        limit = self.host_limits.get(item.host, self.per_host_limit)
+                        self.host_limits[item.host] = max(1, limit - 1)
+
+                now = time.monotonic()
+                done = self._bytes_done(running)
+
+                # one more file at a time while that still buys >10% throughput
+                if ramping and now - last_ramp >= RAMP_INTERVAL:
+                    ramp_speed = (done - ramp_done) / (now - last_ramp)
+                    if ramp_speed < best_speed * 0.9 and target > 1:
+                        # the last step made things worse, give it back
+                        target -= 1
+                        ramping = False
+                    elif ramp_speed > best_speed * 1.1:
+                        if self.queue and target < self.max_concurrent:
+                            target += 1
+                    else:
+                        ramping = False
+                    best_speed = max(best_speed, ramp_speed)
+                    ramp_done, last_ramp = done, now
+
+                if now - last_report >= REPORT_INTERVAL:
+                    speed = (done - report_done) / (now - last_report)
+                    self._report(running, started, speed)
+                    report_done, last_report = done, now
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+        return self.results
@@ -0,0 +1,91 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+
+# inotify flags from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def _inotify_fd(directory):
+    """Create a non-blocking inotify fd watching directory, None when unavailable"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class FileWatcher:
+    """
+    Wait for changes in a directory from inside the event loop.
+
+    uses inotify when the kernel has it, otherwise polls with an interval
+    that backs off while nothing happens and snaps back on activity.
+    """
+
+    MIN_POLL_INTERVAL = 0.05
+    MAX_POLL_INTERVAL = 1.0
+    # even with inotify wake up now and then, events can be missed on some mounts
+    SAFETY_INTERVAL = 2.0
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.poll_interval = self.MIN_POLL_INTERVAL
+        self.changed = asyncio.Event()
+        self.fd = _inotify_fd(directory)
+        if self.fd is not None:
+            asyncio.get_running_loop().add_reader(self.fd, self._on_inotify)
+        else:
+            print(f"inotify unavailable for {directory}, falling back to polling")
+
+    @property
+    def uses_inotify(self):
+        return self.fd is not None
+
+    def _on_inotify(self):
+        # we only care that something happened, drain and discard the events
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        self.changed.set()
+
+    async def wait(self):
+        """Return once the directory has (probably) changed"""
+        if self.fd is None:
+            await asyncio.sleep(self.poll_interval)
+            self.poll_interval = min(self.poll_interval * 2, self.MAX_POLL_INTERVAL)
+            return
+
+        try:
+            await asyncio.wait_for(self.changed.wait(), self.SAFETY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self.changed.clear()
+
+    def activity(self):
+        """Something was read, poll quickly again"""
+        self.poll_interval = self.MIN_POLL_INTERVAL
+
+    def close(self):
+        if self.fd is not None:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
@@ -1,12 +1,39 @@
 import html
 import re
 from datetime import datetime
+from typing import NamedTuple
 
+# compiled once, these run on every line the tailer reads
+TIMESTAMP_PATTERN = re.compile(r"^\[([\d\-\s:]+)\]")
+ERROR_PATTERN = re.compile(r"error|exception|fail|critical", re.IGNORECASE)
+WARNING_PATTERN = re.compile(r"warn|caution", re.IGNORECASE)
 
-def format_log_line(line, ws=False):
-    """Format a log line to match Docker container log style"""
+
+class LogRecord(NamedTuple):
+    """A raw log line with its level and ws html, built once when the line is read"""
+
+    line: str
+    level: str
+    html: str
+
+    @property
+    def html_line(self):
+        return f"<div class='log-line'>{self.html}</div>"
+
+
+def classify_log_line(content):
+    """Return the css class for a log line based on its content"""
+    if ERROR_PATTERN.search(content):
+        return "log-error"
+    if WARNING_PATTERN.search(content):
+        return "log-warning"
+    return "log-info"
+
+
+def make_log_record(line):
+    """Split timestamp, classify and escape a log line"""
     # Extract timestamp if present, or generate one
-    timestamp_match = re.search(r"^\[([\d\-\s:]+)\]", line)
+    timestamp_match = TIMESTAMP_PATTERN.search(line)
     if timestamp_match:
         timestamp = timestamp_match.group(1)
         content = line[len(timestamp_match.group(0)) :].strip()
@@ -14,15 +41,15 @@ def format_log_line(line, ws=False):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
         content = line
 
-    # Determine log level based on content
-    css_class = "log-info"
-    if re.search(r"error|exception|fail|critical", content, re.IGNORECASE):
-        css_class = "log-error"
-    elif re.search(r"warn|caution", content, re.IGNORECASE):
-        css_class = "log-warning"
+    css_class = classify_log_line(content)
+    return LogRecord(
+        line,
+        css_class,
+        f"<span class='log-timestamp'>{timestamp}</span><span class='{css_class}'>{html.escape(content)}</span>",
+    )
 
-    # Format the line with HTML
-    if ws:
-        return f"<span class='log-timestamp'>{timestamp}</span><span class='{css_class}'>{html.escape(content)}</span>"
 
-    return f"<div class='log-line'><span class='log-timestamp'>{timestamp}</span><span class='{css_class}'>{html.escape(content)}</span></div>"
+def format_log_line(line, ws=False):
+    """Format a log line to match Docker container log style"""
+    record = make_log_record(line)
+    return record.html if ws else record.html_line
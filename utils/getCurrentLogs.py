@@ -1,7 +1,6 @@
 from datetime import datetime
 
 from constants.logLock import log_buffer, log_lock
-from utils.formatLogLine import format_log_line
 
 
 def get_current_logs():
@@ -14,12 +13,11 @@ def get_current_logs():
         if log_buffer:
             formatted_logs = []
             prev_line = None
-            for line in log_buffer:
-                if line != prev_line:  # Avoid duplicate consecutive lines
-                    # Format the log line with timestamp and color coding
-                    formatted_line = format_log_line(line)
-                    formatted_logs.append(formatted_line)
-                prev_line = line
+            for record in log_buffer:
+                if record.line != prev_line:  # Avoid duplicate consecutive lines
+                    # already formatted with timestamp and color coding by the tailer
+                    formatted_logs.append(record.html_line)
+                prev_line = record.line
             return header + "\n".join(formatted_logs)
         else:
             return (
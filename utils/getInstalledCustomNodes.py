@@ -1,51 +1,256 @@
+import json
 import os
 
+from utils.provisionCustomNodes import CUSTOM_NODES_DIR, load_manifest, load_results
 
-def get_installed_custom_nodes():
-    """Get a list of installed custom nodes from start.sh"""
-    custom_nodes = []
+# per node git metadata and size, reused while the node's directories keep their mtime
+CACHE_FILE = os.environ.get(
+    "CUSTOM_NODES_CACHE_FILE",
+    os.path.join("/workspace", ".cache", "custom_nodes.json"),
+)
+
+_cache = None
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _git_dir(repo_path):
+    """.git of a clone, following the gitdir: file of worktrees and submodules"""
+    git_path = os.path.join(repo_path, ".git")
+    if os.path.isdir(git_path):
+        return git_path
+    content = _read(git_path)
+    if content and content.startswith("gitdir:"):
+        git_dir = content[len("gitdir:") :].strip()
+        return os.path.normpath(os.path.join(repo_path, git_dir))
+    return None
+
+
+def _common_dir(git_dir):
+    """where a worktree's refs and config live, git_dir itself for a plain clone"""
+    common = _read(os.path.join(git_dir, "commondir"))
+    return os.path.normpath(os.path.join(git_dir, common)) if common else git_dir
 
+
+def _resolve_ref(git_dir, ref):
+    for base in (git_dir, _common_dir(git_dir)):
+        commit = _read(os.path.join(base, ref))
+        if commit:
+            return commit
+    packed = _read(os.path.join(_common_dir(git_dir), "packed-refs")) or ""
+    for line in packed.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == ref:
+            return parts[0]
+    return None
+
+
+def _remote_url(git_dir):
+    """url of origin, or of the first remote when there is no origin"""
+    remotes = {}
+    remote = None
+    for line in (_read(os.path.join(git_dir, "config")) or "").splitlines():
+        line = line.strip()
+        if line.startswith("["):
+            remote = None
+            if line.startswith("[remote "):
+                remote = line[len("[remote ") : -1].strip('"')
+        elif remote and line.startswith("url"):
+            remotes.setdefault(remote, line.split("=", 1)[1].strip())
+    return remotes.get("origin") or next(iter(remotes.values()), None)
+
+
+def read_git_metadata(repo_path):
+    """HEAD commit, branch and remote of a clone from its .git files, no git process"""
+    git_dir = _git_dir(repo_path)
+    if git_dir is None:
+        return None
+    head = _read(os.path.join(git_dir, "HEAD")) or ""
+    branch = None
+    if head.startswith("ref:"):
+        ref = head[len("ref:") :].strip()
+        branch = ref.rsplit("/", 1)[-1] if ref.startswith("refs/heads/") else ref
+        commit = _resolve_ref(git_dir, ref)
+    else:
+        commit = head or None
+    return {
+        "commit": commit,
+        "branch": branch,
+        "url": _remote_url(_common_dir(git_dir)),
+    }
+
+
+def _tree_size(path):
+    total = 0
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def _mtime(path):
     try:
-        # Check multiple possible locations for start.sh
-        start_sh_paths = [
-            "/start.sh",
-            "./start.sh",
-            "/workspace/start.sh",
-            os.path.join(os.path.dirname(__file__), "start.sh"),
-        ]
-        start_sh_content = None
-
-        for path in start_sh_paths:
-            if os.path.exists(path):
-                with open(path, "r") as file:
-                    start_sh_content = file.read()
-                break
-
-        if not start_sh_content:
-            print("Warning: start.sh not found in expected locations")
-            return []
-
-        # Extract git clone lines for custom nodes
-        import re
-
-        pattern = r"git clone --depth=1 (https://github.com/[^/]+/([^\.]+)\.git)"
-        matches = re.findall(pattern, start_sh_content)
-
-        for match in matches:
-            repo_url, repo_name = match
-            # Extract the actual repository name from the URL
-            repo_name_clean = repo_url.split("/")[-1].replace(".git", "")
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
 
+def _node_info(entry):
+    # ComfyUI-Manager disables a node by renaming it to <name>.disabled
+    name = entry.name
+    enabled = not name.endswith(".disabled")
+    if not enabled:
+        name = name[: -len(".disabled")]
+
+    if entry.is_file():
+        return {
+            "name": name[:-3] if name.endswith(".py") else name,
+            "path": entry.path,
+            "version": "local",
+            "url": None,
+            "commit": None,
+            "branch": None,
+            "size": entry.stat().st_size,
+            "enabled": enabled,
+            "status": "installed",
+        }
+
+    git = read_git_metadata(entry.path)
+    commit = git["commit"] if git else None
+    # a failed clone leaves an empty or half written directory
+    complete = os.path.exists(os.path.join(entry.path, "__init__.py"))
+    return {
+        "name": name,
+        "path": entry.path,
+        "version": commit[:7] if commit else "local",
+        "url": git["url"] if git else None,
+        "commit": commit,
+        "branch": git["branch"] if git else None,
+        "size": _tree_size(entry.path),
+        "enabled": enabled,
+        "status": "installed" if complete else "incomplete",
+    }
+
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_FILE, "r") as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _save_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp_path = f"{CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f, separators=(",", ":"))
+        os.replace(tmp_path, CACHE_FILE)
+    except OSError as e:
+        print(f"Could not save custom node cache: {e}")
+
+
+def _with_manifest(custom_nodes):
+    """
+    Add the manifest's pin and the last provisioning result to the nodes.
+
+    enabled manifest entries that aren't on disk are listed too, as failed
+    (with the error) or missing, so a clone that didn't work shows up.
+    """
+    _, entries = load_manifest()
+    results = load_results()
+    by_name = {node["name"]: i for i, node in enumerate(custom_nodes)}
+    for entry in entries:
+        result = results.get(entry["name"], {})
+        provision = {
+            "pinned": entry["commit"],
+            "provision_status": result.get("status"),
+            "error": result.get("error"),
+        }
+        if entry["name"] in by_name:
+            i = by_name[entry["name"]]
+            custom_nodes[i] = {**custom_nodes[i], **provision}
+        elif entry["enabled"]:
             custom_nodes.append(
                 {
-                    "name": repo_name_clean,
-                    "path": f"/workspace/ComfyUI/custom_nodes/{repo_name_clean}",
-                    "version": "Installed",
-                    "url": repo_url,
+                    "name": entry["name"],
+                    "path": os.path.join(CUSTOM_NODES_DIR, entry["name"]),
+                    "version": entry["commit"][:7] if entry["commit"] else "-",
+                    "url": entry["repo"],
+                    "commit": None,
+                    "branch": None,
+                    "size": 0,
+                    "enabled": True,
+                    "status": "failed" if result.get("error") else "missing",
+                    **provision,
                 }
             )
-    except Exception as e:
-        print(f"Error parsing custom nodes from start.sh: {e}")
+    return custom_nodes
+
+
+def get_installed_custom_nodes():
+    """
+    Get a list of installed custom nodes from custom_nodes itself
+
+    whatever is on disk counts, cloned from the manifest or installed through
+    ComfyUI-Manager. A node is re-read only when the mtime of its directory
+    or its .git changed (a pull rewrites ORIG_HEAD/FETCH_HEAD in .git).
+    """
+    global _cache
+    cache = _load_cache()
+    custom_nodes = []
+    fresh = {}
+
+    try:
+        with os.scandir(CUSTOM_NODES_DIR) as it:
+            entries = [
+                entry
+                for entry in it
+                if not entry.name.startswith((".", "__"))
+                and (entry.is_dir() or entry.name.endswith((".py", ".py.disabled")))
+            ]
+    except OSError:
+        print(f"Note: {CUSTOM_NODES_DIR} doesn't exist yet")
+        return []
+
+    for entry in entries:
+        try:
+            key = [_mtime(entry.path), _mtime(os.path.join(entry.path, ".git"))]
+            cached = cache.get(entry.name)
+            if cached and cached["key"] == key:
+                info = cached["info"]
+            else:
+                info = _node_info(entry)
+            fresh[entry.name] = {"key": key, "info": info}
+            custom_nodes.append(info)
+        except OSError as e:
+            print(f"Error reading custom node {entry.path}: {e}")
+
+    if fresh != cache:
+        _cache = fresh
+        _save_cache(fresh)
 
     # Sort alphabetically
-    return sorted(custom_nodes, key=lambda x: x["name"].lower())
+    return sorted(_with_manifest(custom_nodes), key=lambda x: x["name"].lower())
@@ -1,24 +1,25 @@
+import asyncio
 import os
 import sys
-from urllib.parse import urlparse
 
+from utils.modelInventory import (
+    INSTALLED,
+    MISSING,
+    PARTIAL,
+    model_filename,
+    model_inventory,
+)
+from utils.modelsConfig import models_config
 
-def check_model_exists(url):
+
+def check_model_exists(url, inventory=None):
     """Check if a model file exists in ComfyUI models directories"""
     try:
-        filename = os.path.basename(urlparse(url).path)
+        filename = model_filename(url)
         if not filename:
             return False
-        
-        # Search in all model directories
-        models_base = "/workspace/ComfyUI/models"
-        if not os.path.exists(models_base):
-            return False
-            
-        for root, dirs, files in os.walk(models_base):
-            if filename in files:
-                return True
-        return False
+        inventory = inventory or model_inventory.refresh()
+        return inventory.status(filename) == INSTALLED
     except Exception:
         return False
 
@@ -35,30 +36,16 @@ def check_missing_models(config_file):
             config = json.load(f)
         
         missing_count = 0
-        
-        # Handle different config formats
-        if isinstance(config, dict):
-            # Standard format: {"category": ["url1", "url2"]}
-            for category, urls in config.items():
-                if isinstance(urls, list):
-                    for url in urls:
-                        if isinstance(url, str) and url.startswith('http'):
-                            if not check_model_exists(url):
-                                print(f"Missing model: {url}")
-                                missing_count += 1
-                elif isinstance(urls, str) and urls.startswith('http'):
-                    # Single URL as string
-                    if not check_model_exists(urls):
-                        print(f"Missing model: {urls}")
-                        missing_count += 1
-        elif isinstance(config, list):
-            # Array format: ["url1", "url2"]
-            for url in config:
-                if isinstance(url, str) and url.startswith('http'):
-                    if not check_model_exists(url):
-                        print(f"Missing model: {url}")
-                        missing_count += 1
-        
+
+        # one scan of the models tree answers every url, any config format
+        for model in model_inventory.refresh().check_config(config):
+            if model["status"] == PARTIAL:
+                print(f"Partially downloaded model: {model['url']}")
+                missing_count += 1
+            elif model["status"] == MISSING:
+                print(f"Missing model: {model['url']}")
+                missing_count += 1
+
         return missing_count > 0
         
     except Exception as e:
@@ -66,42 +53,18 @@ def check_missing_models(config_file):
         return True
 
 
-def get_installed_models():
-    """Get a list of installed models from models_config.json"""
+def get_installed_models(model_config=None):
+    """
+    Get a list of installed models from models_config.json
+
+    async callers pass the config from `await models_config.get()`, without
+    one it is loaded here, blocking.
+    """
     models = {}
 
     try:
-        import json
-        import urllib.request
-        
-        model_config = None
-        
-        # Check if MODELS_CONFIG_URL is set and try to fetch from URL first
-        models_config_url = os.getenv("MODELS_CONFIG_URL")
-        if models_config_url and models_config_url.startswith("http"):
-            try:
-                print(f"Fetching model config from URL: {models_config_url}")
-                with urllib.request.urlopen(models_config_url) as response:
-                    model_config = json.loads(response.read().decode())
-                print("Successfully loaded model config from custom URL")
-            except Exception as e:
-                print(f"Failed to fetch model config from URL {models_config_url}: {e}")
-                print("Falling back to local config files...")
-        
-        # If URL fetch failed or no URL provided, check local files
-        if not model_config:
-            config_paths = [
-                "/workspace/models_config.json",
-                "./models_config.json",
-                os.path.join(os.path.dirname(__file__), "models_config.json"),
-            ]
-
-            for path in config_paths:
-                if os.path.exists(path):
-                    with open(path, "r") as file:
-                        model_config = json.load(file)
-                    print(f"Loaded model config from local file: {path}")
-                    break
+        if model_config is None:
+            model_config = asyncio.run(models_config.get())
 
         if not model_config:
             print("Warning: models_config.json not found in expected locations")
@@ -114,6 +77,8 @@ def get_installed_models():
                 f"Note: {comfyui_models_dir} doesn't exist yet. Will show models from config only."
             )
 
+        inventory = model_inventory.refresh()
+
         # Process each model category
         for category, urls in model_config.items():
             if urls:  # Only process non-empty categories
@@ -121,6 +86,8 @@ def get_installed_models():
                 for url in urls:
                     # Extract filename from URL
                     filename = url.split("/")[-1]
+                    installed_name = model_filename(url)
+                    _, size = inventory.locate(installed_name)
 
                     # Add model information
                     model_files.append(
@@ -128,6 +95,8 @@ def get_installed_models():
                             "name": filename,
                             "path": f"/workspace/ComfyUI/models/{category}/{filename}",
                             "url": url,
+                            "status": inventory.status(installed_name, category),
+                            "size": size,
                         }
                     )
 
@@ -145,7 +114,7 @@ def get_installed_models():
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "--check-missing":
         if len(sys.argv) != 3:
-            print("Usage: python getInstalledModels.py --check-missing <config_file>", file=sys.stderr)
+            print("Usage: python -m utils.getInstalledModels --check-missing <config_file>", file=sys.stderr)
             sys.exit(1)
         
         config_file = sys.argv[2]
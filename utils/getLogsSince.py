@@ -0,0 +1,20 @@
+from constants.logLock import log_buffer, log_lock
+
+
+def get_logs_since(since, epoch=None):
+    """
+    Get the lines a client missed after sequence number since.
+
+    when the buffer no longer holds everything after since (or the viewer
+    restarted) the whole buffer is returned with reset=True so the client
+    starts over.
+    """
+    with log_lock:
+        reset = log_buffer.has_gap(since, epoch)
+        records = log_buffer.since(0 if reset else since)
+        return {
+            "lines": [record.html for _, record in records],
+            "seq": log_buffer.last_seq,
+            "epoch": log_buffer.epoch,
+            "reset": reset,
+        }
@@ -0,0 +1,140 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+
+# sha256 of downloaded models, keyed by path and trusted while size and mtime match
+HASH_MANIFEST_FILE = os.environ.get(
+    "HASH_MANIFEST_FILE", os.path.join("/workspace", ".cache", "model_hashes.json")
+)
+HASH_READ_SIZE = 8 * 1024 * 1024
+
+SHA256_PATTERN = re.compile(r'^(?:W/)?"?([0-9a-f]{64})"?$')
+
+
+def expected_sha256(headers):
+    """
+    sha256 the server vouches for, None when it doesn't say.
+
+    HF answers LFS files with X-Linked-Etag: "<sha256>" on the resolve
+    redirect, plain git files get a sha1 there and are skipped.
+    """
+    match = SHA256_PATTERN.match(headers.get("X-Linked-Etag", "").strip().lower())
+    return match.group(1) if match else None
+
+
+def sha256_file(path):
+    """Hex sha256 of a whole file, blocking"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StreamingHasher:
+    """
+    sha256 of a file that is written out of order.
+
+    bytes written at the hash frontier are hashed straight from the write
+    buffer, ranges written ahead of it are read back once the frontier
+    reaches them, while they are still in the page cache.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.digest = hashlib.sha256()
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def feed(self, offset, data):
+        """Call after data was written at offset"""
+        with self.lock:
+            if offset == self.position:
+                self.digest.update(data)
+                self.position += len(data)
+
+    def catch_up(self, limit):
+        """Hash what is on disk up to limit, blocking, run it in a thread"""
+        while True:
+            with self.lock:
+                if self.position >= limit:
+                    return
+                size = min(HASH_READ_SIZE, limit - self.position)
+                data = os.pread(self.fd, size, self.position)
+                if not data:
+                    return
+                self.digest.update(data)
+                self.position += len(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class HashManifest:
+    """
+    Persisted {path: {size, mtime_ns, sha256, verified}}.
+
+    verified means the hash matched the one the server published. The viewer
+    and download_models.py both write it, updates merge under a file lock.
+    """
+
+    def __init__(self, path=HASH_MANIFEST_FILE):
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, path):
+        """Entry for path when the file is unchanged since it was hashed"""
+        entry = self._read().get(os.path.abspath(path))
+        if entry is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+            return None
+        return entry
+
+    def record(self, path, sha256, verified=False):
+        st = os.stat(path)
+        self._update(
+            os.path.abspath(path),
+            {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "sha256": sha256,
+                "verified": verified,
+            },
+        )
+
+    def forget(self, path):
+        self._update(os.path.abspath(path), None)
+
+    def _update(self, key, entry):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self._read()
+            if entry is None:
+                if manifest.pop(key, None) is None:
+                    return
+            else:
+                manifest[key] = entry
+            # drop files that are gone
+            manifest = {p: e for p, e in manifest.items() if os.path.exists(p)}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+hash_manifest = HashManifest()
@@ -0,0 +1,100 @@
+import os
+import struct
+import threading
+
+# one record per log line: byte offset where the line starts + level code
+RECORD = struct.Struct("<QB")
+# magic, inode of the indexed log, log bytes covered, number of records
+HEADER = struct.Struct("<8sQQQ")
+MAGIC = b"CLOGIDX1"
+
+LEVELS = ["info", "warning", "error"]
+# css classes from utils.formatLogLine -> level code stored in the index
+LEVEL_CODES = {"log-info": 0, "log-warning": 1, "log-error": 2}
+
+
+class LogIndex:
+    """
+    Line offset index of a log file, persisted next to it as <log>.idx.
+
+    the tailer adds a record for every line it reads so paging and search can
+    jump straight to any line of the history without scanning the log.
+    """
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.path = log_file + ".idx"
+        self.fd = None
+        self.inode = 0
+        # log bytes covered by the index and number of lines, only what's on disk
+        self.end = 0
+        self.count = 0
+        self.pending = bytearray()
+        self.pending_count = 0
+        # readers mmap the log, rotation must not truncate it under them
+        self.lock = threading.Lock()
+        self.readers = 0
+
+    def open(self, inode, size):
+        """Load the index of the log with this inode, returns the log offset to resume at"""
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        header = os.pread(self.fd, HEADER.size, 0)
+        if len(header) == HEADER.size:
+            magic, idx_inode, end, count = HEADER.unpack(header)
+            complete = os.fstat(self.fd).st_size >= HEADER.size + count * RECORD.size
+            if magic == MAGIC and idx_inode == inode and end <= size and complete:
+                self.inode, self.end, self.count = inode, end, count
+                self.pending.clear()
+                self.pending_count = 0
+                return end
+
+        self.reset(inode)
+        return 0
+
+    def reset(self, inode):
+        """Start over for a new or truncated log"""
+        os.ftruncate(self.fd, 0)
+        self.inode = inode
+        self.end = 0
+        self.count = 0
+        self.pending.clear()
+        self.pending_count = 0
+        self._write_header()
+
+    def add(self, offset, level):
+        self.pending += RECORD.pack(offset, level)
+        self.pending_count += 1
+
+    def flush(self, end):
+        """Write pending records, end is the log offset right after the last indexed line"""
+        if not self.pending and end == self.end:
+            return
+        if self.pending:
+            os.pwrite(self.fd, self.pending, HEADER.size + self.count * RECORD.size)
+            self.count += self.pending_count
+            self.pending.clear()
+            self.pending_count = 0
+        self.end = end
+        self._write_header()
+
+    def _write_header(self):
+        os.pwrite(self.fd, HEADER.pack(MAGIC, self.inode, self.end, self.count), 0)
+
+    def records(self, start, stop):
+        """Return [(offset, level)] for lines start..stop-1"""
+        stop = min(stop, self.count)
+        if self.fd is None or start >= stop:
+            return []
+        data = os.pread(
+            self.fd, (stop - start) * RECORD.size, HEADER.size + start * RECORD.size
+        )
+        # cut a record that was half written by a reset in between
+        data = data[: len(data) - len(data) % RECORD.size]
+        return list(RECORD.iter_unpack(data))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,154 @@
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+
+# the live log is rotated into a gzip segment once it is this big or this old
+ROTATE_MAX_BYTES = int(os.environ.get("LOG_ROTATE_MAX_BYTES", 64 * 1024 * 1024))
+ROTATE_MAX_AGE = float(os.environ.get("LOG_ROTATE_MAX_AGE", 24 * 60 * 60))
+# oldest segments are deleted past either limit
+RETENTION_SEGMENTS = int(os.environ.get("LOG_RETENTION_SEGMENTS", 20))
+RETENTION_BYTES = int(float(os.environ.get("LOG_RETENTION_MAX_GB", 1)) * 1024**3)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def compress_segment(log_file, end, path):
+    """gzip the first end bytes of the log into path, runs in a worker thread"""
+    with open(log_file, "rb") as src, gzip.open(path, "wb", compresslevel=6) as dst:
+        remaining = end
+        while remaining:
+            chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            dst.write(chunk)
+            remaining -= len(chunk)
+    _fsync(path)
+
+
+def append_segment(log_file, start, end, path):
+    """gzip bytes [start, end) of the log onto the segment at path, runs in a worker thread"""
+    with open(log_file, "rb") as src, gzip.open(path, "ab", compresslevel=6) as dst:
+        src.seek(start)
+        remaining = end - start
+        while remaining:
+            chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            dst.write(chunk)
+            remaining -= len(chunk)
+    _fsync(path)
+
+
+def _fsync(path):
+    # the live log is truncated right after, the segment has to be on disk by then
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class LogSegments:
+    """
+    Compressed segments rotated out of a log, listed in <log>.segments.json.
+
+    line numbers continue across segments: base is the number of the first
+    line in the live log, every segment knows its first line and line count.
+    """
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.log_dir = os.path.dirname(log_file)
+        self.path = log_file + ".segments.json"
+        # {"file", "first", "lines", "bytes", "started", "ended"}, oldest first
+        self.segments = []
+        self.base = 0
+        # when the live log was started, for age based rotation
+        self.started = time.time()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        self.segments = [
+            segment
+            for segment in data.get("segments", [])
+            if os.path.exists(os.path.join(self.log_dir, segment["file"]))
+        ]
+        self.base = data.get("base", 0)
+        self.started = data.get("started") or time.time()
+        self.save()
+
+        # leftovers of a rotation that was interrupted
+        prefix = os.path.basename(self.log_file) + "."
+        for name in os.listdir(self.log_dir):
+            if name.startswith(prefix) and name.endswith(".gz.tmp"):
+                os.remove(os.path.join(self.log_dir, name))
+
+    def save(self):
+        data = {"base": self.base, "started": self.started, "segments": self.segments}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    @property
+    def first_line(self):
+        return self.segments[0]["first"] if self.segments else self.base
+
+    def rotation_due(self, size):
+        if size >= ROTATE_MAX_BYTES:
+            return True
+        return size > 0 and time.time() - self.started >= ROTATE_MAX_AGE
+
+    def new_segment_path(self):
+        name = os.path.basename(self.log_file)
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.log_dir, f"{name}.{timestamp}.gz")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.log_dir, f"{name}.{timestamp}-{suffix}.gz")
+            suffix += 1
+        return path
+
+    def add(self, path, lines):
+        """Record a finished segment holding the live log's lines, then apply retention"""
+        now = time.time()
+        self.segments.append(
+            {
+                "file": os.path.basename(path),
+                "first": self.base,
+                "lines": lines,
+                "bytes": os.path.getsize(path),
+                "started": self.started,
+                "ended": now,
+            }
+        )
+        self.base += lines
+        self.started = now
+        self.prune()
+        self.save()
+
+    def prune(self):
+        total = sum(segment["bytes"] for segment in self.segments)
+        while self.segments and (
+            len(self.segments) > RETENTION_SEGMENTS or total > RETENTION_BYTES
+        ):
+            segment = self.segments.pop(0)
+            total -= segment["bytes"]
+            try:
+                os.remove(os.path.join(self.log_dir, segment["file"]))
+            except FileNotFoundError:
+                pass
+            print(f"Removed old log segment {segment['file']}")
+
+    def iter_lines(self, segment):
+        """Yield the raw lines of a segment without line endings"""
+        with gzip.open(os.path.join(self.log_dir, segment["file"]), "rb") as f:
+            for line in f:
+                yield line.rstrip(b"\r\n")
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+from urllib.parse import urlparse
+
+from utils.stagedDownload import MODELS_DIR, PARTIAL_SUFFIX, STAGING_DIR, partial_path
+
+# last scan of the models tree, directories whose mtime didn't change are reused
+INVENTORY_FILE = os.environ.get(
+    "MODEL_INVENTORY_FILE",
+    os.path.join("/workspace", ".cache", "model_inventory.json"),
+)
+
+INSTALLED = "installed"
+PARTIAL = "partial"
+MISSING = "missing"
+
+
+def model_filename(url):
+    return os.path.basename(urlparse(url).path)
+
+
+def iter_config_urls(config):
+    """(category, url) of every model in a models config, category None for a bare list"""
+    if isinstance(config, dict):
+        for category, urls in config.items():
+            if isinstance(urls, str):
+                urls = [urls]
+            if not isinstance(urls, list):
+                continue
+            for url in urls:
+                if isinstance(url, str) and url.startswith("http"):
+                    yield category, url
+    elif isinstance(config, list):
+        for url in config:
+            if isinstance(url, str) and url.startswith("http"):
+                yield None, url
+
+
+class ModelInventory:
+    """
+    Filename, size and mtime of everything under ComfyUI/models.
+
+    dirs maps a directory (relative to models_dir) to its mtime_ns, files
+    {name: [size, mtime_ns]} and subdirectories. refresh() stats every
+    directory but only lists the ones that changed, a file growing in
+    place doesn't change its directory so sizes can lag until then.
+    """
+
+    def __init__(self, models_dir=MODELS_DIR, path=INVENTORY_FILE):
+        self.models_dir = models_dir
+        self.path = path
+        self.dirs = None
+        self.names = {}
+        # the viewer refreshes from worker threads, one walk at a time
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                saved = json.load(f)
+            if saved.get("models_dir") == self.models_dir:
+                return saved["dirs"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {"models_dir": self.models_dir, "dirs": self.dirs},
+                    f,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save model inventory: {e}")
+
+    def refresh(self):
+        """Bring the index up to date, returns self"""
+        with self.lock:
+            return self._refresh()
+
+    def _refresh(self):
+        previous = self.dirs if self.dirs is not None else self.load()
+        dirs = {}
+        changed = False
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            full = os.path.join(self.models_dir, rel)
+            try:
+                mtime = os.stat(full).st_mtime_ns
+            except OSError:
+                continue
+            entry = previous.get(rel)
+            if entry is None or entry["mtime_ns"] != mtime:
+                entry = self._scan(full, mtime)
+                changed = True
+            dirs[rel] = entry
+            stack.extend(os.path.join(rel, name) for name in entry["subdirs"])
+
+        changed = changed or dirs.keys() != previous.keys()
+        names = {}
+        for rel, entry in dirs.items():
+            for name in entry["files"]:
+                names.setdefault(name, []).append(rel)
+        # swapped in whole, lookups from the event loop never see half an index
+        self.dirs, self.names = dirs, names
+        if changed:
+            self.save()
+        return self
+
+    def _scan(self, full, mtime):
+        files = {}
+        subdirs = []
+        try:
+            with os.scandir(full) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files[entry.name] = [st.st_size, st.st_mtime_ns]
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return {"mtime_ns": mtime, "files": files, "subdirs": subdirs}
+
+    def file(self, path):
+        """[size, mtime_ns] of a file under models_dir, None when it isn't there"""
+        if self.dirs is None:
+            self.refresh()
+        rel = os.path.relpath(os.path.dirname(os.path.abspath(path)), self.models_dir)
+        entry = self.dirs.get("" if rel == "." else rel)
+        return entry["files"].get(os.path.basename(path)) if entry else None
+
+    def status(self, filename, category=None):
+        """installed, partial or missing, looking in every model directory like ComfyUI"""
+        found = self.names.get(filename, [])
+        for rel in found:
+            # an aria2 control file next to it means the download never finished
+            if filename + ".aria2" not in self.dirs[rel]["files"]:
+                return INSTALLED
+        if found or filename + PARTIAL_SUFFIX in self.names:
+            return PARTIAL
+        if STAGING_DIR and category:
+            expected = os.path.join(self.models_dir, category, filename)
+            if os.path.exists(partial_path(expected)):
+                return PARTIAL
+        return MISSING
+
+    def locate(self, filename):
+        """(path, size) of the first complete copy, (None, None) if there is none"""
+        for rel in self.names.get(filename, []):
+            files = self.dirs[rel]["files"]
+            if filename + ".aria2" not in files:
+                path = os.path.join(self.models_dir, rel, filename)
+                return os.path.normpath(path), files[filename][0]
+        return None, None
+
+    def check_config(self, config):
+        """Status of every model in a models config, in one pass over the index"""
+        results = []
+        for category, url in iter_config_urls(config):
+            name = model_filename(url)
+            path, size = self.locate(name)
+            results.append(
+                {
+                    "category": category,
+                    "url": url,
+                    "name": name,
+                    "status": self.status(name, category) if name else MISSING,
+                    "path": path,
+                    "size": size,
+                }
+            )
+        return results
+
+
+# shared by start.sh's preflight, download_models.py and /api/models
+model_inventory = ModelInventory()
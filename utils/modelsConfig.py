@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+import aiohttp
+
+MODELS_CONFIG_URL = os.environ.get("MODELS_CONFIG_URL")
+LOCAL_CONFIG_PATHS = [
+    "/workspace/models_config.json",
+    "./models_config.json",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "models_config.json"),
+]
+# fetched configs, so a restart or an outage still has the last good copy
+CACHE_DIR = os.path.join("/workspace", ".cache", "models_config")
+# a fetched config is used this long before it is revalidated
+CONFIG_TTL = float(os.environ.get("MODELS_CONFIG_TTL", 300))
+FETCH_TIMEOUT = 30
+# without a cached copy a failed fetch isn't retried for this long
+FAILED_RETRY_AFTER = 30
+
+DEFAULT_CONFIG = {
+    "checkpoints": [],
+    "vae": [],
+    "unet": [],
+    "diffusion_models": [],
+    "text_encoders": [],
+    "loras": [],
+    "upscale_models": [],
+    "clip": [],
+    "controlnet": [],
+    "clip_vision": [],
+    "ipadapter": [],
+    "style_models": [],
+}
+
+
+class ModelsConfig:
+    """
+    models_config.json from MODELS_CONFIG_URL or a local file, cached.
+
+    a fetched config is kept in memory and on disk and revalidated with
+    If-None-Match/If-Modified-Since once it is older than the TTL. When the
+    URL can't be reached the cached copy is used. Local files are re-read
+    only when their mtime changes.
+    """
+
+    def __init__(
+        self,
+        url=MODELS_CONFIG_URL,
+        local_paths=LOCAL_CONFIG_PATHS,
+        cache_dir=CACHE_DIR,
+        ttl=CONFIG_TTL,
+    ):
+        self.url = url
+        self.local_paths = local_paths
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        # url -> {url, config, etag, last_modified, checked}
+        self.fetched = {}
+        # path -> (mtime_ns, config)
+        self.local = {}
+        self.locks = {}
+        # url -> when fetching it last failed without a cached copy to fall back to
+        self.failed = {}
+
+    async def get(self):
+        """The config to use: MODELS_CONFIG_URL when set, else the first local file"""
+        if self.url and self.url.startswith("http"):
+            config = await self.fetch(self.url)
+            if config is not None:
+                return config
+            print("Falling back to local config files...")
+        for path in self.local_paths:
+            config = self.load_local(path)
+            if config is not None:
+                return config
+        return None
+
+    def load_local(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self.local.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, "r") as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read model config {path}: {e}")
+            return None
+        self.local[path] = (mtime, config)
+        return config
+
+    async def fetch(self, url, attempts=1, retry_wait=10):
+        """Config at url, from cache while fresh, None when there is neither"""
+        entry = self.fetched.get(url) or self._read_cache(url)
+        if entry and time.time() - entry["checked"] < self.ttl:
+            return entry["config"]
+        if not entry and time.time() - self.failed.get(url, 0) < FAILED_RETRY_AFTER:
+            return None
+
+        lock = self.locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            entry = self.fetched.get(url) or self._read_cache(url)
+            if entry and time.time() - entry["checked"] < self.ttl:
+                return entry["config"]
+            if not entry and time.time() - self.failed.get(url, 0) < FAILED_RETRY_AFTER:
+                return None
+
+            for attempt in range(attempts):
+                try:
+                    entry = await self._revalidate(url, entry)
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    print(f"Failed to fetch model config from {url}: {e}")
+                    if entry:
+                        print("Using the cached copy of the model config")
+                        # try again after another TTL, not on every request
+                        # while the host is down. Memory only, a restart retries
+                        entry["checked"] = time.time()
+                        break
+                    if attempt + 1 < attempts:
+                        await asyncio.sleep(retry_wait)
+                    else:
+                        self.failed[url] = time.time()
+        return entry["config"] if entry else None
+
+    async def _revalidate(self, url, entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        timeout = aiohttp.ClientTimeout(total=FETCH_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and entry:
+                    entry["checked"] = time.time()
+                else:
+                    response.raise_for_status()
+                    # GitHub raw serves text/plain, parse the text ourselves
+                    entry = {
+                        "url": url,
+                        "config": json.loads(await response.text()),
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "checked": time.time(),
+                    }
+                    print(f"Loaded model config from URL: {url}")
+
+        self.fetched[url] = entry
+        self._write_cache(entry)
+        return entry
+
+    def _cache_path(self, url):
+        name = hashlib.sha1(url.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _read_cache(self, url):
+        try:
+            with open(self._cache_path(url), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url:
+            return None
+        self.fetched[url] = entry
+        return entry
+
+    def _write_cache(self, entry):
+        path = self._cache_path(entry["url"])
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not cache model config: {e}")
+
+
+# shared by the viewer, download_models.py and start.sh
+models_config = ModelsConfig()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write MODELS_CONFIG_URL to a file, through the config cache"
+    )
+    parser.add_argument("--write", required=True, help="where to write the config")
+    args = parser.parse_args()
+
+    if not models_config.url:
+        print("MODELS_CONFIG_URL is not set", file=sys.stderr)
+        sys.exit(1)
+    config = asyncio.run(models_config.fetch(models_config.url, attempts=5))
+    if config is None:
+        sys.exit(1)
+    with open(args.write, "w") as f:
+        json.dump(config, f, indent=4)
+    print(f"Wrote model config to {args.write}")
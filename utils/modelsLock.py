@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import aiohttp
+
+from utils.hashManifest import expected_sha256
+from utils.modelInventory import iter_config_urls, model_filename, model_inventory
+from utils.segmentedDownload import CONTENT_RANGE_PATTERN, get_http_session
+from utils.stagedDownload import MODELS_DIR, STAGING_DIR, partial_path
+
+# what download_models.py --plan resolved, later boots read sizes and hashes from it
+LOCK_FILE = os.environ.get(
+    "MODELS_LOCK_FILE", os.path.join("/workspace", "models_config.lock.json")
+)
+RESOLVE_CONCURRENCY = 16
+RESOLVE_TIMEOUT = 30
+# left free on the volume after every planned download
+FREE_SPACE_MARGIN = 2 * 1024**3
+
+
+async def resolve_url(url, session=None):
+    """
+    Final url, size, ETag and sha256 of url, following redirects.
+
+    a HEAD is enough for most hosts, signed CDN links that refuse HEAD get a
+    one byte ranged GET instead. HF's X-Linked-Size/Etag on the resolve
+    redirect wins over what the CDN says.
+    """
+    session = session or get_http_session()
+    entry = {
+        "url": url,
+        "final_url": None,
+        "size": None,
+        "etag": None,
+        "sha256": None,
+        "error": None,
+    }
+    timeout = aiohttp.ClientTimeout(total=RESOLVE_TIMEOUT)
+    try:
+        async with session.head(url, allow_redirects=True, timeout=timeout) as response:
+            _collect(entry, response)
+            ok = response.status < 400
+        if not ok:
+            headers = {"Range": "bytes=0-0"}
+            async with session.get(url, headers=headers, timeout=timeout) as response:
+                _collect(entry, response)
+                if response.status >= 400:
+                    entry["error"] = f"HTTP {response.status}"
+                match = CONTENT_RANGE_PATTERN.match(
+                    response.headers.get("Content-Range", "")
+                )
+                if match and entry["size"] is None:
+                    entry["size"] = int(match.group(1))
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        entry["error"] = str(e) or type(e).__name__
+    return entry
+
+
+def _collect(entry, response):
+    for hop in (*response.history, response):
+        entry["sha256"] = entry["sha256"] or expected_sha256(hop.headers)
+        linked_size = hop.headers.get("X-Linked-Size")
+        if linked_size and entry["size"] is None:
+            entry["size"] = int(linked_size)
+    entry["final_url"] = str(response.url)
+    if response.status < 300:
+        entry["etag"] = response.headers.get("ETag")
+        if entry["size"] is None and "Content-Range" not in response.headers:
+            entry["size"] = response.content_length
+
+
+async def resolve_urls(urls, session=None):
+    """resolve_url() for every url, RESOLVE_CONCURRENCY at a time on one pool"""
+    semaphore = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+
+    async def resolve(url):
+        async with semaphore:
+            return await resolve_url(url, session)
+
+    return await asyncio.gather(*(resolve(url) for url in urls))
+
+
+def _existing_size(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+def space_needed(path, size, inventory=model_inventory):
+    """Bytes a download of size to path still takes from the disk"""
+    if size is None:
+        return 0
+    local = inventory.file(path)
+    if local is not None and local[0] == size:
+        return 0
+    # a partial already holds its bytes (all of them when preallocated)
+    return max(0, size - _existing_size(partial_path(path)))
+
+
+def free_space(needed, models_dir=MODELS_DIR):
+    """
+    [(directory, free, needed)] for every filesystem needed bytes land on.
+
+    with a staging dir on another filesystem the partials need the room
+    there and the finished files need it again under models_dir.
+    """
+    checks = [models_dir]
+    if STAGING_DIR and os.path.isdir(STAGING_DIR):
+        if os.stat(STAGING_DIR).st_dev != os.stat(models_dir).st_dev:
+            checks.append(STAGING_DIR)
+    return [
+        (directory, shutil.disk_usage(directory).free, needed + FREE_SPACE_MARGIN)
+        for directory in checks
+    ]
+
+
+def config_sha256(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+async def build_plan(config, models_dir=MODELS_DIR, inventory=model_inventory):
+    """Resolve every model in config and check it fits on the disk, nothing is downloaded"""
+    inventory.refresh()
+    wanted = list(iter_config_urls(config))
+    entries = await resolve_urls([url for _, url in wanted])
+
+    needed = 0
+    for (category, url), entry in zip(wanted, entries):
+        path = os.path.join(models_dir, category or "", model_filename(url))
+        local = inventory.file(path)
+        entry["category"] = category
+        entry["path"] = path
+        entry["local_size"] = local[0] if local else None
+        entry["needed"] = space_needed(path, entry["size"], inventory)
+        needed += entry["needed"]
+
+    space = free_space(needed, models_dir)
+    return {
+        "created": time.time(),
+        "config_sha256": config_sha256(config),
+        "models_dir": models_dir,
+        "models": entries,
+        "total_size": sum(entry["size"] or 0 for entry in entries),
+        "download_size": needed,
+        "unknown": sum(1 for entry in entries if entry["size"] is None),
+        "free_space": [
+            {"path": path, "free": free, "needed": need} for path, free, need in space
+        ],
+        "fits": all(free >= need for _, free, need in space),
+    }
+
+
+def write_lock(plan, path=LOCK_FILE):
+    """Store the resolved entries, unresolved ones are left out"""
+    lock = {
+        "created": plan["created"],
+        "config_sha256": plan["config_sha256"],
+        "models": {
+            entry["url"]: {
+                key: entry[key] for key in ("final_url", "size", "etag", "sha256")
+            }
+            for entry in plan["models"]
+            if not entry["error"] and entry["size"] is not None
+        },
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(lock, f, indent=4)
+    os.replace(tmp_path, path)
+    return lock
+
+
+def load_lock(path=LOCK_FILE):
+    """{url: {final_url, size, etag, sha256}} from the lockfile, {} without one"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f).get("models", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
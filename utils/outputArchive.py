@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.zipStream import ZipStreamWriter, deflate_file
+
+OUTPUT_DIR = os.path.join("/workspace", "ComfyUI", "output")
+
+# how many bytes to collect before handing a chunk to the response
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# already compressed media, deflating these again burns cpu for ~0% size gain
+STORED_EXTENSIONS = {
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".webp",
+    ".gif",
+    ".avif",
+    ".heic",
+    ".mp4",
+    ".webm",
+    ".mov",
+    ".mkv",
+    ".avi",
+    ".mp3",
+    ".m4a",
+    ".aac",
+    ".ogg",
+    ".opus",
+    ".flac",
+    ".zip",
+    ".gz",
+    ".7z",
+}
+
+# compressible files up to this size are deflated in the process pool,
+# bigger ones are deflated inline so we never hold a huge payload in memory
+POOL_MAX_FILE_SIZE = 32 * 1024 * 1024
+
+# keep the pool small, ComfyUI wants the same cores
+POOL_WORKERS = int(
+    os.getenv("OUTPUT_ZIP_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2))))
+)
+
+# bytes of files handed to the pool but not written yet, a queued file's
+# payload is held in memory until its turn comes
+POOL_PENDING_BYTES = int(os.getenv("OUTPUT_ZIP_PENDING_MB", "64")) * 1024 * 1024
+
+_deflate_pool = None
+
+
+def _get_deflate_pool():
+    """Lazily create the shared deflate process pool (None when disabled)"""
+    global _deflate_pool
+    if _deflate_pool is None and POOL_WORKERS > 1:
+        # created from a threadpool thread of the viewer, forking that copies
+        # whatever locks the other threads hold at that moment
+        _deflate_pool = ProcessPoolExecutor(
+            max_workers=POOL_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return _deflate_pool
+
+
+def should_compress(file_path):
+    """Compression policy: store media as-is, deflate everything else"""
+    return os.path.splitext(file_path)[1].lower() not in STORED_EXTENSIONS
+
+
+def iter_output_files(output_dir=OUTPUT_DIR):
+    """Yield (file_path, arcname) for every file in the output directory in a stable order"""
+    for root, dirs, files in os.walk(output_dir):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            yield file_path, os.path.relpath(file_path, output_dir)
+
+
+def coalesce(chunks, size=STREAM_CHUNK_SIZE):
+    """Merge small chunks so we don't send thousands of tiny frames"""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _plan_entries(files, pool):
+    """Stat every file and submit small compressible ones to the deflate pool"""
+    for file_path, arcname in files:
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+
+        compress = should_compress(file_path)
+        job = None
+        if pool and compress and st.st_size <= POOL_MAX_FILE_SIZE:
+            job = pool.submit(deflate_file, file_path, st.st_size)
+        yield file_path, arcname, st, compress, job
+
+
+def _write_entry(writer, file_path, arcname, st, compress, job):
+    if job is not None:
+        crc, file_size, payload = job.result()
+        return writer.write_deflated(arcname, st.st_mtime, file_size, crc, payload)
+    return writer.write_file(file_path, arcname, compress=compress)
+
+
+def generate_entries(files, writer):
+    """Yield the archive bytes for every (file_path, arcname), without the central directory"""
+    pool = _get_deflate_pool()
+    # deflate files ahead of the one being written, entries stay in walk order
+    lookahead = POOL_WORKERS * 4
+    pending = deque()
+    pending_bytes = 0
+
+    def drain(entry):
+        try:
+            yield from _write_entry(writer, *entry)
+        except FileNotFoundError:
+            # file removed between walk and read, nothing was emitted for it yet
+            pass
+
+    try:
+        for entry in _plan_entries(files, pool):
+            pending.append(entry)
+            if entry[4] is not None:
+                pending_bytes += entry[2].st_size
+            # a few big files fill the byte budget long before the count
+            while pending and (
+                len(pending) > lookahead or pending_bytes > POOL_PENDING_BYTES
+            ):
+                entry = pending.popleft()
+                if entry[4] is not None:
+                    pending_bytes -= entry[2].st_size
+                yield from drain(entry)
+        while pending:
+            yield from drain(pending.popleft())
+    finally:
+        # client went away, don't leave queued work behind
+        for entry in pending:
+            if entry[4] is not None:
+                entry[4].cancel()
+
+
+def _generate_output_zip(files, writer):
+    yield from generate_entries(files, writer)
+    yield writer.central_directory()
+
+
+def stream_output_zip(output_dir=OUTPUT_DIR, arcnames=None):
+    """
+    Stream a zip of the ComfyUI output directory chunk by chunk.
+
+    memory stays flat no matter how big the outputs are and the first bytes
+    are sent while the rest of the directory is still being compressed.
+    media files are stored, everything else is deflated in parallel.
+    pass arcnames to archive only those files (relative to output_dir).
+    """
+    if arcnames is None:
+        files = iter_output_files(output_dir)
+    else:
+        files = ((os.path.join(output_dir, arcname), arcname) for arcname in arcnames)
+    return coalesce(_generate_output_zip(files, ZipStreamWriter()))
@@ -0,0 +1,313 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from utils.outputArchive import OUTPUT_DIR, coalesce, generate_entries
+from utils.zipStream import ZipStreamWriter
+
+CACHE_ENABLED = os.getenv("OUTPUT_ZIP_CACHE", "true").lower() == "true"
+# point this at container disk when /workspace is a slow network volume
+CACHE_DIR = os.getenv(
+    "OUTPUT_ZIP_CACHE_DIR", os.path.join("/workspace", ".cache", "output_archives")
+)
+CACHE_MAX_BYTES = int(float(os.getenv("OUTPUT_ZIP_CACHE_MAX_GB", "10")) * 1024**3)
+# never let the cache eat the last few GB of the volume
+CACHE_MIN_FREE_BYTES = int(
+    float(os.getenv("OUTPUT_ZIP_CACHE_MIN_FREE_GB", "5")) * 1024**3
+)
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class CachedArchive:
+    """
+    One cached archive on disk.
+
+    body.bin only holds the zip entries and is append-only, meta.json records
+    which manifest those entries belong to. The central directory is rebuilt
+    from the entries for every response, so appending new outputs never
+    touches bytes that another client may still be reading.
+    """
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.manifest = meta["manifest"]
+        self.entries = meta["entries"]
+        self.body_size = meta["body_size"]
+        self.last_used = meta.get("last_used", 0)
+        self.writing = False
+
+    @property
+    def body_path(self):
+        return os.path.join(self.path, "body.bin")
+
+    def disk_size(self):
+        try:
+            return os.path.getsize(self.body_path)
+        except FileNotFoundError:
+            return 0
+
+    def save(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "manifest": self.manifest,
+                    "entries": self.entries,
+                    "body_size": self.body_size,
+                    "last_used": self.last_used,
+                },
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, meta_path)
+
+
+class ArchiveView:
+    """A complete cached archive version: body prefix + generated central directory"""
+
+    def __init__(self, archive):
+        # keep our own handle, eviction can unlink the file while we stream it
+        self.file = open(archive.body_path, "rb")
+        self.body_size = archive.body_size
+        self.central_directory = ZipStreamWriter(
+            archive.body_size, archive.entries
+        ).central_directory()
+        self.size = self.body_size + len(self.central_directory)
+
+    def close(self):
+        self.file.close()
+
+    def iter_range(self, start=0, end=None):
+        """Yield bytes [start, end) of the archive, closes the view when done"""
+        # no sendfile here: uvicorn has no zero-copy send, FileResponse reads
+        # in chunks through the threadpool as well, and it can only send whole
+        # files while body.bin may already hold bytes appended past body_size
+        end = self.size if end is None else end
+        try:
+            if start < self.body_size:
+                self.file.seek(start)
+                remaining = min(end, self.body_size) - start
+                while remaining > 0:
+                    chunk = self.file.read(min(READ_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+            if end > self.body_size:
+                cd_start = max(start, self.body_size) - self.body_size
+                yield self.central_directory[cd_start : end - self.body_size]
+        finally:
+            self.close()
+
+
+class _Tee:
+    """Copy streamed entry bytes into the cache file until the size budget runs out"""
+
+    def __init__(self, path, offset, budget):
+        self.file = None
+        self.budget = budget
+        self.ok = True
+        try:
+            self.file = open(path, "r+b" if os.path.exists(path) else "wb")
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        except OSError as e:
+            # the download still goes out, it just isn't cached
+            print(f"Error opening output archive cache: {e}")
+            self.ok = False
+
+    def write(self, chunk):
+        if not self.ok:
+            return
+        self.budget -= len(chunk)
+        if self.budget < 0:
+            print("Output archive cache budget exceeded, not caching this archive")
+            self.ok = False
+            return
+        try:
+            self.file.write(chunk)
+        except OSError as e:
+            print(f"Error writing output archive cache: {e}")
+            self.ok = False
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class OutputArchiveCache:
+    """Server-side cache of output archives keyed by the output manifest"""
+
+    def __init__(
+        self,
+        cache_dir=CACHE_DIR,
+        max_bytes=CACHE_MAX_BYTES,
+        min_free_bytes=CACHE_MIN_FREE_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.lock = threading.Lock()
+        self.archives = None
+
+    def _load(self):
+        """Read archive metadata from disk once, dropping anything left half-written"""
+        if self.archives is not None:
+            return
+        self.archives = []
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            try:
+                with open(os.path.join(entry.path, "meta.json"), "r") as f:
+                    archive = CachedArchive(entry.path, json.load(f))
+                # an append that died midway leaves garbage after body_size
+                if archive.disk_size() > archive.body_size:
+                    os.truncate(archive.body_path, archive.body_size)
+                self.archives.append(archive)
+            except Exception:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def get(self, manifest):
+        """Return an ArchiveView when an archive for exactly this manifest is cached"""
+        with self.lock:
+            self._load()
+            for archive in self.archives:
+                if not archive.writing and archive.manifest == manifest:
+                    try:
+                        view = ArchiveView(archive)
+                    except OSError as e:
+                        # body.bin removed or unreadable, the caller builds a fresh one
+                        print(f"Error opening cached output archive: {e}")
+                        self._remove(archive)
+                        return None
+                    archive.last_used = time.time()
+                    return view
+        return None
+
+    def _claim_base(self, manifest):
+        """Pick an idle archive whose files are all still unchanged in manifest"""
+        best = None
+        for archive in self.archives:
+            if archive.writing:
+                continue
+            # readers only ever read up to their own body_size, appending is safe
+            if all(manifest.get(k) == v for k, v in archive.manifest.items()):
+                if best is None or len(archive.manifest) > len(best.manifest):
+                    best = archive
+        return best
+
+    def _claim(self, manifest):
+        with self.lock:
+            self._load()
+            archive = self._claim_base(manifest)
+            if archive is None and not any(a.writing for a in self.archives):
+                path = os.path.join(self.cache_dir, uuid.uuid4().hex)
+                os.makedirs(path)
+                archive = CachedArchive(
+                    path, {"manifest": {}, "entries": [], "body_size": 0}
+                )
+                self.archives.append(archive)
+            if archive is not None:
+                archive.writing = True
+            return archive
+
+    def stream(self, manifest, output_dir=OUTPUT_DIR):
+        """
+        Stream the archive for manifest while caching it.
+
+        appends only the new files when a cached archive is a subset of the
+        current outputs, otherwise builds a fresh one. Falls back to plain
+        streaming when another request is already building an archive.
+        """
+        return coalesce(self._stream(manifest, output_dir))
+
+    def _stream(self, manifest, output_dir):
+        # claimed lazily so an archive is never left marked as writing by an unstarted response
+        archive = self._claim(manifest)
+        if archive is None:
+            writer = ZipStreamWriter()
+            files = ((os.path.join(output_dir, a), a) for a in sorted(manifest))
+            yield from generate_entries(files, writer)
+            yield writer.central_directory()
+            return
+
+        base_size = archive.body_size
+        new_arcnames = [a for a in sorted(manifest) if a not in archive.manifest]
+        writer = ZipStreamWriter(base_size, list(archive.entries))
+        completed = False
+        tee = None
+        try:
+            # inside the try, a failure here must still release the archive
+            tee = _Tee(archive.body_path, base_size, self._budget(archive))
+            # replay what is already cached
+            if base_size:
+                with open(archive.body_path, "rb") as f:
+                    remaining = base_size
+                    while remaining > 0:
+                        chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                        yield chunk
+
+            files = ((os.path.join(output_dir, a), a) for a in new_arcnames)
+            for chunk in generate_entries(files, writer):
+                tee.write(chunk)
+                yield chunk
+
+            completed = tee.ok
+            yield writer.central_directory()
+        finally:
+            if tee is not None:
+                tee.close()
+            with self.lock:
+                archive.writing = False
+                try:
+                    if completed:
+                        archive.manifest = manifest
+                        archive.entries = writer.entries
+                        archive.body_size = writer.offset
+                        archive.last_used = time.time()
+                        archive.save()
+                    elif base_size:
+                        os.truncate(archive.body_path, base_size)
+                    else:
+                        self._remove(archive)
+                except OSError as e:
+                    print(f"Error saving output archive cache: {e}")
+                    self._remove(archive)
+                self._evict()
+
+    def _budget(self, archive):
+        """How many more bytes this archive may grow by"""
+        others = sum(a.disk_size() for a in self.archives if a is not archive)
+        free = shutil.disk_usage(self.cache_dir).free - self.min_free_bytes
+        return max(0, min(self.max_bytes - others - archive.body_size, free))
+
+    def _remove(self, archive):
+        shutil.rmtree(archive.path, ignore_errors=True)
+        self.archives.remove(archive)
+
+    def _evict(self):
+        """Drop least recently used idle archives until the cache fits its budget"""
+        total = sum(a.disk_size() for a in self.archives)
+        free = shutil.disk_usage(self.cache_dir).free
+        for archive in sorted(self.archives, key=lambda a: a.last_used):
+            if total <= self.max_bytes and free >= self.min_free_bytes:
+                break
+            if archive.writing:
+                continue
+            size = archive.disk_size()
+            self._remove(archive)
+            total -= size
+            free += size
+
+
+output_archive_cache = OutputArchiveCache() if CACHE_ENABLED else None
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from utils.outputArchive import OUTPUT_DIR
+
+# manifests of previous downloads, the token returned to the client is the file name
+MANIFEST_DIR = os.path.join("/workspace", ".cache", "output_manifests")
+# a manifest is kept while some browser used it lately, the count only bounds the disk
+MAX_MANIFEST_AGE = 30 * 24 * 3600
+MAX_MANIFESTS = 1000
+# {client: [token, time]} of every browser's last complete download
+CURSORS_FILE = os.path.join(MANIFEST_DIR, "cursors.json")
+
+TOKEN_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+CLIENT_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_cursors_lock = threading.Lock()
+
+
+def scan_output_manifest(output_dir=OUTPUT_DIR):
+    """Map every output file (relative path) to [size, mtime_ns] using only stat calls"""
+    manifest = {}
+    stack = [output_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        arcname = os.path.relpath(entry.path, output_dir)
+                        manifest[arcname] = [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            continue
+    return manifest
+
+
+def manifest_token(manifest):
+    """Stable short token for a manifest"""
+    payload = json.dumps(manifest, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def save_manifest(manifest):
+    """Persist a manifest and return its token, old manifests are pruned"""
+    token = manifest_token(manifest)
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    path = os.path.join(MANIFEST_DIR, f"{token}.json")
+
+    if os.path.exists(path):
+        # bump mtime so it survives pruning
+        os.utime(path)
+    else:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    saved = sorted(
+        (
+            e
+            for e in os.scandir(MANIFEST_DIR)
+            if TOKEN_PATTERN.match(e.name[: -len(".json")])
+        ),
+        key=lambda e: e.stat().st_mtime,
+    )
+    expired = time.time() - MAX_MANIFEST_AGE
+    for i, entry in enumerate(saved):
+        if i >= len(saved) - MAX_MANIFESTS and entry.stat().st_mtime >= expired:
+            continue
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+    return token
+
+
+def load_manifest(token):
+    """Load a saved manifest, None if the token is unknown"""
+    if not TOKEN_PATTERN.match(token):
+        return None
+    path = os.path.join(MANIFEST_DIR, f"{token}.json")
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+        # still in use, keep it from expiring
+        os.utime(path)
+        return manifest
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _load_cursors():
+    try:
+        with open(CURSORS_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def load_client_cursor(client):
+    """Token of the client's last complete download, None without one"""
+    with _cursors_lock:
+        entry = _load_cursors().get(client)
+    return entry[0] if entry else None
+
+
+def save_client_cursor(client, token):
+    """Remember token as the client's last complete download"""
+    with _cursors_lock:
+        expired = time.time() - MAX_MANIFEST_AGE
+        cursors = {
+            key: entry for key, entry in _load_cursors().items() if entry[1] >= expired
+        }
+        cursors[client] = [token, time.time()]
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        tmp_path = f"{CURSORS_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cursors, f, separators=(",", ":"))
+        os.replace(tmp_path, CURSORS_FILE)
+
+
+def files_since(manifest, since):
+    """
+    Return the sorted arcnames added or changed since a cursor.
+
+    since is either a unix timestamp or a token from a previous download,
+    None when the token's manifest is gone, raises ValueError for a
+    malformed cursor.
+    """
+    if TOKEN_PATTERN.match(since):
+        previous = load_manifest(since)
+        if previous is None:
+            return None
+        return sorted(
+            arcname
+            for arcname, stat in manifest.items()
+            if previous.get(arcname) != stat
+        )
+
+    try:
+        timestamp_ns = int(float(since) * 1_000_000_000)
+    except (ValueError, OverflowError):
+        raise ValueError(f"Invalid output cursor: {since}")
+
+    return sorted(
+        arcname for arcname, (_, mtime_ns) in manifest.items() if mtime_ns > timestamp_ns
+    )
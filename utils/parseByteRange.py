@@ -0,0 +1,36 @@
+import re
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a single-range Range header into (start, end) with end exclusive.
+
+    returns None when there is no usable range (serve the whole body) and
+    raises ValueError when the range can't be satisfied.
+    """
+    if not header:
+        return None
+
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        # multiple ranges or other units, answering with the full body is allowed
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # suffix range: the last n bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - length), size
+
+    start = int(first)
+    end = size if not last else min(int(last) + 1, size)
+    if start >= size or start >= end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
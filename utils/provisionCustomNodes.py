@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+
+CUSTOM_NODES_DIR = "/workspace/ComfyUI/custom_nodes"
+# a copy on the volume wins over the one shipped in the image
+MANIFEST_PATHS = [
+    os.environ.get("CUSTOM_NODES_MANIFEST"),
+    "/workspace/custom_nodes.json",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "custom_nodes.json"),
+]
+# what the last provisioning run did to every node, read by the viewer
+RESULTS_FILE = os.environ.get(
+    "CUSTOM_NODES_RESULTS_FILE",
+    os.path.join("/workspace", ".cache", "custom_nodes_provision.json"),
+)
+CONCURRENCY = int(os.environ.get("CUSTOM_NODES_CONCURRENCY", 8))
+# per git command, a stuck clone shouldn't hold up the boot forever
+GIT_TIMEOUT = float(os.environ.get("CUSTOM_NODES_GIT_TIMEOUT", 300))
+RETRIES = 3
+RETRY_DELAY = 5
+
+
+class GitError(Exception):
+    pass
+
+
+def node_dir_name(entry):
+    """Directory a manifest entry is cloned into, "name" or the repo's basename"""
+    name = entry.get("name")
+    if name:
+        return name
+    name = entry["repo"].rstrip("/").rsplit("/", 1)[-1]
+    return name[: -len(".git")] if name.endswith(".git") else name
+
+
+def load_manifest():
+    """(path, entries) of the first manifest found, (None, []) without one"""
+    for path in MANIFEST_PATHS:
+        if not path or not os.path.isfile(path):
+            continue
+        try:
+            with open(path, "r") as f:
+                nodes = json.load(f).get("nodes", [])
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Could not read custom node manifest {path}: {e}")
+            continue
+        entries = []
+        for node in nodes:
+            if not isinstance(node, dict) or not node.get("repo"):
+                print(f"Skipping custom node manifest entry without a repo: {node}")
+                continue
+            entries.append(
+                {
+                    "name": node_dir_name(node),
+                    "repo": node["repo"],
+                    "commit": node.get("commit"),
+                    "enabled": node.get("enabled", True),
+                    "recursive": node.get("recursive", False),
+                }
+            )
+        return path, entries
+    return None, []
+
+
+def load_results(path=RESULTS_FILE):
+    """{name: result} of the last run, {} when there was none"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f).get("nodes", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_results(results, path=RESULTS_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(results, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+async def _git(*args, cwd=None):
+    """Run git, its stdout on success, GitError with the output otherwise"""
+    process = await asyncio.create_subprocess_exec(
+        "git",
+        *args,
+        cwd=cwd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        # fail instead of waiting for credentials of a private or renamed repo
+        env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+    )
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), GIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise GitError(f"git {args[0]} timed out after {GIT_TIMEOUT:.0f}s")
+    output = output.decode(errors="replace").strip()
+    if process.returncode != 0:
+        lines = output.splitlines()
+        raise GitError(lines[-1] if lines else f"git {args[0]} failed")
+    return output
+
+
+async def _head(path):
+    return await _git("rev-parse", "HEAD", cwd=path)
+
+
+async def _checkout_commit(path, entry):
+    # github serves single commits by sha, so a pin still needs no full history
+    await _git("fetch", "--depth=1", "origin", entry["commit"], cwd=path)
+    await _git("checkout", "--detach", "FETCH_HEAD", cwd=path)
+
+
+async def _submodules(path, entry):
+    if entry["recursive"]:
+        await _git(
+            "submodule", "update", "--init", "--recursive", "--depth=1", cwd=path
+        )
+
+
+async def _clone(path, entry):
+    # cloned next to the target and renamed, a failed clone leaves nothing behind
+    tmp_path = f"{path}.provisioning"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        if entry["commit"]:
+            os.makedirs(tmp_path)
+            await _git("init", "-q", cwd=tmp_path)
+            await _git("remote", "add", "origin", entry["repo"], cwd=tmp_path)
+            await _checkout_commit(tmp_path, entry)
+        else:
+            await _git("clone", "--depth=1", entry["repo"], tmp_path)
+        await _submodules(tmp_path, entry)
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+async def _update(path, entry, update):
+    """Bring an existing clone to its pin, or to the remote HEAD with update"""
+    head = await _head(path)
+    if entry["commit"]:
+        if head.startswith(entry["commit"]):
+            return "present"
+        await _checkout_commit(path, entry)
+    elif update:
+        await _git("fetch", "--depth=1", "origin", "HEAD", cwd=path)
+        # --keep refuses instead of throwing away local edits
+        await _git("reset", "--keep", "FETCH_HEAD", cwd=path)
+        if await _head(path) == head:
+            return "present"
+    else:
+        return "present"
+    await _submodules(path, entry)
+    return "updated"
+
+
+async def provision_node(entry, custom_nodes_dir=CUSTOM_NODES_DIR, update=False):
+    """Clone or update one manifest entry, retried RETRIES times, returns its result"""
+    path = os.path.join(custom_nodes_dir, entry["name"])
+    result = {
+        "repo": entry["repo"],
+        "pinned": entry["commit"],
+        "status": None,
+        "commit": None,
+        "attempts": 0,
+        "duration": 0.0,
+        "error": None,
+    }
+    if not entry["enabled"]:
+        result["status"] = "skipped"
+        return result
+
+    started = time.time()
+    for attempt in range(1, RETRIES + 1):
+        result["attempts"] = attempt
+        try:
+            if os.path.isdir(os.path.join(path, ".git")):
+                result["status"] = await _update(path, entry, update)
+            elif os.path.exists(path) or os.path.exists(f"{path}.disabled"):
+                # copied in without git, or disabled through ComfyUI-Manager
+                result["status"] = "present"
+                break
+            else:
+                await _clone(path, entry)
+                result["status"] = "cloned"
+            result["commit"] = await _head(path)
+            result["error"] = None
+            break
+        except (GitError, OSError) as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+            if attempt < RETRIES:
+                print(f"{entry['name']}: {e}, retrying ({attempt}/{RETRIES})...")
+                await asyncio.sleep(RETRY_DELAY * attempt)
+    result["duration"] = round(time.time() - started, 1)
+    return result
+
+
+async def provision(entries, custom_nodes_dir=CUSTOM_NODES_DIR, update=False):
+    """provision_node() for every entry, CONCURRENCY at a time, {name: result}"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def run(entry):
+        async with semaphore:
+            result = await provision_node(entry, custom_nodes_dir, update)
+        if result["status"] in ("cloned", "updated", "failed"):
+            detail = result["error"] or (result["commit"] or "")[:7]
+            print(
+                f"{entry['name']}: {result['status']} in {result['duration']}s ({detail})",
+                flush=True,
+            )
+        return entry["name"], result
+
+    return dict(await asyncio.gather(*(run(entry) for entry in entries)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Clone the custom nodes of the manifest in parallel, "
+        "move pinned ones to their commit"
+    )
+    parser.add_argument("--custom-nodes-dir", default=CUSTOM_NODES_DIR)
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="also fast forward unpinned nodes to their remote HEAD",
+    )
+    args = parser.parse_args()
+
+    manifest_path, entries = load_manifest()
+    if manifest_path is None:
+        print("No custom node manifest found, nothing to provision")
+        return 0
+    if shutil.which("git") is None:
+        print("git is not installed, can't provision custom nodes")
+        return 1
+
+    os.makedirs(args.custom_nodes_dir, exist_ok=True)
+    enabled = sum(1 for entry in entries if entry["enabled"])
+    print(
+        f"Provisioning {enabled} custom nodes from {manifest_path} "
+        f"({CONCURRENCY} at a time)...",
+        flush=True,
+    )
+    started = time.time()
+    nodes = asyncio.run(provision(entries, args.custom_nodes_dir, args.update))
+    save_results(
+        {
+            "manifest": manifest_path,
+            "started": started,
+            "finished": time.time(),
+            "nodes": nodes,
+        }
+    )
+
+    counts = {}
+    for result in nodes.values():
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(f"Custom nodes provisioned in {time.time() - started:.1f}s: {summary}")
+    return 1 if counts.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
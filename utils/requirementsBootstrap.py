@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from utils import wheelhouse
+
+COMFYUI_DIR = os.path.join("/workspace", "ComfyUI")
+TORCH_INDEX_URL = "https://download.pytorch.org/whl/cu130"
+TORCH_PACKAGES = ["torch==2.9.1", "torchvision==0.24.1", "torchaudio==2.9.1"]
+# win over whatever ComfyUI or a custom node asks for
+PINNED_PACKAGES = [*TORCH_PACKAGES, "transformers==5.3.0"]
+# prebuilt wheel, no compilation needed. SageAttention 3 is skipped until
+# there is a CUDA 13.0 Linux wheel
+EXTRA_PACKAGES = [
+    "sageattention @ https://huggingface.co/vjump21848/sageattention-pre-compiled-wheel/resolve/main/sageattention-2.2.0%2Bcu130-cp312-cp312-linux_x86_64.whl",
+]
+# kept in the venv itself, a new container starts with an empty venv even
+# when /workspace already has everything
+FINGERPRINT_FILE = os.path.join(sys.prefix, ".requirements-fingerprint.json")
+
+
+def find_requirement_files(comfyui_dir=COMFYUI_DIR):
+    """ComfyUI's requirements.txt and every one under custom_nodes, sorted"""
+    files = []
+    top = os.path.join(comfyui_dir, "requirements.txt")
+    if os.path.isfile(top):
+        files.append(top)
+    for root, dirs, names in os.walk(os.path.join(comfyui_dir, "custom_nodes")):
+        # nodes ComfyUI-Manager disabled aren't loaded, neither are their deps
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if not d.startswith((".", "__")) and not d.endswith(".disabled")
+        )
+        if "requirements.txt" in names:
+            files.append(os.path.join(root, "requirements.txt"))
+    return files
+
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def fingerprint(files, comfyui_dir=COMFYUI_DIR):
+    """Everything an install depends on, and one hash over all of it"""
+    state = {
+        "python": sys.version,
+        "prefix": sys.prefix,
+        "torch_index": TORCH_INDEX_URL,
+        "packages": [*PINNED_PACKAGES, *EXTRA_PACKAGES],
+        "files": {os.path.relpath(path, comfyui_dir): _sha256(path) for path in files},
+    }
+    state["fingerprint"] = hashlib.sha256(
+        json.dumps(state, sort_keys=True).encode()
+    ).hexdigest()
+    return state
+
+
+def load_fingerprint(path=FINGERPRINT_FILE):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_fingerprint(state, path=FINGERPRINT_FILE):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def describe_changes(old, new):
+    if not old:
+        return ["no previous install recorded"]
+    changes = []
+    for key in ("python", "prefix", "torch_index", "packages"):
+        if old.get(key) != new[key]:
+            changes.append(f"{key} changed")
+    old_files = old.get("files", {})
+    for name, digest in new["files"].items():
+        if name not in old_files:
+            changes.append(f"added {name}")
+        elif old_files[name] != digest:
+            changes.append(f"changed {name}")
+    changes.extend(f"removed {name}" for name in old_files if name not in new["files"])
+    return changes
+
+
+def installer():
+    """uv when it is there, pip otherwise, both aimed at this interpreter"""
+    uv = shutil.which("uv")
+    if uv:
+        return [uv, "pip", "install", "--python", sys.executable, "--no-cache"]
+    return [sys.executable, "-m", "pip", "install", "--no-cache-dir"]
+
+
+def _run(cmd):
+    print(f"Running: {' '.join(cmd)}", flush=True)
+    return subprocess.run(cmd).returncode == 0
+
+
+def _pins_file(flag):
+    pins = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False)
+    pins.write("\n".join(PINNED_PACKAGES) + "\n")
+    pins.close()
+    return pins.name, [flag, pins.name]
+
+
+def _merged_args(files, pins):
+    requirements = [arg for path in files for arg in ("-r", path)]
+    extras = [*PINNED_PACKAGES[len(TORCH_PACKAGES) :], *EXTRA_PACKAGES]
+    return [*pins, *requirements, *extras]
+
+
+def install_from_wheelhouse(state, files, offline=False):
+    """
+    Install through the wheelhouse, None when it can't be used.
+
+    a fingerprint seen before maps to a lock whose wheels are all on the
+    volume, those are installed with no index access. Otherwise (unless
+    offline) pip resolves and fetches wheels for everything into a new lock
+    first. pip can only constrain the pins, a conflict there falls back to
+    install().
+    """
+    key = wheelhouse.resolved_lock(state["fingerprint"])
+    if key is None:
+        if offline:
+            print("No wheelhouse lock for these requirements and --offline is set")
+            return False
+        print("Resolving requirements into the wheelhouse...", flush=True)
+        pins_path, pins = _pins_file("-c")
+        try:
+            key = wheelhouse.build_lock(
+                state["fingerprint"],
+                [
+                    [*TORCH_PACKAGES, "--index-url", TORCH_INDEX_URL],
+                    _merged_args(files, pins),
+                ],
+            )
+        finally:
+            os.remove(pins_path)
+        if key is None:
+            print("Could not build a wheelhouse lock, installing from the indexes")
+            return None
+    if not wheelhouse.install_lock(key, installer()):
+        return False if offline else None
+    wheelhouse.prune(key)
+    return True
+
+
+def install(files):
+    """
+    torch from its index, then everything else in one resolve.
+
+    if the merged resolve fails (two nodes that can't agree) the files are
+    installed one by one like before, so one bad node doesn't take the
+    rest down. True when every step succeeded.
+    """
+    base = installer()
+    # uv overrides a conflicting requirement, pip can only constrain it
+    pins_path, pins = _pins_file("--override" if shutil.which("uv") else "-c")
+    try:
+        if not _run([*base, *TORCH_PACKAGES, "--index-url", TORCH_INDEX_URL]):
+            return False
+
+        if _run([*base, *_merged_args(files, pins)]):
+            return True
+
+        print("Merged install failed, installing requirement files one by one...")
+        failed = [path for path in files if not _run([*base, *pins, "-r", path])]
+        extras = [*PINNED_PACKAGES[len(TORCH_PACKAGES) :], *EXTRA_PACKAGES]
+        if not _run([*base, *pins, *extras]):
+            failed.append("pinned packages")
+        for path in failed:
+            print(f"Failed to install {path}")
+        return not failed
+    finally:
+        os.remove(pins_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Install torch, ComfyUI and custom node requirements, "
+        "skipped when nothing changed since the last install"
+    )
+    parser.add_argument("--comfyui-dir", default=COMFYUI_DIR)
+    parser.add_argument(
+        "--force", action="store_true", help="install even if nothing changed"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="only install from the wheelhouse, fail if it lacks these requirements",
+    )
+    parser.add_argument(
+        "--no-wheelhouse",
+        action="store_true",
+        help="install straight from the indexes like before",
+    )
+    args = parser.parse_args()
+
+    files = find_requirement_files(args.comfyui_dir)
+    state = fingerprint(files, args.comfyui_dir)
+    previous = load_fingerprint()
+    if not args.force and previous.get("fingerprint") == state["fingerprint"]:
+        print(
+            f"Requirements unchanged since the last install ({len(files)} files), skipping"
+        )
+        return 0
+
+    for change in describe_changes(previous, state):
+        print(f"Requirements: {change}")
+    print(f"Installing requirements from {len(files)} files...", flush=True)
+    ok = None
+    if not args.no_wheelhouse:
+        ok = install_from_wheelhouse(state, files, args.offline)
+    if ok is None:
+        ok = install(files)
+    if not ok:
+        print("Some requirements failed to install, will retry on next start")
+        return 1
+    save_fingerprint(state)
+    print("Requirements installed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
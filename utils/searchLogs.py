@@ -0,0 +1,335 @@
+import mmap
+import os
+import re
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # python < 3.11
+    import sre_parse
+
+from utils.formatLogLine import classify_log_line
+from utils.logIndex import LEVEL_CODES, LEVELS
+
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+# lines of index read at once while searching backwards
+SEARCH_BLOCK_LINES = 4096
+# log bytes scanned per search request, the client continues from the cursor
+SEARCH_SCAN_BYTES = 64 * 1024 * 1024
+# a user regex runs line by line on at most this much of each line, and the
+# whole request gives up after REGEX_TIMEOUT seconds. re can't be interrupted
+# mid match, so patterns that backtrack exponentially are refused up front
+MAX_REGEX_LENGTH = 256
+MAX_REGEX_LINE = 4096
+REGEX_TIMEOUT = 10
+
+LEVEL_ALIASES = {"warn": "warning", "err": "error"}
+
+
+def parse_levels(levels):
+    """'error,warn' -> {2, 1}, None when no filter"""
+    if not levels:
+        return None
+    codes = set()
+    for name in levels.split(","):
+        name = name.strip().lower()
+        name = LEVEL_ALIASES.get(name, name)
+        if name not in LEVELS:
+            raise ValueError(f"unknown level {name}")
+        codes.add(LEVELS.index(name))
+    return codes
+
+
+class _Snapshot:
+    """The live log mapped together with consistent index and segment state"""
+
+    def __init__(self, index, segments):
+        self.count = index.count
+        self.end = index.end
+        self.base = segments.base if segments else 0
+        self.segments = list(segments.segments) if segments else []
+        self.first_line = self.segments[0]["first"] if self.segments else self.base
+        self.total = self.base + self.count
+        self.mm = None
+
+
+@contextmanager
+def _open_snapshot(index, segments):
+    """mmap the indexed part of the live log, rotation waits until we are done"""
+    with index.lock:
+        snapshot = _Snapshot(index, segments)
+        index.readers += 1
+    try:
+        fd = os.open(index.log_file, os.O_RDONLY)
+    except FileNotFoundError:
+        fd = None
+    try:
+        if fd is not None and snapshot.end:
+            stat = os.fstat(fd)
+            if stat.st_ino == index.inode and stat.st_size >= snapshot.end:
+                snapshot.mm = mmap.mmap(fd, snapshot.end, access=mmap.ACCESS_READ)
+        yield snapshot
+    finally:
+        if snapshot.mm is not None:
+            snapshot.mm.close()
+        if fd is not None:
+            os.close(fd)
+        with index.lock:
+            index.readers -= 1
+
+
+def _has_nested_repeat(parsed, repeated=False):
+    """True for (a+)+, (a|b)* and the like, a repeat over another repeat or an alternation"""
+    for op, av in parsed:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, sub = av
+            if repeated and high > 1:
+                return True
+            if _has_nested_repeat(sub, repeated or high > 1):
+                return True
+        elif op == sre_parse.BRANCH:
+            if repeated:
+                return True
+            if any(_has_nested_repeat(sub, repeated) for sub in av[1]):
+                return True
+        elif op == sre_parse.SUBPATTERN:
+            if _has_nested_repeat(av[-1], repeated):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if _has_nested_repeat(av[1], repeated):
+                return True
+    return False
+
+
+def compile_query(query, regex=False):
+    """Case-insensitive pattern for a search, None without a query, ValueError when refused"""
+    if not query:
+        return None
+    if not regex:
+        return re.compile(re.escape(query.encode()), re.IGNORECASE | re.MULTILINE)
+
+    if len(query) > MAX_REGEX_LENGTH:
+        raise ValueError(f"regex is longer than {MAX_REGEX_LENGTH} characters")
+    source = query.encode()
+    try:
+        pattern = re.compile(source, re.IGNORECASE | re.MULTILINE)
+    except re.error as e:
+        raise ValueError(f"invalid regex: {e}")
+    if _has_nested_repeat(sre_parse.parse(source, re.IGNORECASE)):
+        raise ValueError(
+            "regex repeats a repeat or an alternation, this can take forever"
+        )
+    return pattern
+
+
+class _Deadline:
+    def __init__(self, seconds):
+        self.at = time.monotonic() + seconds
+
+    def check(self):
+        if time.monotonic() > self.at:
+            raise ValueError(
+                f"regex search took longer than {REGEX_TIMEOUT}s, try a simpler pattern"
+            )
+
+
+def _line(number, data, level=None):
+    text = data.rstrip(b"\r\n").decode("utf-8", "replace")
+    if level is None:
+        level = LEVEL_CODES[classify_log_line(text)]
+    return {"line": number, "level": LEVELS[level], "text": text}
+
+
+def _segment_lines(segments, segment):
+    """Raw lines of a segment, nothing if retention removed it meanwhile"""
+    try:
+        yield from segments.iter_lines(segment)
+    except (OSError, EOFError):
+        return
+
+
+def get_log_page(index, segments=None, start=None, limit=PAGE_SIZE):
+    """
+    Read lines start..start+limit of the whole log history, the last page by default.
+
+    line numbers continue across rotated segments, a page never spans two files.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    lines = []
+    with _open_snapshot(index, segments) as snapshot:
+        if start is None:
+            # newest lines, from the last segment when the live log is still empty
+            oldest = snapshot.base if snapshot.count else snapshot.first_line
+            start = max(oldest, snapshot.total - limit)
+        start = max(snapshot.first_line, min(start, snapshot.total))
+
+        if start >= snapshot.base:
+            local = start - snapshot.base
+            if snapshot.mm is not None:
+                records = index.records(local, local + limit + 1)
+                for i, (offset, level) in enumerate(records[:limit]):
+                    line_end = (
+                        records[i + 1][0] if i + 1 < len(records) else snapshot.end
+                    )
+                    data = snapshot.mm[offset:line_end]
+                    lines.append(_line(start + i, data, level))
+        else:
+            segment = next(
+                s for s in snapshot.segments if start < s["first"] + s["lines"]
+            )
+            stop = min(start + limit, segment["first"] + segment["lines"])
+            for number, data in enumerate(
+                _segment_lines(segments, segment), segment["first"]
+            ):
+                if number >= stop:
+                    break
+                if number >= start:
+                    lines.append(_line(number, data))
+
+    stop = start + len(lines)
+    return {
+        "lines": lines,
+        "start": start,
+        "next": stop if stop < snapshot.total else None,
+        "prev": (
+            max(snapshot.first_line, start - limit)
+            if start > snapshot.first_line
+            else None
+        ),
+        "first": snapshot.first_line,
+        "total": snapshot.total,
+    }
+
+
+def _search_live(index, snapshot, pattern, levels, cursor, limit, matches, deadline):
+    """Search the live log backwards from line cursor, returns (cursor, bytes scanned)"""
+    mm = snapshot.mm
+    local = cursor - snapshot.base
+    scanned = 0
+    while local > 0 and len(matches) < limit and scanned < SEARCH_SCAN_BYTES:
+        low = max(0, local - SEARCH_BLOCK_LINES)
+        records = index.records(low, local + 1)
+        if len(records) < local - low:
+            # index was reset under us
+            break
+        offsets = [offset for offset, _ in records]
+        block_end = offsets[local - low] if len(offsets) > local - low else snapshot.end
+
+        if pattern is None:
+            hits = range(local - low)
+        elif deadline is not None:
+            # a user regex never sees more than one (capped) line at a time
+            hits = []
+            for i in range(local - low):
+                deadline.check()
+                line_end = offsets[i + 1] if i + 1 < len(offsets) else block_end
+                line_end = min(line_end, offsets[i] + MAX_REGEX_LINE)
+                if pattern.search(mm, offsets[i], line_end):
+                    hits.append(i)
+        else:
+            hits = []
+            position = offsets[0]
+            while True:
+                match = pattern.search(mm, position, block_end)
+                if match is None:
+                    break
+                i = bisect_right(offsets, match.start(), 0, local - low) - 1
+                hits.append(i)
+                # one hit per line is enough, continue on the next one
+                position = offsets[i + 1] if i + 1 < local - low else block_end
+                if position >= block_end:
+                    break
+
+        next_local = low
+        for i in reversed(hits):
+            offset, level = records[i]
+            if levels is not None and level not in levels:
+                continue
+            line_end = offsets[i + 1] if i + 1 < len(offsets) else snapshot.end
+            matches.append(_line(snapshot.base + low + i, mm[offset:line_end], level))
+            if len(matches) >= limit:
+                next_local = low + i
+                break
+
+        scanned += block_end - offsets[0]
+        local = next_local
+    return snapshot.base + local, scanned
+
+
+def _search_segment(
+    segments, segment, pattern, levels, cursor, limit, matches, deadline
+):
+    """Search one rotated segment below line cursor, returns (cursor, bytes scanned)"""
+    hits = []
+    scanned = 0
+    for number, data in enumerate(_segment_lines(segments, segment), segment["first"]):
+        if number >= cursor:
+            break
+        scanned += len(data) + 1
+        if deadline is not None:
+            deadline.check()
+            data_searched = data[:MAX_REGEX_LINE]
+        else:
+            data_searched = data
+        if pattern is not None and not pattern.search(data_searched):
+            continue
+        line = _line(number, data)
+        if levels is None or LEVELS.index(line["level"]) in levels:
+            hits.append(line)
+
+    wanted = limit - len(matches)
+    matches.extend(reversed(hits[-wanted:]))
+    if len(hits) >= wanted:
+        return hits[-wanted]["line"], scanned
+    return segment["first"], scanned
+
+
+def search_logs(
+    index, segments=None, query="", regex=False, levels=None, before=None, limit=100
+):
+    """
+    Search the whole log history, rotated segments included, newest first.
+
+    query is a case-insensitive substring or regex, levels a set of level
+    codes. Each call scans about SEARCH_SCAN_BYTES, pass the returned next
+    cursor as before to continue further back. A regex is guarded, see
+    compile_query and REGEX_TIMEOUT.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    pattern = compile_query(query, regex)
+    deadline = _Deadline(REGEX_TIMEOUT) if pattern is not None and regex else None
+
+    matches = []
+    with _open_snapshot(index, segments) as snapshot:
+        cursor = snapshot.total if before is None else min(before, snapshot.total)
+        scanned = 0
+
+        if cursor > snapshot.base:
+            if snapshot.mm is None:
+                cursor = snapshot.base
+            else:
+                cursor, scanned = _search_live(
+                    index, snapshot, pattern, levels, cursor, limit, matches, deadline
+                )
+
+        # continue into the compressed segments, whole segments at a time
+        for segment in reversed(snapshot.segments):
+            if len(matches) >= limit or scanned >= SEARCH_SCAN_BYTES:
+                break
+            if segment["first"] >= cursor:
+                continue
+            cursor, segment_scanned = _search_segment(
+                segments, segment, pattern, levels, cursor, limit, matches, deadline
+            )
+            scanned += segment_scanned
+
+    return {
+        "matches": matches,
+        "next": cursor if cursor > snapshot.first_line else None,
+        "first": snapshot.first_line,
+        "total": snapshot.total,
+    }
@@ -0,0 +1,519 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from urllib.parse import unquote, urlparse
+
+import aiohttp
+
+from utils.hashManifest import StreamingHasher, expected_sha256, hash_manifest
+from utils.stagedDownload import finalize, partial_path
+
+# "native" downloads in process with this engine, "aria2" keeps using aria2c
+DOWNLOAD_BACKEND = os.environ.get("DOWNLOAD_BACKEND", "aria2").lower()
+# parallel range requests per file, the engine ramps up to this while it helps
+MAX_SEGMENTS = int(os.environ.get("DOWNLOAD_MAX_SEGMENTS", 16))
+INITIAL_SEGMENTS = 4
+RAMP_STEP = 2
+RAMP_INTERVAL = 2
+# a range isn't split below this
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+READ_SIZE = 256 * 1024
+# bytes buffered per segment before one pwrite
+WRITE_SIZE = 1024 * 1024
+STATE_SAVE_INTERVAL = 2
+MAX_TRIES = 5
+RETRY_WAIT = 2
+STATE_SUFFIX = ".dlstate"
+
+CONTENT_RANGE_PATTERN = re.compile(r"bytes \d+-\d+/(\d+)")
+
+_session = None
+
+
+class DownloadError(Exception):
+    pass
+
+
+def native_backend_enabled():
+    return DOWNLOAD_BACKEND == "native"
+
+
+def get_http_session():
+    """Shared session, so connections to HF/Civitai CDNs are reused across files"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=0, limit_per_host=MAX_SEGMENTS * 2, ttl_dns_cache=300
+            ),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60),
+        )
+    return _session
+
+
+async def close_http_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _preallocate(fd, size):
+    """Reserve the whole file up front, sparse when the filesystem can't"""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+class Segment:
+    """[start, end) of the file, pos is where the next written byte goes"""
+
+    __slots__ = ("start", "end", "pos")
+
+    def __init__(self, start, end, pos=None):
+        self.start = start
+        self.end = end
+        self.pos = start if pos is None else pos
+
+    @property
+    def remaining(self):
+        return self.end - self.pos
+
+
+class SegmentedDownload:
+    """
+    One file fetched with parallel HTTP Range requests.
+
+    starts with a few segments and adds connections while throughput keeps
+    improving, a finished segment takes over half of the largest one left.
+    Data goes to a .partial file with a .dlstate sidecar, so a cancelled or
+    crashed download continues where it stopped. The sha256 is computed while
+    writing and checked against the one HF publishes before the partial is
+    renamed to the model name.
+    """
+
+    def __init__(
+        self,
+        url,
+        directory,
+        filename=None,
+        headers=None,
+        tracker=None,
+        session=None,
+        max_segments=MAX_SEGMENTS,
+        sha256=None,
+    ):
+        self.url = url
+        self.directory = str(directory)
+        self.filename = filename
+        self.headers = headers or {}
+        self.tracker = tracker
+        self.session = session or get_http_session()
+        self.max_segments = max_segments
+        self.final_url = url
+        self.total = None
+        self.validator = None
+        self.ranges = False
+        self.segments = []
+        self.fd = None
+        self.path = None
+        self.partial = None
+        self.expected_sha256 = sha256
+        self.hasher = None
+
+    @property
+    def state_path(self):
+        return self.partial + STATE_SUFFIX
+
+    def _headers_for(self, url):
+        # credentials only go to the host they were given for, not the CDN
+        if urlparse(url).hostname == urlparse(self.url).hostname:
+            return dict(self.headers)
+        return {}
+
+    async def run(self):
+        """Download the file, returns its path"""
+        await self._probe()
+        self.path = os.path.join(self.directory, self.filename)
+        self.partial = partial_path(self.path)
+        os.makedirs(os.path.dirname(self.partial), exist_ok=True)
+
+        if not self.ranges or not self.total:
+            sha256 = await self._stream_whole()
+            await self._finish(sha256)
+            return self.path
+
+        self._load_state()
+        self.fd = os.open(self.partial, os.O_RDWR | os.O_CREAT, 0o644)
+        self.hasher = StreamingHasher(self.fd)
+        try:
+            if os.fstat(self.fd).st_size != self.total:
+                _preallocate(self.fd, self.total)
+            await self._fetch_segments()
+            await asyncio.to_thread(self.hasher.catch_up, self.total)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        await self._finish(self.hasher.hexdigest())
+        return self.path
+
+    async def _finish(self, sha256):
+        """
+        Check size and hash of the partial, then move it into place.
+
+        a bad partial is dropped, a good model is remembered so later boots
+        don't rehash it.
+        """
+        size = os.path.getsize(self.partial)
+        problem = None
+        if self.total and size != self.total:
+            problem = f"got {size} of {self.total} bytes"
+        elif self.expected_sha256 and sha256 != self.expected_sha256:
+            problem = f"sha256 {sha256} doesn't match {self.expected_sha256}"
+        if problem:
+            os.remove(self.partial)
+            raise DownloadError(f"{self.filename}: {problem}, removed the download")
+
+        await asyncio.to_thread(finalize, self.partial, self.path)
+        hash_manifest.record(self.path, sha256, verified=bool(self.expected_sha256))
+
+    async def _probe(self):
+        """Follow redirects once, learn the size and whether ranges work"""
+        headers = {**self.headers, "Range": "bytes=0-0"}
+        async with self.session.get(self.url, headers=headers) as response:
+            if response.status >= 400:
+                raise DownloadError(f"HTTP {response.status} for {self.url}")
+            self.final_url = str(response.url)
+            for hop in (*response.history, response):
+                self.expected_sha256 = self.expected_sha256 or expected_sha256(
+                    hop.headers
+                )
+
+            if not self.filename:
+                disposition = response.content_disposition
+                if disposition and disposition.filename:
+                    self.filename = os.path.basename(disposition.filename)
+                else:
+                    self.filename = os.path.basename(
+                        unquote(urlparse(self.final_url).path)
+                    )
+            if not self.filename:
+                raise DownloadError(f"Could not tell a filename for {self.url}")
+
+            match = CONTENT_RANGE_PATTERN.match(
+                response.headers.get("Content-Range", "")
+            )
+            if response.status == 206 and match:
+                self.ranges = True
+                self.total = int(match.group(1))
+            else:
+                self.total = response.content_length
+            self.validator = response.headers.get("ETag") or response.headers.get(
+                "Last-Modified"
+            )
+
+    def _load_state(self):
+        """Continue from the sidecar when it describes the same remote file"""
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            if (
+                state["url"] == self.url
+                and state["total"] == self.total
+                and state["validator"] == self.validator
+                and os.path.getsize(self.partial) == self.total
+            ):
+                self.segments = [Segment(*segment) for segment in state["segments"]]
+                return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        count = max(
+            1, min(INITIAL_SEGMENTS, self.max_segments, self.total // MIN_SEGMENT_SIZE)
+        )
+        size = -(-self.total // count)
+        self.segments = [
+            Segment(start, min(start + size, self.total))
+            for start in range(0, self.total, size)
+        ]
+
+    def _save_state(self):
+        state = {
+            "url": self.url,
+            "total": self.total,
+            "validator": self.validator,
+            "segments": [[s.start, s.end, s.pos] for s in self.segments],
+        }
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _write(self, data, offset):
+        _pwrite_all(self.fd, data, offset)
+        self.hasher.feed(offset, data)
+
+    def _done_bytes(self):
+        return self.total - sum(segment.remaining for segment in self.segments)
+
+    def _done_prefix(self):
+        """End of the finished part at the start of the file"""
+        for segment in sorted(self.segments, key=lambda s: s.start):
+            if segment.remaining > 0:
+                return segment.pos
+        return self.total
+
+    def _split_largest(self, busy):
+        """Hand the back half of the largest unfinished range to a new segment"""
+        candidates = [s for s in self.segments if s.remaining >= 2 * MIN_SEGMENT_SIZE]
+        if not candidates:
+            return None
+        segment = max(candidates, key=lambda s: s.remaining)
+        if segment not in busy:
+            return segment
+        # leave room for what the running request has buffered but not written
+        mid = segment.pos + WRITE_SIZE + (segment.remaining - WRITE_SIZE) // 2
+        new = Segment(mid, segment.end)
+        segment.end = mid
+        self.segments.append(new)
+        return new
+
+    async def _fetch_segments(self):
+        tasks = {}
+        target = min(INITIAL_SEGMENTS, self.max_segments)
+        ramping = True
+        last_saved = last_ramp = last_tick = time.monotonic()
+        ramp_done = last_done = self._done_bytes()
+        ramp_speed = 0
+        hashing = None
+
+        try:
+            while True:
+                busy = set(tasks.values())
+                for segment in self.segments:
+                    if len(tasks) >= target:
+                        break
+                    if segment.remaining > 0 and segment not in busy:
+                        tasks[asyncio.create_task(self._fetch(segment))] = segment
+                        busy.add(segment)
+                while len(tasks) < target:
+                    segment = self._split_largest(busy)
+                    if segment is None:
+                        break
+                    tasks[asyncio.create_task(self._fetch(segment))] = segment
+                    busy.add(segment)
+
+                if not tasks:
+                    break
+
+                finished, _ = await asyncio.wait(
+                    tasks, timeout=0.5, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in finished:
+                    del tasks[task]
+                    task.result()
+
+                now = time.monotonic()
+                done = self._done_bytes()
+                self._report(done, (done - last_done) / max(now - last_tick, 1e-6))
+                last_done, last_tick = done, now
+
+                # hash what was written ahead while it is still in the page cache
+                prefix = self._done_prefix()
+                if self.hasher.position < prefix and (
+                    hashing is None or hashing.done()
+                ):
+                    hashing = asyncio.create_task(
+                        asyncio.to_thread(self.hasher.catch_up, prefix)
+                    )
+
+                if now - last_saved >= STATE_SAVE_INTERVAL:
+                    self._save_state()
+                    last_saved = now
+
+                # add connections while each step still buys >10% throughput
+                if ramping and now - last_ramp >= RAMP_INTERVAL:
+                    speed = (done - ramp_done) / (now - last_ramp)
+                    if speed > ramp_speed * 1.1 and target < self.max_segments:
+                        target = min(target + RAMP_STEP, self.max_segments)
+                    else:
+                        ramping = False
+                    ramp_speed, ramp_done, last_ramp = speed, done, now
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if hashing is not None:
+                await asyncio.gather(hashing, return_exceptions=True)
+            if any(segment.remaining for segment in self.segments):
+                self._save_state()
+
+        if self.tracker:
+            self.tracker.finish()
+
+    def _report(self, done, speed):
+        if not self.tracker:
+            return
+        self.tracker.update(
+            {
+                "done": done,
+                "total": self.total,
+                "percent": round(done * 100 / self.total, 1),
+                "speed": int(speed),
+                "eta": int((self.total - done) / speed) if speed else None,
+            }
+        )
+        self.tracker.check_stall()
+
+    async def _fetch(self, segment):
+        tries = 0
+        while segment.remaining > 0:
+            before = segment.pos
+            try:
+                await self._fetch_range(segment)
+            except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError) as e:
+                tries = 0 if segment.pos > before else tries + 1
+                if tries >= MAX_TRIES:
+                    raise DownloadError(f"{self.filename}: {e}")
+                if isinstance(e, aiohttp.ClientResponseError) and e.status in (
+                    401,
+                    403,
+                    410,
+                ):
+                    # signed CDN links expire, get a fresh one through the redirect
+                    self.final_url = self.url
+                await asyncio.sleep(RETRY_WAIT * 2 ** (tries - 1 if tries else 0))
+
+    async def _fetch_range(self, segment):
+        url = self.final_url
+        headers = {
+            **self._headers_for(url),
+            "Range": f"bytes={segment.pos}-{segment.end - 1}",
+        }
+        async with self.session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise DownloadError(f"server ignored the range request for {url}")
+
+            buffer = bytearray()
+            async for chunk in response.content.iter_chunked(READ_SIZE):
+                buffer += chunk
+                while len(buffer) >= min(WRITE_SIZE, segment.remaining):
+                    if not await self._flush(segment, buffer):
+                        return
+                if segment.remaining <= 0:
+                    return
+            while buffer and await self._flush(segment, buffer):
+                pass
+
+    async def _flush(self, segment, buffer):
+        """
+        pwrite the head of buffer at segment.pos, False once the segment is full.
+
+        the segment may have been split since the request went out, so the
+        end is read again before every write and nothing goes past it. At
+        most WRITE_SIZE is in flight, the margin _split_largest leaves.
+        """
+        size = min(len(buffer), WRITE_SIZE, segment.remaining)
+        if size <= 0:
+            return False
+        await asyncio.to_thread(self._write, buffer[:size], segment.pos)
+        segment.pos += size
+        del buffer[:size]
+        return True
+
+    async def _stream_whole(self):
+        """No ranges or no length, one plain request from the start"""
+        async with self.session.get(
+            self.final_url, headers=self._headers_for(self.final_url)
+        ) as response:
+            response.raise_for_status()
+            digest = hashlib.sha256()
+            done = 0
+            last_tick = time.monotonic()
+            last_done = 0
+            with open(self.partial, "wb") as f:
+                async for chunk in response.content.iter_chunked(WRITE_SIZE):
+                    await asyncio.to_thread(f.write, chunk)
+                    digest.update(chunk)
+                    done += len(chunk)
+                    now = time.monotonic()
+                    if self.tracker and now - last_tick >= 0.5:
+                        speed = (done - last_done) / (now - last_tick)
+                        self.tracker.update(
+                            {
+                                "done": done,
+                                "total": self.total,
+                                "percent": (
+                                    round(done * 100 / self.total, 1)
+                                    if self.total
+                                    else None
+                                ),
+                                "speed": int(speed),
+                                "eta": None,
+                            }
+                        )
+                        last_tick, last_done = now, done
+        if self.tracker:
+            self.tracker.finish()
+        return digest.hexdigest()
+
+
+async def probe_remote(url, headers=None, session=None):
+    """
+    (size, sha256) the server reports for url without downloading, None if unknown.
+
+    redirects aren't followed, HF puts X-Linked-Size/Etag on the resolve
+    redirect and signed CDN links don't take HEAD requests.
+    """
+    session = session or get_http_session()
+    try:
+        async with session.head(
+            url, headers=headers, allow_redirects=False
+        ) as response:
+            if response.status >= 400:
+                return None, None
+            size = response.headers.get("X-Linked-Size")
+            if size is None and response.status < 300:
+                size = response.content_length
+            return (int(size) if size else None), expected_sha256(response.headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print(f"Could not check {url}: {e}")
+        return None, None
+
+
+async def download_url(
+    url,
+    directory,
+    filename=None,
+    headers=None,
+    tracker=None,
+    session=None,
+    max_segments=MAX_SEGMENTS,
+    sha256=None,
+):
+    """
+    Download url into directory with the native engine, returns the file path
+
+    a known sha256 (from the lockfile) is enforced, without one the file is
+    checked against the hash the response headers publish, if any.
+    """
+    download = SegmentedDownload(
+        url, directory, filename, headers, tracker, session, max_segments, sha256
+    )
+    return await download.run()
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+
+PARTIAL_SUFFIX = ".partial"
+# partials go here instead of next to the model, e.g. fast local disk when
+# /workspace is a network volume. Unset keeps them in the model directory.
+STAGING_DIR = os.environ.get("DOWNLOAD_STAGING_DIR")
+# partials untouched for this long belong to no running download anymore
+PARTIAL_MAX_AGE = float(os.environ.get("DOWNLOAD_PARTIAL_MAX_AGE", 7 * 86400))
+MODELS_DIR = os.path.join("/workspace", "ComfyUI", "models")
+COPY_SIZE = 16 * 1024 * 1024
+
+
+def partial_path(final_path):
+    """Where final_path is downloaded to, the same path every time so it resumes"""
+    final_path = os.path.abspath(str(final_path))
+    name = os.path.basename(final_path) + PARTIAL_SUFFIX
+    if not STAGING_DIR:
+        return os.path.join(os.path.dirname(final_path), name)
+    # one flat staging dir for every category, keep same named models apart
+    key = hashlib.sha1(final_path.encode()).hexdigest()[:12]
+    return os.path.join(STAGING_DIR, f"{key}-{name}")
+
+
+def staging_dir(model_dir):
+    """Fresh directory for downloaders that pick the file name themselves"""
+    root = STAGING_DIR or str(model_dir)
+    path = os.path.join(root, f".download-{uuid.uuid4().hex[:12]}{PARTIAL_SUFFIX}")
+    os.makedirs(path)
+    return path
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _copy_synced(source, target):
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_SIZE)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+
+def finalize(partial, final_path):
+    """
+    Move a finished, checked partial into place, blocking.
+
+    the data is fsynced before the rename and the directory after it, so
+    the model name only ever points at a complete file. From a staging dir
+    on another filesystem it is copied next to the target first.
+    """
+    final_path = str(final_path)
+    final_dir = os.path.dirname(os.path.abspath(final_path))
+    os.makedirs(final_dir, exist_ok=True)
+    _fsync(partial)
+    try:
+        os.replace(partial, final_path)
+    except OSError:
+        local = os.path.join(
+            final_dir, os.path.basename(final_path) + PARTIAL_SUFFIX + ".copy"
+        )
+        _copy_synced(partial, local)
+        os.replace(local, final_path)
+        os.remove(partial)
+    _fsync(final_dir)
+
+
+def finalize_dir(directory, model_dir):
+    """finalize() every file a downloader left in a staging_dir(), returns the paths"""
+    paths = []
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            path = os.path.join(str(model_dir), entry.name)
+            finalize(entry.path, path)
+            paths.append(path)
+    shutil.rmtree(directory, ignore_errors=True)
+    return paths
+
+
+def is_partial(name):
+    """Download leftovers, never a usable model"""
+    return PARTIAL_SUFFIX in name or name.endswith((".aria2", ".dlstate"))
+
+
+def collect_orphan_partials(max_age=PARTIAL_MAX_AGE):
+    """Delete partials no download has touched for max_age, returns bytes freed"""
+    roots = [MODELS_DIR] + ([STAGING_DIR] if STAGING_DIR else [])
+    cutoff = time.time() - max_age
+    freed = 0
+    stack = [root for root in roots if os.path.isdir(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if PARTIAL_SUFFIX not in entry.name:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if st.st_mtime > cutoff:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    freed += _tree_size(entry.path)
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    freed += st.st_size
+                    os.remove(entry.path)
+                print(f"Removed orphaned partial download {entry.path}")
+            except OSError:
+                continue
+    return freed
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
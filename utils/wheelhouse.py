@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from utils.downloadProgress import format_bytes
+from utils.hashManifest import sha256_file
+
+# wheels for the venv, on the volume so a new container installs without the network
+WHEELHOUSE_DIR = os.environ.get(
+    "WHEELHOUSE_DIR", os.path.join("/workspace", ".cache", "wheelhouse")
+)
+# locks kept besides the current one, their wheels survive pruning
+KEEP_LOCKS = 1
+LOCK_FILE_NAME = "lock.txt"
+
+
+def _path(*parts):
+    return os.path.join(WHEELHOUSE_DIR, *parts)
+
+
+def _run(cmd):
+    print(f"Running: {' '.join(cmd)}", flush=True)
+    return subprocess.run(cmd).returncode == 0
+
+
+def _load_resolved():
+    try:
+        with open(_path("resolved.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_resolved(resolved):
+    tmp_path = _path(f"resolved.json.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(resolved, f, indent=1)
+    os.replace(tmp_path, _path("resolved.json"))
+
+
+def locked_wheels(key):
+    """Wheel paths of a lock, None when the lock or one of its wheels is missing"""
+    lock_dir = _path("locks", key)
+    try:
+        with open(os.path.join(lock_dir, LOCK_FILE_NAME), "r") as f:
+            names = [line.split()[1] for line in f if line.strip()]
+    except (OSError, IndexError):
+        return None
+    paths = [os.path.join(lock_dir, name) for name in names]
+    return paths if all(os.path.exists(path) for path in paths) else None
+
+
+def resolved_lock(fingerprint):
+    """Lock built for a requirements fingerprint, if its wheels are all there"""
+    key = _load_resolved().get(fingerprint)
+    if key and locked_wheels(key) is not None:
+        return key
+    return None
+
+
+def _link(source, target):
+    # volumes without hardlinks get a relative symlink, a copy as a last resort
+    try:
+        os.link(source, target)
+        return
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.relpath(source, os.path.dirname(target)), target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _lock_digests(key):
+    """sha256 of every wheel a lock lists, None when it has no lock.txt"""
+    try:
+        with open(_path("locks", key, LOCK_FILE_NAME), "r") as f:
+            return {line.split()[0] for line in f if line.strip()}
+    except (OSError, IndexError):
+        return None
+
+
+def build_lock(fingerprint, steps):
+    """
+    Resolve and fetch wheels for everything, returns the lock key or None.
+
+    steps are `pip wheel` argument lists, run in order into one directory
+    so later steps see earlier wheels. Every wheel goes to blobs/<sha256>
+    and is linked into locks/<key>/ under its own name, key being the hash
+    of the (sha256, filename) list, so locks share wheels they have in
+    common. Wheels of the locks already here are offered to pip first.
+    """
+    os.makedirs(_path("blobs"), exist_ok=True)
+    os.makedirs(_path("locks"), exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix="build-", dir=WHEELHOUSE_DIR)
+    try:
+        pip = [sys.executable, "-m", "pip", "wheel", "--wheel-dir", build_dir]
+        pip += ["--find-links", build_dir]
+        for key in os.listdir(_path("locks")):
+            pip += ["--find-links", _path("locks", key)]
+        for args in steps:
+            if not _run([*pip, *args]):
+                return None
+
+        entries = []
+        for name in sorted(os.listdir(build_dir)):
+            if not name.endswith(".whl"):
+                continue
+            path = os.path.join(build_dir, name)
+            digest = sha256_file(path)
+            blob = _path("blobs", digest)
+            if not os.path.exists(blob):
+                os.replace(path, blob)
+            entries.append((digest, name))
+
+        lock = "".join(f"{digest}  {name}\n" for digest, name in entries)
+        key = hashlib.sha256(lock.encode()).hexdigest()[:16]
+        lock_dir = _path("locks", key)
+        os.makedirs(lock_dir, exist_ok=True)
+        for digest, name in entries:
+            target = os.path.join(lock_dir, name)
+            if not os.path.exists(target):
+                _link(_path("blobs", digest), target)
+        # written last, a lock without it is incomplete
+        with open(os.path.join(lock_dir, LOCK_FILE_NAME), "w") as f:
+            f.write(lock)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    resolved = _load_resolved()
+    resolved[fingerprint] = key
+    _save_resolved(resolved)
+    print(f"Wheelhouse lock {key}: {len(entries)} wheels")
+    return key
+
+
+def install_lock(key, installer):
+    """Install exactly the wheels of a lock, no index is contacted"""
+    wheels = locked_wheels(key)
+    if wheels is None:
+        return False
+    os.utime(_path("locks", key))
+    print(f"Installing {len(wheels)} wheels from the wheelhouse (lock {key})...")
+    return _run([*installer, "--no-index", "--no-deps", *wheels])
+
+
+def prune(current):
+    """Drop locks other than current and the KEEP_LOCKS last used, then unused wheels"""
+    locks_dir = _path("locks")
+    if not os.path.isdir(locks_dir):
+        return 0
+    locks = {}
+    for entry in os.scandir(locks_dir):
+        digests = _lock_digests(entry.name)
+        if digests is None:
+            # a build killed before writing lock.txt
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            locks[entry.name] = (entry.stat().st_mtime, digests)
+    others = sorted(
+        (key for key in locks if key != current), key=lambda key: -locks[key][0]
+    )
+    for key in others[KEEP_LOCKS:]:
+        shutil.rmtree(_path("locks", key), ignore_errors=True)
+        print(f"Removed wheelhouse lock {key}")
+        del locks[key]
+
+    # a blob no remaining lock.txt lists is garbage. Link counts can't tell,
+    # a lock on a volume without hardlinks holds symlinks or copies
+    live = set().union(*(digests for _, digests in locks.values()))
+    freed = 0
+    for entry in os.scandir(_path("blobs")):
+        if entry.name not in live:
+            freed += entry.stat().st_size
+            os.remove(entry.path)
+
+    # and build dirs of installs that were killed
+    for entry in os.scandir(WHEELHOUSE_DIR):
+        if entry.name.startswith("build-") and entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    kept = set(os.listdir(locks_dir))
+    resolved = {fp: key for fp, key in _load_resolved().items() if key in kept}
+    _save_resolved(resolved)
+    if freed:
+        print(f"Pruned the wheelhouse, freed {format_bytes(freed)}")
+    return freed
@@ -0,0 +1,266 @@
+import os
+import struct
+import time
+import zlib
+
+# zip format limits, anything above needs zip64 extra fields
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+CHUNK_SIZE = 1024 * 1024
+
+# general purpose flag bits: sizes/crc are in a data descriptor, filename is utf-8
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+def _dos_datetime(mtime):
+    """Convert a unix timestamp into (dos_time, dos_date)"""
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def deflate_file(path, size, level=6):
+    """Raw-deflate the first size bytes of a file, returns (crc, file_size, payload)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    file_size = 0
+    parts = []
+    with open(path, "rb") as src:
+        while file_size < size:
+            chunk = src.read(min(CHUNK_SIZE, size - file_size))
+            if not chunk:
+                break
+            file_size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    return crc, file_size, b"".join(parts)
+
+
+class ZipStreamWriter:
+    """
+    Write a zip archive as a sequence of byte chunks without ever seeking.
+
+    every entry uses a data descriptor so crc and sizes can be computed while
+    streaming, and zip64 records are emitted for large files/offsets.
+    """
+
+    def __init__(self, offset=0, entries=None):
+        self.offset = offset
+        self.entries = entries if entries is not None else []
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _local_header(self, name, flags, method, mtime, zip64):
+        dos_time, dos_date = _dos_datetime(mtime)
+        if zip64:
+            version = 45
+            extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+            size_field = ZIP64_LIMIT
+        else:
+            version = 20
+            extra = b""
+            size_field = 0
+
+        header = struct.pack(
+            "<4sHHHHHLLLHH",
+            b"PK\x03\x04",
+            version,
+            flags,
+            method,
+            dos_time,
+            dos_date,
+            0,
+            size_field,
+            size_field,
+            len(name),
+            len(extra),
+        )
+        return header + name + extra
+
+    def _data_descriptor(self, crc, compress_size, file_size, zip64):
+        if zip64:
+            return struct.pack("<4sLQQ", b"PK\x07\x08", crc, compress_size, file_size)
+        return struct.pack("<4sLLL", b"PK\x07\x08", crc, compress_size, file_size)
+
+    def _begin_entry(self, arcname, method, mtime, file_size):
+        arcname = arcname.replace(os.sep, "/")
+        name = arcname.encode("utf-8")
+        flags = FLAG_DATA_DESCRIPTOR
+        if not name.isascii():
+            flags |= FLAG_UTF8
+
+        # same heuristic as zipfile: deflate can slightly grow incompressible data
+        zip64 = file_size * 1.05 > ZIP64_LIMIT
+        # plain json-friendly values, entries can be persisted and written again later
+        entry = {
+            "name": arcname,
+            "flags": flags,
+            "method": method,
+            "mtime": mtime,
+            "offset": self.offset,
+            "zip64": zip64,
+        }
+        return entry, self._emit(
+            self._local_header(name, flags, method, mtime, zip64)
+        )
+
+    def _end_entry(self, entry, crc, compress_size, file_size):
+        entry.update(crc=crc, compress_size=compress_size, file_size=file_size)
+        self.entries.append(entry)
+        return self._emit(
+            self._data_descriptor(crc, compress_size, file_size, entry["zip64"])
+        )
+
+    def write_file(self, path, arcname, compress=True, chunk_size=CHUNK_SIZE):
+        """Yield the bytes of one archive entry read from path"""
+        # open before emitting anything so a vanished file doesn't corrupt the stream
+        src = open(path, "rb")
+        with src:
+            st = os.fstat(src.fileno())
+            # only archive the size we saw, outputs may still be growing
+            remaining = st.st_size
+            method = ZIP_DEFLATED if compress else ZIP_STORED
+            entry, header = self._begin_entry(arcname, method, st.st_mtime, remaining)
+            yield header
+
+            compressor = (
+                zlib.compressobj(6, zlib.DEFLATED, -15) if compress else None
+            )
+            crc = 0
+            file_size = 0
+            compress_size = 0
+            while remaining > 0:
+                chunk = src.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                file_size += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    compress_size += len(chunk)
+                    yield self._emit(chunk)
+
+            if compressor:
+                tail = compressor.flush()
+                compress_size += len(tail)
+                yield self._emit(tail)
+
+        yield self._end_entry(entry, crc, compress_size, file_size)
+
+    def write_deflated(self, arcname, mtime, file_size, crc, payload):
+        """Yield one archive entry from data that was already raw-deflated elsewhere"""
+        entry, header = self._begin_entry(arcname, ZIP_DEFLATED, mtime, file_size)
+        yield header
+        yield self._emit(payload)
+        yield self._end_entry(entry, crc, len(payload), file_size)
+
+    def central_directory(self):
+        """Return the central directory and end records for the entries written so far"""
+        cd_offset = self.offset
+        records = []
+        for entry in self.entries:
+            file_size = entry["file_size"]
+            compress_size = entry["compress_size"]
+            header_offset = entry["offset"]
+
+            zip64_fields = []
+            if file_size >= ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+                file_size = ZIP64_LIMIT
+            if compress_size >= ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+                compress_size = ZIP64_LIMIT
+            if header_offset >= ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = ZIP64_LIMIT
+
+            extra = b""
+            if zip64_fields:
+                extra = struct.pack(
+                    f"<HH{len(zip64_fields)}Q",
+                    1,
+                    8 * len(zip64_fields),
+                    *zip64_fields,
+                )
+            version = 45 if (zip64_fields or entry["zip64"]) else 20
+            dos_time, dos_date = _dos_datetime(entry["mtime"])
+            name = entry["name"].encode("utf-8")
+
+            records.append(
+                struct.pack(
+                    "<4sBBBBHHHHLLLHHHHHLL",
+                    b"PK\x01\x02",
+                    version,
+                    3,  # made by unix, so external attrs are permission bits
+                    version,
+                    0,
+                    entry["flags"],
+                    entry["method"],
+                    dos_time,
+                    dos_date,
+                    entry["crc"],
+                    compress_size,
+                    file_size,
+                    len(name),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    0o100644 << 16,
+                    header_offset,
+                )
+                + name
+                + extra
+            )
+
+        central_dir = b"".join(records)
+        cd_size = len(central_dir)
+        count = len(self.entries)
+        end = b""
+
+        if (
+            count >= ZIP_FILECOUNT_LIMIT
+            or cd_size >= ZIP64_LIMIT
+            or cd_offset >= ZIP64_LIMIT
+        ):
+            zip64_end_offset = cd_offset + cd_size
+            end += struct.pack(
+                "<4sQHHLLQQQQ",
+                b"PK\x06\x06",
+                44,
+                45,
+                45,
+                0,
+                0,
+                count,
+                count,
+                cd_size,
+                cd_offset,
+            )
+            end += struct.pack("<4sLQL", b"PK\x06\x07", 0, zip64_end_offset, 1)
+
+        end += struct.pack(
+            "<4sHHHHLLH",
+            b"PK\x05\x06",
+            0,
+            0,
+            min(count, ZIP_FILECOUNT_LIMIT),
+            min(count, ZIP_FILECOUNT_LIMIT),
+            min(cd_size, ZIP64_LIMIT),
+            min(cd_offset, ZIP64_LIMIT),
+            0,
+        )
+        return central_dir + end
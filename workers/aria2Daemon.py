@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import re
+import secrets
+import shutil
+
+from utils.aria2Rpc import RPC_STATE_FILE, Aria2Rpc, Aria2RpcError
+
+ARIA2_RPC_PORT = int(os.environ.get("ARIA2_RPC_PORT", 6800))
+# use an aria2 rpc server that is already running instead of starting one
+ARIA2_RPC_URL = os.environ.get("ARIA2_RPC_URL")
+ARIA2_RPC_SECRET = os.environ.get("ARIA2_RPC_SECRET")
+ARIA2_MAX_CONCURRENT = int(os.environ.get("ARIA2_MAX_CONCURRENT", 5))
+# global bandwidth cap for every download going through the daemon, 0 = unlimited
+DOWNLOAD_MAX_SPEED = os.environ.get("DOWNLOAD_MAX_SPEED", "0")
+
+SPEED_PATTERN = re.compile(r"^\d+[KkMm]?$")
+START_TIMEOUT = 5
+
+
+class Aria2Daemon:
+    """
+    The single long-lived aria2c every aria2 download goes through.
+
+    started by the log viewer, download_models.py finds it through the rpc
+    state file. Connections, the speed limit and state are shared.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.rpc = None
+        self.max_speed = DOWNLOAD_MAX_SPEED
+        self.lock = asyncio.Lock()
+
+    @property
+    def running(self):
+        if self.rpc is None:
+            return False
+        return self.process is None or self.process.returncode is None
+
+    async def ensure_started(self):
+        """Return the rpc client, starting aria2c if needed. None when aria2c isn't available"""
+        async with self.lock:
+            if self.running:
+                return self.rpc
+
+            if ARIA2_RPC_URL:
+                self.rpc = Aria2Rpc(ARIA2_RPC_URL, ARIA2_RPC_SECRET)
+                return self.rpc
+
+            if shutil.which("aria2c") is None:
+                print("aria2c not found, downloads use one process each")
+                return None
+
+            secret = secrets.token_hex(16)
+            self.process = await asyncio.create_subprocess_exec(
+                "aria2c",
+                "--enable-rpc",
+                "--rpc-listen-all=false",
+                f"--rpc-listen-port={ARIA2_RPC_PORT}",
+                f"--rpc-secret={secret}",
+                f"--max-concurrent-downloads={ARIA2_MAX_CONCURRENT}",
+                f"--max-overall-download-limit={self.max_speed}",
+                "--max-connection-per-server=16",
+                "--split=16",
+                "--min-split-size=1M",
+                "--file-allocation=none",
+                "--continue=true",
+                "--max-tries=5",
+                "--retry-wait=10",
+                "--connect-timeout=30",
+                "--timeout=600",
+                "--console-log-level=warn",
+                "--summary-interval=0",
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            rpc = Aria2Rpc(f"http://127.0.0.1:{ARIA2_RPC_PORT}/jsonrpc", secret)
+
+            for _ in range(START_TIMEOUT * 10):
+                if self.process.returncode is not None:
+                    break
+                if await rpc.ping():
+                    self.rpc = rpc
+                    self._write_state()
+                    print(f"Started aria2c rpc daemon on port {ARIA2_RPC_PORT}")
+                    return rpc
+                await asyncio.sleep(0.1)
+
+            print("aria2c rpc daemon did not start, downloads use one process each")
+            if self.process.returncode is None:
+                self.process.kill()
+                await self.process.wait()
+            self.process = None
+            return None
+
+    def _write_state(self):
+        fd = os.open(RPC_STATE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {
+                    "url": self.rpc.url,
+                    "secret": self.rpc.secret,
+                    "pid": self.process.pid,
+                },
+                f,
+            )
+
+    async def set_max_speed(self, max_speed):
+        """Change the global download limit, e.g. 20M, 0 for unlimited"""
+        if not SPEED_PATTERN.match(str(max_speed)):
+            raise ValueError(
+                f"invalid speed limit {max_speed}, use e.g. 500K, 20M or 0"
+            )
+        rpc = await self.ensure_started()
+        if rpc is None:
+            raise RuntimeError("aria2 daemon is not running")
+        await rpc.call(
+            "changeGlobalOption", {"max-overall-download-limit": str(max_speed)}
+        )
+        self.max_speed = str(max_speed)
+
+    async def status(self):
+        if not self.running:
+            return {"running": False, "max_speed": self.max_speed}
+        try:
+            stat = await self.rpc.call("getGlobalStat")
+        except Aria2RpcError as e:
+            return {"running": False, "max_speed": self.max_speed, "error": str(e)}
+        return {
+            "running": True,
+            "max_speed": self.max_speed,
+            "download_speed": int(stat.get("downloadSpeed", 0)),
+            "active": int(stat.get("numActive", 0)),
+            "waiting": int(stat.get("numWaiting", 0)),
+        }
+
+    async def stop(self):
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            try:
+                await self.rpc.call("shutdown")
+                await asyncio.wait_for(self.process.wait(), 10)
+            except (Aria2RpcError, asyncio.TimeoutError):
+                self.process.kill()
+                await self.process.wait()
+        if os.path.exists(RPC_STATE_FILE):
+            os.remove(RPC_STATE_FILE)
+        self.process = None
+        self.rpc = None
+
+
+# shared by the viewer's download jobs
+aria2_daemon = Aria2Daemon()
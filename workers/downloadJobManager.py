@@ -0,0 +1,293 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+import uuid
+from urllib.parse import urlparse
+
+from constants.websocketEventManager import publish_message
+from utils.downloadProgress import ProgressTracker, describe_progress
+
+# downloads running at once, in total and against the same host
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("DOWNLOAD_MAX_CONCURRENT", 2))
+MAX_DOWNLOADS_PER_HOST = int(os.environ.get("DOWNLOAD_MAX_PER_HOST", 2))
+# finished jobs kept for GET /api/downloads
+FINISHED_JOBS_KEPT = 100
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+# the job whose runner is executing, set for the runner's task
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+def download_host(url):
+    """Host a download counts against, bare google drive ids included"""
+    return urlparse(url).hostname or "drive.google.com"
+
+
+class DownloadJob:
+    """
+    One requested download.
+
+    runner is a callable returning a fresh coroutine, so a paused job can be
+    started again. The coroutine returns {"success": bool, "message": str}.
+    """
+
+    def __init__(self, source, url, runner, priority=0, model_type=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.url = url
+        self.host = download_host(url)
+        self.model_type = model_type
+        self.runner = runner
+        self.priority = priority
+        self.status = QUEUED
+        self.detail = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = None
+        self.task = None
+        # whatever the runner needs to continue after a pause, e.g. an aria2 gid
+        self.resume_state = None
+        # set by the runner when its backend continues a paused download,
+        # curl and gdown would start over
+        self.resumable = False
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "source": self.source,
+            "url": self.url,
+            "host": self.host,
+            "model_type": self.model_type,
+            "priority": self.priority,
+            "status": self.status,
+            "detail": self.detail,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": self.progress,
+            "resumable": self.resumable,
+        }
+
+
+class DownloadJobManager:
+    """
+    Priority queue of download jobs with global and per-host concurrency caps.
+
+    higher priority starts first, equal priority in submission order. All
+    methods run inside the event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+        max_per_host=MAX_DOWNLOADS_PER_HOST,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_host = max_per_host
+        self.jobs = {}
+        # (-priority, order, job), entries of jobs that left the queue are skipped
+        self.queue = []
+        self.order = itertools.count()
+        self.running = {}
+
+    def submit(self, source, url, runner, priority=0, model_type=None):
+        job = DownloadJob(source, url, runner, priority, model_type)
+        self.jobs[job.id] = job
+        self._enqueue(job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        """Jobs by status, queued ones in the order they will start"""
+        queued = sorted(
+            (job for job in self.jobs.values() if job.status == QUEUED),
+            key=lambda job: (-job.priority, job.created),
+        )
+        return {
+            "queued": [job.to_dict() for job in queued],
+            "running": [job.to_dict() for job in self.running.values()],
+            "paused": [
+                job.to_dict() for job in self.jobs.values() if job.status == PAUSED
+            ],
+            "finished": [
+                job.to_dict()
+                for job in sorted(
+                    (job for job in self.jobs.values() if job.status in FINISHED),
+                    key=lambda job: job.finished,
+                    reverse=True,
+                )
+            ],
+            "limits": {
+                "max_concurrent": self.max_concurrent,
+                "max_per_host": self.max_per_host,
+            },
+        }
+
+    def cancel(self, job_id):
+        return self._stop(job_id, CANCELLED)
+
+    def pause(self, job_id):
+        job = self._require(job_id)
+        if job.status == RUNNING and not job.resumable:
+            raise ValueError(f"job {job_id} can't be paused, its download can't resume")
+        return self._stop(job_id, PAUSED)
+
+    def resume(self, job_id):
+        job = self._require(job_id)
+        if job.status != PAUSED:
+            raise ValueError(f"job {job_id} is {job.status}, not paused")
+        self._enqueue(job)
+        return job
+
+    def set_priority(self, job_id, priority):
+        job = self._require(job_id)
+        job.priority = priority
+        if job.status == QUEUED:
+            # the old heap entry is skipped once this one is popped
+            self._enqueue(job)
+        return job
+
+    def _require(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def _stop(self, job_id, status):
+        job = self._require(job_id)
+        if job.status in FINISHED or (job.status == PAUSED and status == PAUSED):
+            raise ValueError(f"job {job_id} is already {job.status}")
+
+        if job.status == RUNNING:
+            # the runner kills its process on cancellation, _on_done sees this status
+            job.status = status
+            job.task.cancel()
+        else:
+            job.status = status
+            self._changed(job)
+        if status in FINISHED:
+            # set right away, _prune and list sort finished jobs by it
+            job.finished = time.time()
+        return job
+
+    def _enqueue(self, job):
+        job.status = QUEUED
+        heapq.heappush(self.queue, (-job.priority, next(self.order), job))
+        self._changed(job)
+        self._schedule()
+
+    def _host_running(self, host):
+        return sum(1 for job in self.running.values() if job.host == host)
+
+    def _schedule(self):
+        """Start queued jobs while there is room, a busy host doesn't block others"""
+        waiting = []
+        while self.queue and len(self.running) < self.max_concurrent:
+            entry = heapq.heappop(self.queue)
+            job = entry[2]
+            if job.status != QUEUED or -entry[0] != job.priority:
+                continue
+            if self._host_running(job.host) >= self.max_per_host:
+                waiting.append(entry)
+                continue
+            self._start(job)
+
+        for entry in waiting:
+            heapq.heappush(self.queue, entry)
+
+    def _start(self, job):
+        job.status = RUNNING
+        job.started = time.time()
+        job.detail = None
+        job.progress = None
+        job.task = asyncio.create_task(self._run(job))
+        job.task.add_done_callback(lambda task: self._on_done(job, task))
+        self.running[job.id] = job
+        self._changed(job)
+
+    async def _run(self, job):
+        current_job.set(job)
+        return await job.runner()
+
+    def _on_done(self, job, task):
+        self.running.pop(job.id, None)
+        job.task = None
+
+        if task.cancelled():
+            if job.status == RUNNING:
+                job.status = CANCELLED
+        elif task.exception() is not None:
+            job.status = FAILED
+            job.detail = str(task.exception())
+        else:
+            result = task.result() or {}
+            job.status = COMPLETED if result.get("success") else FAILED
+            job.detail = result.get("message")
+
+        if job.status in FINISHED:
+            job.finished = time.time()
+        self._changed(job)
+        self._prune()
+        self._schedule()
+
+    def _prune(self):
+        finished = sorted(
+            (job for job in self.jobs.values() if job.status in FINISHED),
+            key=lambda job: job.finished,
+        )
+        for job in finished[: max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[job.id]
+
+    def _changed(self, job):
+        publish_message({"type": "download_job", "data": job.to_dict()})
+
+
+# shared by the download endpoints
+download_jobs = DownloadJobManager()
+
+
+def mark_resumable():
+    """Called by a runner whose backend picks a paused download up where it stopped"""
+    job = current_job.get()
+    if job is not None:
+        job.resumable = True
+
+
+def _report_progress(progress):
+    job = current_job.get()
+    if job is None:
+        return
+    job.progress = progress
+    publish_message(
+        {
+            "type": "download_progress",
+            "data": {"id": job.id, "source": job.source, **progress},
+        }
+    )
+
+
+def _report_stall(progress, seconds):
+    job = current_job.get()
+    if job is not None:
+        print(
+            f"Download {job.id} ({job.url}) stalled, no data for {seconds:.0f}s: "
+            f"{describe_progress(progress)}"
+        )
+
+
+def job_progress_tracker():
+    """Progress tracker that streams to the websocket as the current job's progress"""
+    return ProgressTracker(on_update=_report_progress, on_stall=_report_stall)
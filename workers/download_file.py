@@ -1,8 +1,94 @@
 import asyncio
 import os
+import shutil
 import subprocess
 
 from constants.websocketEventManager import broadcast_to_websockets
+from utils.aria2Rpc import Aria2Download
+from utils.downloadProgress import run_download_process
+from utils.hashManifest import hash_manifest
+from utils.modelsLock import load_lock
+from utils.stagedDownload import finalize, finalize_dir, partial_path, staging_dir
+from utils.segmentedDownload import (
+    download_url,
+    native_backend_enabled,
+    probe_remote,
+)
+from workers.aria2Daemon import aria2_daemon
+from workers.downloadJobManager import (
+    PAUSED,
+    current_job,
+    job_progress_tracker,
+    mark_resumable,
+)
+
+
+def locked_sha256(url):
+    """sha256 the models lockfile pins for url, None when it isn't locked"""
+    return load_lock().get(url, {}).get("sha256")
+
+
+async def download_with_aria2_daemon(rpc, url, directory, filename, options=None):
+    """Run a download through the shared aria2c, pausing the job pauses it in aria2"""
+    job = current_job.get()
+    if job is not None and job.resume_state is not None:
+        download = job.resume_state
+    else:
+        download = Aria2Download(rpc, url, directory, filename, options)
+    if job is not None:
+        job.resume_state = download
+        job.resumable = True
+
+    try:
+        return await download.run(job_progress_tracker())
+    except asyncio.CancelledError:
+        if job is not None and job.status == PAUSED:
+            await download.pause()
+        else:
+            await download.remove()
+        raise
+
+
+async def _download_huggingface_process(url, model_dir, filename, options):
+    """One aria2c process for this download, used when the daemon isn't there"""
+    # -c continues the partial and its .aria2 control file after a pause
+    mark_resumable()
+    cmd = [
+        "aria2c",
+        *(f"--{name}={value}" for name, value in options.items()),
+        "--console-log-level=error",
+        "-c",
+        "-x",
+        "16",
+        "-s",
+        "16",
+        "-k",
+        "1M",
+        "--file-allocation=none",
+        "--optimize-concurrent-downloads=true",
+        "--max-connection-per-server=16",
+        "--min-split-size=1M",
+        "--max-tries=5",
+        "--retry-wait=10",
+        "--connect-timeout=30",
+        "--timeout=600",
+        # one progress readout per second, parsed by run_download_process
+        "--summary-interval=0",
+        "--show-console-readout=true",
+        url,
+        "-d",
+        model_dir,
+        "-o",
+        filename,
+    ]
+
+    returncode, stdout, stderr = await run_download_process(
+        cmd, "aria2c", job_progress_tracker()
+    )
+
+    print(stdout.decode())
+    print(stderr.decode())
+    return returncode == 0, stdout.decode()
 
 
 async def download_from_civitai_async(url, api_key=None, model_type="loras"):
@@ -20,12 +106,15 @@ async def download_from_civitai_async(url, api_key=None, model_type="loras"):
     model_dir = os.path.join("/workspace", "ComfyUI", model_path)
     os.makedirs(model_dir, exist_ok=True)
 
+    # curl names the file from the response, it lands in a staging dir first
+    download_dir = staging_dir(model_dir)
     cmd = [
         "curl",
         "-L",
         "-J",
         "-O",
-        "--output-dir", model_dir,
+        "--fail",
+        "--output-dir", download_dir,
     ]
 
     if api_key:
@@ -34,16 +123,42 @@ async def download_from_civitai_async(url, api_key=None, model_type="loras"):
     cmd.append(url)
 
     try:
-        # Use asyncio.create_subprocess_exec for non-blocking execution
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-
-        print(stdout.decode())
-        print(stderr.decode())
-
-        if process.returncode == 0:
+        if native_backend_enabled():
+            shutil.rmtree(download_dir, ignore_errors=True)
+            headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+            mark_resumable()
+            path = await download_url(
+                url,
+                model_dir,
+                headers=headers,
+                tracker=job_progress_tracker(),
+                sha256=locked_sha256(url),
+            )
+            print(f"Downloaded {path}")
+            returncode, stdout = 0, b""
+        else:
+            # Use asyncio.create_subprocess_exec for non-blocking execution
+            try:
+                returncode, stdout, stderr = await run_download_process(
+                    cmd, "curl", job_progress_tracker()
+                )
+            except asyncio.CancelledError:
+                # cancelled, curl can't continue it so nothing is worth keeping
+                shutil.rmtree(download_dir, ignore_errors=True)
+                raise
+
+            print(stdout.decode())
+            print(stderr.decode())
+
+            if returncode == 0:
+                for path in await asyncio.to_thread(
+                    finalize_dir, download_dir, model_dir
+                ):
+                    print(f"Downloaded {path}")
+            else:
+                shutil.rmtree(download_dir, ignore_errors=True)
+
+        if returncode == 0:
             await broadcast_to_websockets(
                 {"type": "download", "data": {"status": "success", "source": "civitai"}}
             )
@@ -89,40 +204,40 @@ async def download_from_huggingface_async(url, model_type="loras"):
 
     try:
         filename = url.split("/")[-1]
-        cmd = [
-            "aria2c",
-            "--console-log-level=error",
-            "-c",
-            "-x",
-            "16",
-            "-s",
-            "16",
-            "-k",
-            "1M",
-            "--file-allocation=none",
-            "--optimize-concurrent-downloads=true",
-            "--max-connection-per-server=16",
-            "--min-split-size=1M",
-            "--max-tries=5",
-            "--retry-wait=10",
-            "--connect-timeout=30",
-            "--timeout=600",
-            url,
-            "-d",
-            model_dir,
-            "-o",
-            filename,
-        ]
-
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-
-        print(stdout.decode())
-        print(stderr.decode())
+        if native_backend_enabled():
+            mark_resumable()
+            path = await download_url(
+                url,
+                model_dir,
+                filename,
+                tracker=job_progress_tracker(),
+                sha256=locked_sha256(url),
+            )
+            print(f"Downloaded {path}")
+            success, detail = True, None
+        else:
+            # aria2 checks the file against the locked sha256 or the one HF
+            # publishes, by reading it again once complete, only the native
+            # engine hashes on the fly
+            sha256 = locked_sha256(url) or (await probe_remote(url))[1]
+            options = {"checksum": f"sha-256={sha256}"} if sha256 else {}
+            path = os.path.join(model_dir, filename)
+            partial = partial_path(path)
+            partial_dir, partial_name = os.path.split(partial)
+            rpc = await aria2_daemon.ensure_started()
+            if rpc is not None:
+                success, detail = await download_with_aria2_daemon(
+                    rpc, url, partial_dir, partial_name, options
+                )
+            else:
+                success, detail = await _download_huggingface_process(
+                    url, partial_dir, partial_name, options
+                )
+            if success:
+                await asyncio.to_thread(finalize, partial, path)
+                hash_manifest.record(path, sha256, verified=bool(sha256))
 
-        if process.returncode == 0:
+        if success:
             await broadcast_to_websockets(
                 {
                     "type": "download",
@@ -137,11 +252,11 @@ async def download_from_huggingface_async(url, model_type="loras"):
                     "data": {
                         "status": "failed",
                         "source": "huggingface",
-                        "detail": stdout.decode(),
+                        "detail": detail,
                     },
                 }
             )
-            return {"success": False, "message": f"Download failed: {stdout.decode()}"}
+            return {"success": False, "message": f"Download failed: {detail}"}
     except Exception as e:
 
         await broadcast_to_websockets(
@@ -204,27 +319,38 @@ async def download_from_googledrive_async(
             )
             await process.communicate()
 
-        # Download the file
+        # Download the file, into a staging dir until it is complete
+        download_dir = staging_dir(model_dir)
         if custom_filename:
             cmd = [
                 "gdown",
                 "--id",
                 file_id,
                 "-O",
-                os.path.join(model_dir, custom_filename),
+                os.path.join(download_dir, custom_filename),
             ]
         else:
-            cmd = ["gdown", "--id", file_id, "-O", model_dir]
+            # trailing slash makes gdown keep the drive file name
+            cmd = ["gdown", "--id", file_id, "-O", os.path.join(download_dir, "")]
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
+        try:
+            returncode, stdout, stderr = await run_download_process(
+                cmd, "gdown", job_progress_tracker()
+            )
+        except asyncio.CancelledError:
+            # cancelled, gdown can't continue it so nothing is worth keeping
+            shutil.rmtree(download_dir, ignore_errors=True)
+            raise
 
         print(stdout.decode())
         print(stderr.decode())
 
-        if process.returncode == 0:
+        if returncode == 0:
+            await asyncio.to_thread(finalize_dir, download_dir, model_dir)
+        else:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+        if returncode == 0:
             await broadcast_to_websockets(
                 {"type": "download", "data": {"status": "success", "source": "gdrive"}}
             )
@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+from constants.websocketEventManager import publish_message
+from download_models import prepare_downloads, run_downloads, setup_logging
+from utils.downloadScheduler import COMPLETED
+from utils.modelInventory import (
+    INSTALLED,
+    iter_config_urls,
+    model_filename,
+    model_inventory,
+)
+from utils.modelsConfig import models_config
+from utils.modelsLock import LOCK_FILE
+
+IDLE = "idle"
+PREPARING = "preparing"
+DOWNLOADING = "downloading"
+FINISHED = "finished"
+FAILED = "failed"
+
+READY = "ready"
+
+
+class ModelDownloadService:
+    """
+    The boot downloads of models_config.json, run inside the viewer.
+
+    start.sh starts them and goes on to launch ComfyUI, which only sees a
+    model once its download was renamed into place. readiness() tells which
+    files are there, bump() moves a queued file to the front.
+    """
+
+    def __init__(self):
+        self.state = IDLE
+        self.detail = None
+        self.started = None
+        self.finished = None
+        self.scheduler = None
+        self.task = None
+
+    def start(self, lock_path=LOCK_FILE):
+        """Start the boot downloads, False when they are already running"""
+        if self.task is not None and not self.task.done():
+            return False
+        self.scheduler = None
+        self.detail = None
+        self.started = time.time()
+        self.finished = None
+        # progress goes to comfyui.log like a download_models.py run
+        setup_logging()
+        self._set_state(PREPARING)
+        self.task = asyncio.create_task(self._run(lock_path))
+        return True
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _run(self, lock_path):
+        try:
+            self.scheduler = await prepare_downloads(lock_path, self._item_changed)
+            if self.scheduler is not None:
+                self._set_state(DOWNLOADING)
+                results = await run_downloads(self.scheduler)
+                failed = sum(1 for success in results.values() if not success)
+                if failed:
+                    self.detail = f"{failed} of {len(results)} downloads failed"
+            self.finished = time.time()
+            self._set_state(FINISHED)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Boot model downloads failed: {e}")
+            self.detail = str(e)
+            self.finished = time.time()
+            self._set_state(FAILED)
+
+    def bump(self, url):
+        """The scheduled file for url after moving it to the front, None if unknown"""
+        if self.scheduler is None:
+            return None
+        return self.scheduler.bump(url)
+
+    def status(self):
+        items = self.scheduler.items if self.scheduler else []
+        return {
+            "state": self.state,
+            "detail": self.detail,
+            "started": self.started,
+            "finished": self.finished,
+            "queued": (
+                [item.url for item in self.scheduler.queue] if self.scheduler else []
+            ),
+            "total": len(items),
+            "completed": sum(1 for item in items if item.state == COMPLETED),
+        }
+
+    async def readiness(self):
+        """
+        Every model of the config by category, with whether it is ready.
+
+        files the boot downloads handle report their state there (queued,
+        running, failed, ready when completed), the rest come from the model
+        inventory: ready, partial or missing.
+        """
+        config = await models_config.get()
+        inventory = await asyncio.to_thread(model_inventory.refresh)
+        queue = self.scheduler.queue if self.scheduler else []
+        categories = {}
+        for category, url in iter_config_urls(config or {}):
+            name = model_filename(url)
+            item = self.scheduler.get(url) if self.scheduler else None
+            if item is not None:
+                entry = _item_readiness(item)
+                if item in queue:
+                    entry["position"] = queue.index(item) + 1
+            else:
+                status = inventory.status(name, category)
+                entry = {
+                    "url": url,
+                    "name": name,
+                    "size": inventory.locate(name)[1],
+                    "state": READY if status == INSTALLED else status,
+                }
+            files = categories.setdefault(category, {"ready": True, "files": []})
+            files["files"].append(entry)
+            files["ready"] = files["ready"] and entry["state"] == READY
+        return {
+            **self.status(),
+            "ready": all(category["ready"] for category in categories.values()),
+            "categories": categories,
+        }
+
+    def _set_state(self, state):
+        self.state = state
+        publish_message({"type": "model_downloads", "data": self.status()})
+
+    def _item_changed(self, item):
+        publish_message({"type": "model_readiness", "data": _item_readiness(item)})
+
+
+def _item_readiness(item):
+    data = item.to_dict()
+    if item.state == COMPLETED:
+        data["state"] = READY
+    return data
+
+
+# started by start.sh through POST /api/models/boot-downloads
+model_downloads = ModelDownloadService()
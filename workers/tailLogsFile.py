@@ -1,71 +1,234 @@
 import asyncio
 import os
-import time
 
 from constants.logLock import log_buffer, log_lock
-from constants.websocketEventManager import sync_broadcast_to_websockets
-from utils.formatLogLine import format_log_line
-
-
-def tail_log_file():
-    """Continuously tail the log file and update the buffer"""
-    log_file = os.path.join("/", "workspace", "logs", "comfyui.log")
-
-    if not os.path.exists(log_file):
-        os.makedirs("/","workspace","logs", exist_ok=True)
-        open(log_file, "a").close()
-
-    def follow(file_path):
-        """Generator function that yields new lines in a file with proper handling of file rotation/truncation"""
-        with open(file_path, "r", encoding="utf-8") as file:
-            current_position = 0
-            while True:
-                try:
-                    # Check if file has been truncated
-                    file_size = os.path.getsize(file_path)
-                    if file_size < current_position:
-                        current_position = 0  # File was truncated, start from beginning
-
-                    # Seek to last position
-                    file.seek(current_position)
-
-                    # Read new lines
-                    new_lines = file.readlines()
-                    if new_lines:
-                        current_position = file.tell()
-                        for line in new_lines:
-                            yield line
-                    else:
-                        # No new lines, sleep before checking again
-                        time.sleep(0.1)
-                except Exception as e:
-                    print(f"Error following log file: {e}")
-                    time.sleep(1)  # Wait a bit longer on error
+from constants.websocketEventManager import publish_log_line
+from utils.fileWatcher import FileWatcher
+from utils.formatLogLine import classify_log_line, make_log_record
+from utils.logIndex import LEVEL_CODES, LogIndex
+from utils.logSegments import LogSegments, append_segment, compress_segment
+
+LOG_FILE = os.path.join("/", "workspace", "logs", "comfyui.log")
+# offset index and rotated segments of LOG_FILE, shared with the paging and search endpoints
+log_index = LogIndex(LOG_FILE)
+log_segments = LogSegments(LOG_FILE)
+
+READ_CHUNK_SIZE = 256 * 1024
+# the buffer only keeps the last 500 lines, no need to replay the whole file on start
+BACKFILL_BYTES = 256 * 1024
+
+
+def split_lines(text):
+    """Split on \\n, \\r\\n and bare \\r (tqdm redraws), last item is the unfinished line"""
+    return text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+
+
+def handle_log_line(line):
+    """Format a log line once, store it in the buffer and queue it for websocket clients"""
+    record = make_log_record(line)
+    with log_lock:
+        seq = log_buffer.append(record)
+
+    publish_log_line(record.html, seq)
+    return record
+
+
+def _publish(data):
+    """Publish the \\r separated parts of a line, returns the highest level code"""
+    level = 0
+    for part in split_lines(data.decode("utf-8", "replace")):
+        stripped_line = part.strip()
+        if stripped_line:
+            level = max(level, LEVEL_CODES[handle_log_line(stripped_line).level])
+    return level
+
+
+def _classify(data):
+    return LEVEL_CODES[classify_log_line(data.decode("utf-8", "replace"))]
+
+
+def _start_rotation(log_file, segments, position):
+    """gzip everything read so far into a new segment in a worker thread"""
+    path = segments.new_segment_path()
+    temp_path = path + ".tmp"
+    task = asyncio.create_task(
+        asyncio.to_thread(compress_segment, log_file, position, temp_path)
+    )
+    return {"task": task, "path": path, "temp_path": temp_path, "rotated_to": position}
+
+
+def _catch_up_rotation(log_file, rotation, position):
+    """gzip what was logged while compressing onto the segment in a worker thread"""
+    rotation["task"] = asyncio.create_task(
+        asyncio.to_thread(
+            append_segment,
+            log_file,
+            rotation["rotated_to"],
+            position,
+            rotation["temp_path"],
+        )
+    )
+    rotation["rotated_to"] = position
+
+
+def _finish_rotation(fd, log_file, index, segments, rotation):
+    """
+    Truncate the live log and record the segment, once it holds every byte.
+
+    returns False when it has to wait, a search still maps the log or new
+    bytes arrived since the last catch-up.
+    """
+    with index.lock:
+        # checked right before truncating, lines tee -a wrote since the
+        # catch-up go into the segment first
+        if index.readers or os.fstat(fd).st_size != rotation["rotated_to"]:
+            return False
+
+        # copytruncate, writers append with tee -a so they carry on at offset 0.
+        # renaming the log wouldn't work, tee keeps writing to the old inode
+        os.truncate(log_file, 0)
+        os.replace(rotation["temp_path"], rotation["path"])
+        segments.add(rotation["path"], index.count)
+        index.reset(os.fstat(fd).st_ino)
+    return True
+
+
+async def tail_log_file(log_file=LOG_FILE, index=None, segments=None):
+    """
+    Continuously tail the log file inside the event loop and update the buffer.
+
+    every line also goes into the on-disk offset index. On start only the
+    last BACKFILL_BYTES are replayed into the buffer, while the index picks
+    up where it stopped last time. The log is rotated into gzip segments
+    once it gets too big or too old.
+    """
+    log_dir = os.path.dirname(log_file)
+    os.makedirs(log_dir, exist_ok=True)
+    open(log_file, "a").close()
+
+    if index is None:
+        index = LogIndex(log_file)
+    if segments is None:
+        segments = LogSegments(log_file)
+    segments.load()
+    rotation = None
+    watcher = FileWatcher(log_dir)
+    fd = os.open(log_file, os.O_RDONLY)
+    stat = os.fstat(fd)
+    backfill_from = max(0, stat.st_size - BACKFILL_BYTES)
+    indexed_to = index.open(stat.st_ino, stat.st_size)
+    position = min(backfill_from, indexed_to)
+    # started in the middle of a line, drop that fragment (it's indexed already)
+    skip_fragment = 0 < position != indexed_to
+
+    # offset of the current unfinished line, its bytes not yet published and level so far
+    line_start = position
+    pending = b""
+    pending_level = 0
 
     try:
-        # Start the continuous tail
-        prev_line = None
-        for line in follow(log_file):
-            stripped_line = line.strip()
-            if stripped_line:  # Only process non-empty lines and not duplicates
-                with log_lock:
-                    log_buffer.append(stripped_line)
-                    if len(log_buffer) > 500:
-                        log_buffer.pop(0)
-
-                # Emit new log line via WebSocket (thread-safe)
-                sync_broadcast_to_websockets(
-                    {
-                        "type": "new_log_line",
-                        "line": format_log_line(stripped_line, ws=True),
-                    }
-                )
-            prev_line = stripped_line
-    except Exception as e:
-        print(f"Error tailing log file: {e}")
-        time.sleep(5)
-
-
-def tlf_worker(tail_log_file, loop):
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(tail_log_file())
+        while True:
+            try:
+                stat = os.fstat(fd)
+                replaced = os.stat(log_file).st_ino != stat.st_ino
+                # file was replaced under us, follow the new one
+                if replaced:
+                    os.close(fd)
+                    fd = os.open(log_file, os.O_RDONLY)
+                    stat = os.fstat(fd)
+
+                size = stat.st_size
+                if replaced or size < position:
+                    # truncated or new file, start over from the beginning of the new content
+                    index.reset(stat.st_ino)
+                    position = line_start = indexed_to = backfill_from = 0
+                    pending = b""
+                    pending_level = 0
+                    skip_fragment = False
+
+                if size == position:
+                    # only rotate between whole lines, once everything is read
+                    if rotation is None and line_start == position:
+                        if segments.rotation_due(size):
+                            rotation = _start_rotation(log_file, segments, position)
+                    elif rotation is not None and rotation["task"].done():
+                        error = rotation["task"].exception()
+                        if error is None and position < rotation["rotated_to"]:
+                            error = "log was truncated while rotating"
+                        if error is not None:
+                            print(f"Error rotating log file: {error}")
+                            if os.path.exists(rotation["temp_path"]):
+                                os.remove(rotation["temp_path"])
+                            rotation = None
+                        elif line_start == position > rotation["rotated_to"]:
+                            # a short append, wait for it and try to finish right away
+                            _catch_up_rotation(log_file, rotation, position)
+                            await asyncio.wait([rotation["task"]])
+                            continue
+                        elif line_start == position and _finish_rotation(
+                            fd, log_file, index, segments, rotation
+                        ):
+                            print(f"Rotated log into {rotation['path']}")
+                            rotation = None
+                            position = line_start = indexed_to = backfill_from = 0
+                            continue
+
+                    await watcher.wait()
+                    continue
+
+                data = os.pread(fd, min(READ_CHUNK_SIZE, size - position), position)
+                buf_offset = position - len(pending)
+                position += len(data)
+                buf = pending + data
+
+                start = 0
+                while True:
+                    newline = buf.find(b"\n", start)
+                    if newline < 0:
+                        break
+                    line_offset = line_start
+                    line = buf[start:newline]
+                    line_start = buf_offset + newline + 1
+                    start = newline + 1
+
+                    if skip_fragment:
+                        skip_fragment = False
+                    elif line_offset >= backfill_from:
+                        level = max(pending_level, _publish(line))
+                    else:
+                        level = max(pending_level, _classify(line))
+
+                    if line_offset >= indexed_to:
+                        index.add(line_offset, level)
+                        indexed_to = line_start
+                    pending_level = 0
+
+                pending = buf[start:]
+                if not skip_fragment:
+                    if line_start >= backfill_from:
+                        # tqdm redraws with \r, show those without waiting for the newline
+                        carriage = pending.rfind(b"\r")
+                        if carriage >= 0:
+                            level = _publish(pending[:carriage])
+                            pending_level = max(pending_level, level)
+                            pending = pending[carriage + 1 :]
+                    elif len(pending) > READ_CHUNK_SIZE:
+                        pending_level = max(pending_level, _classify(pending))
+                        pending = b""
+
+                index.flush(indexed_to)
+                watcher.activity()
+                # a big burst is read in chunks, let requests run in between
+                await asyncio.sleep(0)
+            except FileNotFoundError:
+                # log removed, wait for it to come back
+                await watcher.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error tailing log file: {e}")
+                await asyncio.sleep(1)
+    finally:
+        watcher.close()
+        os.close(fd)
+        index.close()